@@ -0,0 +1,11 @@
+
+"""
+Benchmarks for measuring how the ucode compiler scales with program size.
+Run them from the root of the repository, for example:
+
+    python3 -m bench.coalesce
+    python3 -m bench.simulate
+    python3 -m bench.batch
+    python3 -m bench.scaling
+    python3 -m bench.memory
+"""
@@ -0,0 +1,105 @@
+"""
+Compares a batched NumPy simulation of many independent lanes against
+simulating each lane on its own, using a sweep of the fibonacci example
+over every value of its 8-bit input n.
+"""
+
+import sys
+import time
+import argparse
+
+import numpy
+
+import pyucode as ucode
+
+PROGRAM = "examples/fibonacci/fibonacci-program.txt"
+
+
+def build_resolver(prog_path):
+    """
+    Parse and resolve the program at prog_path, with coalescing.
+    """
+    program = ucode.UCProgram()
+    program.parseSource(prog_path)
+
+    resolver = ucode.UCResolver()
+    resolver.addVariables(program.variables)
+    resolver.addInstructions(program.instructions)
+    resolver.addProgram(program)
+    resolver.enable_coalescing = True
+    resolver.resolve()
+    return resolver
+
+
+def run_batch(resolver, n, max_cycles):
+    """
+    Simulate one lane per value of n together. Returns a tuple of the time
+    taken, the per-lane cycle counts and the per-lane results.
+    """
+    start = time.perf_counter()
+    sim   = ucode.UCBatchSimulator(resolver, len(n))
+    sim.set_inputs({"n": n, "valid": 1})
+    sim.run(max_cycles, until = lambda s: s.values["done"] == 1)
+    taken = time.perf_counter() - start
+    return (taken, list(sim.cycles), [int(r) for r in sim.values["result"]])
+
+
+def run_serial(resolver, n, max_cycles):
+    """
+    Simulate each value of n one after another with the compiled scalar
+    simulator.
+    """
+    start   = time.perf_counter()
+    sim     = ucode.UCCompiledSimulator(resolver)
+    cycles  = []
+    results = []
+    for value in n:
+        sim.reset()
+        sim.set_inputs({"n": int(value), "valid": 1})
+        cycles.append(sim.run(max_cycles,
+                              until = lambda s: s.values["done"] == 1))
+        results.append(sim.values["result"])
+    taken = time.perf_counter() - start
+    return (taken, cycles, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lanes", type=int, nargs="+",
+        default=[256, 1024, 4096, 16384],
+        help="Number of lanes in each sweep. Lane i computes n = i %% 256.")
+    parser.add_argument("--serial-limit", type=int, default=4096,
+        help="Largest sweep to also simulate one lane at a time.")
+    parser.add_argument("--max-cycles", type=int, default=100000,
+        help="Maximum number of cycles to simulate each lane for.")
+    args = parser.parse_args()
+
+    resolver = build_resolver(PROGRAM)
+
+    print("%8s %10s %10s %12s %8s %6s" % ("lanes", "batch/s", "serial/s",
+        "lane-cyc/s", "speedup", "same"))
+
+    for lanes in args.lanes:
+        n = numpy.arange(lanes) % 256
+        batch_time, batch_cycles, batch_results = run_batch(resolver, n,
+            args.max_cycles)
+        rate = sum(batch_cycles) / batch_time
+
+        serial_col, speed_col, same_col = "-", "-", "-"
+        if(lanes <= args.serial_limit):
+            serial_time, serial_cycles, serial_results = run_serial(
+                resolver, n, args.max_cycles)
+            serial_col = "%.3f" % serial_time
+            speed_col  = "%.1fx" % (serial_time / batch_time)
+            same_col   = "yes" if (serial_cycles == batch_cycles and
+                                   serial_results == batch_results) else "NO"
+
+        print("%8d %10.3f %10s %12.0f %8s %6s" % (lanes, batch_time,
+            serial_col, rate, speed_col, same_col))
+        sys.stdout.flush()
+
+    return 0
+
+
+if(__name__ == "__main__"):
+    sys.exit(main())
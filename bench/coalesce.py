@@ -0,0 +1,224 @@
+
+"""
+Compares the worklist block coalescer in UCResolver against the original
+recursive, restart-after-every-merge implementation on synthetic programs
+of increasing size.
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import pyucode as ucode
+
+INSTRUCTIONS = """
+// Increment a variable by a constant value
+define inc
+    argument variable var
+    argument constant increment
+begin
+    var = var + increment
+end
+"""
+
+
+def write_program(directory, num_blocks, num_vars):
+    """
+    Write a synthetic program with num_blocks single statement blocks to
+    directory and return its path. Blocks form a long goto chain which
+    increments the variables in turn, so runs of num_vars blocks can be
+    coalesced before a write-after-write hazard stops the merge. Every
+    sixteenth block branches back to main, which also splits the chain.
+    """
+    instr_path = os.path.join(directory, "bench-instrs.txt")
+    prog_path  = os.path.join(directory, "bench-program.txt")
+
+    with open(instr_path, "w") as fh:
+        fh.write(INSTRUCTIONS)
+
+    with open(prog_path, "w") as fh:
+        fh.write('using instructions "bench-instrs.txt"\n\n')
+        for v in range(0, num_vars):
+            fh.write("reg v%d [7:0]\n" % v)
+
+        for b in range(0, num_blocks):
+            name   = "main" if b == 0 else "b%d" % b
+            target = "main" if b == num_blocks - 1 else "b%d" % (b + 1)
+            fh.write("\nblock %s\n" % name)
+            fh.write("    inc v%d 1\n" % (b % num_vars))
+            if(b % 16 == 15):
+                fh.write("    ifeqz v%d main\n" % (b % num_vars))
+            fh.write("    goto %s\n" % target)
+
+    return prog_path
+
+
+def build_resolver(prog_path):
+    """
+    Parse and resolve the program at prog_path, without coalescing.
+    """
+    program = ucode.UCProgram()
+    program.parseSource(prog_path)
+
+    resolver = ucode.UCResolver()
+    resolver.addVariables(program.variables)
+    resolver.addInstructions(program.instructions)
+    resolver.addProgram(program)
+    resolver.resolve()
+    return resolver
+
+
+def legacy_coalesce_program(resolver):
+    """
+    The original coalescing algorithm: after every merge it removes
+    unreachable blocks and recurses to restart the scan from the first
+    block, finding predecessors with a scan of the whole program.
+    """
+    changes = 0
+    blocks  = resolver.program.blocks
+
+    for i in range(0, len(blocks)):
+        block = blocks[i]
+
+        inset   = legacy_incoming_blocks(resolver, block)
+        outset  = legacy_outgoing_blocks(block)
+
+        if(block.name == "main"):
+            continue
+
+        if(len(inset) + len(outset) == 0):
+            block.removable = not block.gets_dereferenced
+            continue
+
+        reads, writes = block.read_write_sets()
+
+        if(len(outset) == 1):
+            candidate = outset[0]
+            cin       = legacy_incoming_blocks(resolver, candidate)
+            crd, cwr  = candidate.read_write_sets()
+
+            if(len(cin) > 1): continue
+            if(not crd.isdisjoint(writes)): continue
+            if(not cwr.isdisjoint(writes)): continue
+
+            block.statements     += candidate.statements
+            block.flow_change     = candidate.flow_change
+            block.src_statements += candidate.src_statements
+            block.invalidate_read_write_sets()
+            for other in resolver.program.blocks:
+                for fc in other.flow_change:
+                    if(fc.target == candidate):
+                        fc.target = block
+
+            candidate.removable = not candidate.gets_dereferenced
+            if(candidate.removable):
+                changes += 1
+                break
+
+    if(changes > 0):
+        legacy_remove_unreachable_blocks(resolver)
+        changes = legacy_coalesce_program(resolver)
+
+    return changes
+
+
+def legacy_incoming_blocks(resolver, block):
+    """
+    Scan every flow change in the program for ones which target block.
+    """
+    tr = []
+    for b in resolver.program.blocks:
+        for flowchange in b.flow_change:
+            if flowchange.target == block:
+                tr.append(b)
+    return tr
+
+
+def legacy_outgoing_blocks(block):
+    """
+    Return the targets of every flow change at the end of block which jumps
+    to another block.
+    """
+    return [fc.target for fc in block.flow_change
+            if type(fc.target) == ucode.UCProgramBlock]
+
+
+def legacy_remove_unreachable_blocks(resolver):
+    """
+    The original quadratic unreachable block removal.
+    """
+    newlist = []
+    for block in resolver.program.blocks:
+        inset  = legacy_incoming_blocks(resolver, block)
+        outset = legacy_outgoing_blocks(block)
+        if(not (len(inset) + len(outset) == 0 or block.removable)):
+            newlist.append(block)
+    resolver.program.blocks = newlist
+
+
+def run_worklist(resolver):
+    resolver.coalesce_program()
+    resolver.remove_unreachable_blocks()
+
+
+def run_legacy(resolver):
+    legacy_coalesce_program(resolver)
+    legacy_remove_unreachable_blocks(resolver)
+
+
+def time_coalesce(prog_path, runner):
+    """
+    Resolve the program at prog_path and time only the coalescing step.
+    Returns a tuple of (seconds, list of (block name, statement count))
+    or (None, reason) if the runner failed.
+    """
+    resolver = build_resolver(prog_path)
+    start    = time.perf_counter()
+    try:
+        runner(resolver)
+    except RecursionError:
+        return (None, "recursion limit")
+    elapsed  = time.perf_counter() - start
+    shape    = [(b.name, len(b.statements)) for b in resolver.program.blocks]
+    return (elapsed, shape)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+",
+        default=[100, 200, 400, 800, 10000, 100000],
+        help="Number of blocks in each synthetic program.")
+    parser.add_argument("--vars", type=int, default=8,
+        help="Number of program variables the blocks cycle through.")
+    parser.add_argument("--legacy-limit", type=int, default=800,
+        help="Largest program size to run the original algorithm on.")
+    args = parser.parse_args()
+
+    print("%8s %12s %12s %8s" % ("blocks","worklist/s","original/s","same"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            prog_path = write_program(directory, size, args.vars)
+
+            new_time, new_shape = time_coalesce(prog_path, run_worklist)
+
+            old_col  = "-"
+            same_col = "-"
+            if(size <= args.legacy_limit):
+                old_time, old_shape = time_coalesce(prog_path, run_legacy)
+                if(old_time == None):
+                    old_col = old_shape
+                else:
+                    old_col  = "%.4f" % old_time
+                    same_col = "yes" if old_shape == new_shape else "NO"
+
+            print("%8d %12.4f %12s %8s" % (size, new_time, old_col, same_col))
+            sys.stdout.flush()
+
+    return 0
+
+
+if(__name__ == "__main__"):
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Writes synthetic instruction libraries and programs of any size, for
+finding out how the compiler scales. Every generated program parses and
+resolves cleanly, and the same arguments and seed always give the same
+files. Run it on its own to write a program for a closer look:
+
+    python3 -m bench.generate work/synthetic --statements 10000
+"""
+
+import os
+import sys
+import random
+import argparse
+
+# Operators used in the statements of generated instructions.
+OPERATORS = ["+", "-", "^", "&", "|"]
+
+
+def write_library(directory, num_instrs, seed = 0):
+    """
+    Write an instruction library with num_instrs instructions to directory
+    and return its path. Instruction i is called op<i>, takes a variable to
+    write, a variable to read and a constant, and has between one and three
+    statements, all of which write the first variable.
+    """
+    rng  = random.Random(seed)
+    path = os.path.join(directory, "synthetic-instrs.txt")
+
+    with open(path, "w") as fh:
+        for i in range(0, num_instrs):
+            fh.write("\n// Synthetic instruction %d\n" % i)
+            fh.write("define op%d\n" % i)
+            fh.write("    argument variable a\n")
+            fh.write("    argument variable b\n")
+            fh.write("    argument constant c\n")
+            fh.write("begin\n")
+            statements = rng.randint(1, 3)
+            for s in range(0, statements):
+                source = "b" if s == 0 else "a"
+                fh.write("    a = %s %s c %s %s\n" % (source,
+                    rng.choice(OPERATORS), rng.choice(OPERATORS),
+                    "b" if s % 2 == 0 else "a"))
+            fh.write("end\n")
+
+    return path
+
+
+def write_program(directory, num_statements, statements_per_block = 4,
+                  num_vars = 16, branch_density = 0.25, include_depth = 0,
+                  num_instrs = 16, seed = 0):
+    """
+    Write a synthetic program of about num_statements instruction statements
+    to directory and return the path of its top level file.
+
+    Blocks of statements_per_block statements form a chain which ends by
+    going back to main. Each statement of a block writes a different one of
+    num_vars variables, so no block writes a variable twice. A fraction
+    branch_density of the blocks also branch to a random other block if a
+    variable is zero. With an include_depth above zero, the blocks are
+    split evenly between a chain of that many subprogram files, each
+    included by the one before it.
+    """
+    rng        = random.Random(seed)
+    per_block  = max(1, min(statements_per_block, num_vars))
+    num_blocks = max(1, (num_statements + per_block - 1) // per_block)
+    num_files  = include_depth + 1
+
+    write_library(directory, num_instrs, seed)
+
+    names = ["main"] + ["b%d" % b for b in range(1, num_blocks)]
+    paths = [os.path.join(directory, "synthetic-program.txt")] + \
+            [os.path.join(directory, "synthetic-sub%d.txt" % f)
+             for f in range(1, num_files)]
+
+    per_file = (num_blocks + num_files - 1) // num_files
+    block    = 0
+    for f, path in enumerate(paths):
+        with open(path, "w") as fh:
+            if(f == 0):
+                fh.write('using instructions "synthetic-instrs.txt"\n')
+            if(f + 1 < num_files):
+                fh.write('using subprogram "%s"\n' %
+                    os.path.basename(paths[f + 1]))
+            fh.write("\n")
+
+            if(f == 0):
+                fh.write("output reg result [7:0]\n")
+                for v in range(0, num_vars):
+                    fh.write("reg v%d [7:0]\n" % v)
+            else:
+                # Every file needs a declaration before its blocks.
+                fh.write("reg s%d [7:0]\n" % f)
+
+            last = min(num_blocks, block + per_file)
+            while(block < last):
+                fh.write("\nblock %s\n" % names[block])
+                for s in range(0, per_block):
+                    dest = (block * per_block + s) % num_vars
+                    src  = rng.randrange(0, num_vars)
+                    fh.write("    op%d v%d v%d %d\n" % (
+                        rng.randrange(0, num_instrs), dest, src,
+                        rng.randrange(1, 256)))
+                if(num_blocks > 1 and rng.random() < branch_density):
+                    fh.write("    ifeqz v%d %s\n" % (
+                        rng.randrange(0, num_vars), rng.choice(names)))
+                block += 1
+                target = names[block] if block < num_blocks else "main"
+                fh.write("    goto %s\n" % target)
+
+    return paths[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory",
+        help="Directory to write the program and instructions to.")
+    parser.add_argument("--statements", type=int, default=1000,
+        help="Number of instruction statements in the program.")
+    parser.add_argument("--per-block", type=int, default=4,
+        help="Number of statements in each block.")
+    parser.add_argument("--vars", type=int, default=16,
+        help="Number of program variables.")
+    parser.add_argument("--branch-density", type=float, default=0.25,
+        help="Fraction of blocks which end with a conditional branch.")
+    parser.add_argument("--include-depth", type=int, default=0,
+        help="Number of nested subprogram files to split the blocks over.")
+    parser.add_argument("--instrs", type=int, default=16,
+        help="Number of instructions in the instruction library.")
+    parser.add_argument("--seed", type=int, default=0,
+        help="Seed of the random choices.")
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    path = write_program(args.directory, args.statements, args.per_block,
+                         args.vars, args.branch_density, args.include_depth,
+                         args.instrs, args.seed)
+    print(path)
+    return 0
+
+
+if(__name__ == "__main__"):
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Measures how much memory compiled cores hold on to, for processes which
+keep several of them loaded at once. Synthetic programs of increasing size
+are parsed and resolved, and the memory still allocated afterwards is
+traced, along with the number of blocks, flow changes, variables and
+instruction uses it holds and the shallow size of one of each.
+
+    python3 -m bench.memory --sizes 1000 10000 --cores 4
+"""
+
+import gc
+import sys
+import argparse
+import tempfile
+import tracemalloc
+
+import pyucode as ucode
+
+from bench.generate import write_program
+
+
+def compile_core(prog_path, coalesce):
+    """
+    Parse and resolve the program at prog_path, and return the resolver.
+    """
+    program = ucode.UCProgram()
+    program.parseSource(prog_path)
+
+    resolver = ucode.UCResolver()
+    resolver.addVariables(program.variables)
+    resolver.addInstructions(program.instructions)
+    resolver.addProgram(program)
+    resolver.enable_coalescing = coalesce
+    resolver.resolve()
+    return resolver
+
+
+def count_objects(resolver):
+    """
+    Return a dict of the number of objects of each kind a resolver holds,
+    along with one example of each.
+    """
+    blocks = resolver.program.blocks
+    flows  = [fc for b in blocks for fc in b.flow_change]
+    instrs = dict((id(i), i) for b in blocks for i in b.statements)
+    return {
+        "blocks"       : (len(blocks), blocks[0] if blocks else None),
+        "flow_changes" : (len(flows), flows[0] if flows else None),
+        "variables"    : (len(resolver.variables.by_index),
+                          resolver.variables.by_index[0]),
+        "instructions" : (len(instrs), next(iter(instrs.values()), None)),
+    }
+
+
+def shallow_size(obj):
+    """
+    Return the bytes taken by an object itself, including its attribute
+    dict if it has one, but not the values of its attributes.
+    """
+    tr = sys.getsizeof(obj)
+    if(hasattr(obj, "__dict__")):
+        tr += sys.getsizeof(obj.__dict__)
+    return tr
+
+
+def measure(prog_path, cores, coalesce):
+    """
+    Compile cores copies of the program at prog_path and keep them all.
+    Returns a tuple of the bytes they hold between them and the object
+    counts of one of them.
+    """
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    kept   = [compile_core(prog_path, coalesce) for c in range(0, cores)]
+    gc.collect()
+    held   = tracemalloc.get_traced_memory()[0] - before
+    return (held, count_objects(kept[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+",
+        default=[100, 1000, 10000],
+        help="Number of statements in each synthetic program.")
+    parser.add_argument("--cores", type=int, default=4,
+        help="Number of compiled copies of each program to keep at once.")
+    parser.add_argument("--coalesce", action="store_true",
+        help="Coalesce the programs as they are compiled.")
+    parser.add_argument("--seed", type=int, default=0,
+        help="Seed of the random choices.")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+
+    print("%10s %12s %14s %8s %8s %8s %8s" % ("statements", "held(MB)",
+        "per stmt(B)", "blocks", "flows", "vars", "instrs"))
+
+    example = None
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            prog_path = write_program(directory, size, seed = args.seed)
+            held, counts = measure(prog_path, args.cores, args.coalesce)
+            example = counts
+            print("%10d %12.2f %14.1f %8d %8d %8d %8d" % (size, held / 1e6,
+                held / float(size * args.cores),
+                counts["blocks"][0], counts["flow_changes"][0],
+                counts["variables"][0], counts["instructions"][0]))
+            sys.stdout.flush()
+
+    tracemalloc.stop()
+
+    print()
+    print("%-14s %10s" % ("object", "bytes"))
+    for kind, (count, obj) in example.items():
+        if(obj != None):
+            print("%-14s %10d" % (kind, shallow_size(obj)))
+
+    return 0
+
+
+if(__name__ == "__main__"):
+    sys.exit(main())
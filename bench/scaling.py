@@ -0,0 +1,263 @@
+"""
+Times each step of a compile on synthetic programs from 10 up to a million
+statements, and reports how the time of each step grows with the size of
+the program. Results can be saved as a baseline, and later runs compared
+against it to catch steps which got slower:
+
+    python3 -m bench.scaling --save-baseline bench/baseline.json
+    python3 -m bench.scaling --baseline bench/baseline.json
+
+Once a step takes longer than --max-seconds it is not run on any larger
+program, so super-linear steps do not stop the others being measured.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+
+import pyucode as ucode
+
+from bench.generate import write_program
+
+# The steps timed, in the order they are run.
+STEPS = ["parse", "resolve", "resolve_coalesce", "render", "instrdocs",
+         "progdocs", "flowgraph"]
+
+# Steps which can only run if the given step ran.
+NEEDS = {
+    "resolve_coalesce" : "resolve",
+    "render"           : "resolve_coalesce",
+    "instrdocs"        : "resolve_coalesce",
+    "progdocs"         : "resolve_coalesce",
+    "flowgraph"        : "resolve_coalesce",
+}
+
+
+def build_resolver(prog_path, coalesce):
+    """
+    Parse the program at prog_path and return an unresolved resolver for
+    it.
+    """
+    program = ucode.UCProgram()
+    program.parseSource(prog_path)
+
+    resolver = ucode.UCResolver()
+    resolver.addVariables(program.variables)
+    resolver.addInstructions(program.instructions)
+    resolver.addProgram(program)
+    resolver.enable_coalescing = coalesce
+    return resolver
+
+
+def timed(function):
+    """
+    Call function and return a tuple of the seconds it took and its result.
+    """
+    start  = time.perf_counter()
+    result = function()
+    return (time.perf_counter() - start, result)
+
+
+def time_steps(directory, prog_path, skip):
+    """
+    Time every step not in skip on the program at prog_path. Returns a dict
+    mapping each step which ran onto the seconds it took.
+    """
+    tr = {}
+
+    def run(step, function):
+        need = NEEDS.get(step, None)
+        if(step in skip or (need != None and not need in tr)):
+            return None
+        seconds, result = timed(function)
+        tr[step] = seconds
+        return result
+
+    def parse():
+        program = ucode.UCProgram()
+        program.parseSource(prog_path)
+        return program
+
+    run("parse", parse)
+    run("resolve",
+        lambda: build_resolver(prog_path, False).resolve())
+
+    resolver = build_resolver(prog_path, True)
+    run("resolve_coalesce", resolver.resolve)
+    if(not "resolve_coalesce" in tr):
+        return tr
+
+    output = os.path.join(directory, "out")
+    run("render",
+        lambda: ucode.UCTemplater(resolver).renderTo(output + ".v"))
+    run("instrdocs",
+        lambda: ucode.UCInstructionDocGen(resolver.instrs).renderTo(
+            output + "-instrs.html"))
+    progdocs = ucode.UCProgramDocgen(resolver)
+    run("progdocs",
+        lambda: progdocs.gen_program_docs(output + "-prog.html"))
+    run("flowgraph",
+        lambda: progdocs.gen_flow_dot_graph(output + ".dot"))
+
+    return tr
+
+
+def exponent(results, step, sizes):
+    """
+    Return the slope of log(seconds) against log(statements) between the
+    two largest sizes a step ran on, which is about 1 for linear steps and
+    2 for quadratic ones. Returns None if the step ran on fewer than two
+    sizes, or was too quick to measure.
+    """
+    points = [(s, results[s][step]) for s in sizes
+              if step in results.get(s, {}) and results[s][step] > 1e-3]
+    if(len(points) < 2):
+        return None
+    (s0, t0), (s1, t1) = points[-2], points[-1]
+    return math.log(t1 / t0) / math.log(s1 / s0)
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    """
+    Return a list of messages describing every step which is more than
+    tolerance times slower than the baseline for a size both ran, ignoring
+    times under min_seconds.
+    """
+    tr = []
+    for size, steps in results.items():
+        old_steps = baseline.get(str(size), {})
+        for step, seconds in steps.items():
+            old = old_steps.get(step, None)
+            if(old == None or seconds < min_seconds):
+                continue
+            if(seconds > old * tolerance):
+                tr.append("%s at %d statements took %.3fs, baseline %.3fs" %
+                    (step, size, seconds, old))
+    return tr
+
+
+def write_table(results, sizes, fh):
+    """
+    Write the seconds each step took at each size, and its growth exponent,
+    as a table.
+    """
+    fh.write("%10s" % "statements")
+    for step in STEPS:
+        fh.write(" %16s" % step)
+    fh.write("\n")
+
+    for size in sizes:
+        fh.write("%10d" % size)
+        for step in STEPS:
+            seconds = results.get(size, {}).get(step, None)
+            fh.write(" %16s" % ("-" if seconds == None else "%.4f" % seconds))
+        fh.write("\n")
+
+    fh.write("%10s" % "exponent")
+    for step in STEPS:
+        e = exponent(results, step, sizes)
+        fh.write(" %16s" % ("-" if e == None else "%.2f" % e))
+    fh.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+",
+        default=[10, 100, 1000, 10000, 100000, 1000000],
+        help="Number of statements in each synthetic program.")
+    parser.add_argument("--per-block", type=int, default=4,
+        help="Number of statements in each block.")
+    parser.add_argument("--vars", type=int, default=16,
+        help="Number of program variables.")
+    parser.add_argument("--branch-density", type=float, default=0.25,
+        help="Fraction of blocks which end with a conditional branch.")
+    parser.add_argument("--include-depth", type=int, default=0,
+        help="Number of nested subprogram files to split the blocks over.")
+    parser.add_argument("--instrs", type=int, default=16,
+        help="Number of instructions in the instruction library.")
+    parser.add_argument("--seed", type=int, default=0,
+        help="Seed of the random choices.")
+    parser.add_argument("--repeat", type=int, default=1,
+        help="Run each size this many times and keep the quickest times.")
+    parser.add_argument("--max-seconds", type=float, default=60,
+        help="Stop running a step on larger programs once it takes longer\
+        than this.")
+    parser.add_argument("--baseline", default=None,
+        help="JSON file written by --save-baseline to compare against.")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+        help="Report steps which are more than this many times slower than\
+        the baseline.")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+        help="Ignore steps quicker than this when comparing.")
+    parser.add_argument("--save-baseline", default=None,
+        help="Write the times of this run to this JSON file.")
+    args = parser.parse_args()
+
+    results = {}
+    skip    = set([])
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            prog_path = write_program(directory, size, args.per_block,
+                args.vars, args.branch_density, args.include_depth,
+                args.instrs, args.seed)
+
+            best = {}
+            for r in range(0, args.repeat):
+                for step, seconds in time_steps(directory, prog_path,
+                                                skip).items():
+                    best[step] = min(seconds, best.get(step, seconds))
+            results[size] = best
+
+            for step, seconds in best.items():
+                if(seconds > args.max_seconds):
+                    skip.add(step)
+
+            print("%10d %s" % (size, " ".join("%s=%.4f" % (s, best[s])
+                for s in STEPS if s in best)))
+            sys.stdout.flush()
+
+    print()
+    write_table(results, args.sizes, sys.stdout)
+
+    options = {
+        "per_block"      : args.per_block,
+        "vars"           : args.vars,
+        "branch_density" : args.branch_density,
+        "include_depth"  : args.include_depth,
+        "instrs"         : args.instrs,
+        "seed"           : args.seed,
+    }
+
+    if(args.save_baseline != None):
+        with open(args.save_baseline, "w") as fh:
+            json.dump({
+                "options" : options,
+                "results" : dict((str(s), r) for s, r in results.items())
+            }, fh, indent=4, sort_keys=True)
+
+    if(args.baseline != None):
+        with open(args.baseline, "r") as fh:
+            baseline = json.load(fh)
+        if(baseline["options"] != options):
+            print("Warning: %s was generated with different options: %s" %
+                (args.baseline, baseline["options"]))
+        regressions = compare(results, baseline["results"], args.tolerance,
+                              args.min_seconds)
+        for message in regressions:
+            print("Regression: %s" % message)
+        if(len(regressions) > 0):
+            return 1
+        print("No step is more than %.1f times slower than %s" %
+            (args.tolerance, args.baseline))
+
+    return 0
+
+
+if(__name__ == "__main__"):
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Compares the throughput of the compiled simulator against the statement
+tree interpreter on the example programs. Both are driven by the same
+random input stimulus, which changes every few cycles, and the final
+variable values are compared to check they agree.
+"""
+
+import sys
+import time
+import random
+import argparse
+
+import pyucode as ucode
+
+EXAMPLES = {
+    "riscv" : "examples/riscv/riscv-program.txt",
+    "dma"   : "examples/dma/dma-program.txt",
+}
+
+
+def build_resolver(prog_path, coalesce):
+    """
+    Parse and resolve the program at prog_path.
+    """
+    program = ucode.UCProgram()
+    program.parseSource(prog_path)
+
+    resolver = ucode.UCResolver()
+    resolver.addVariables(program.variables)
+    resolver.addInstructions(program.instructions)
+    resolver.addProgram(program)
+    resolver.enable_coalescing = coalesce
+    resolver.resolve()
+    return resolver
+
+
+def make_stimulus(sim, seed, period):
+    """
+    Return a stimulus callback which drives every input port with a new
+    random value once every period cycles.
+    """
+    rng   = random.Random(seed)
+    table = [dict((v.name, rng.getrandbits(v.width)) for v in sim.inputs)
+             for i in range(0, 1024)]
+
+    def stimulus(cycle, sim):
+        if(cycle % period != 0):
+            return None
+        return table[(cycle // period) & 1023]
+
+    return stimulus
+
+
+def time_simulation(make_sim, cycles, seed, period, repeat):
+    """
+    Run repeat new simulators from make_sim for the given number of cycles
+    each, and return a tuple of (cycles per second of the quickest run,
+    final variable values).
+    """
+    best = None
+    for r in range(0, repeat):
+        sim          = make_sim()
+        sim.stimulus = make_stimulus(sim, seed, period)
+        start = time.perf_counter()
+        sim.run(cycles)
+        taken = time.perf_counter() - start
+        best  = taken if best == None else min(best, taken)
+    return (cycles / best, dict(sim.values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--examples", nargs="+", default=sorted(EXAMPLES),
+        choices=sorted(EXAMPLES), help="Example programs to simulate.")
+    parser.add_argument("--cycles", type=int, default=200000,
+        help="Number of cycles to simulate with each backend.")
+    parser.add_argument("--period", type=int, default=4,
+        help="Number of cycles between changes of the input ports.")
+    parser.add_argument("--seed", type=int, default=1,
+        help="Seed for the random input stimulus.")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="Run each backend this many times and keep the quickest.")
+    args = parser.parse_args()
+
+    print("%-8s %8s %14s %14s %8s %6s" % ("example", "coalesce",
+        "interpret c/s", "compiled c/s", "speedup", "same"))
+
+    for name in args.examples:
+        for coalesce in [False, True]:
+            resolver = build_resolver(EXAMPLES[name], coalesce)
+
+            start    = time.perf_counter()
+            compiled = ucode.UCCompiledSimulator(resolver)
+            build    = time.perf_counter() - start
+
+            slow, slow_values = time_simulation(
+                lambda: ucode.UCSimulator(resolver),
+                args.cycles, args.seed, args.period, args.repeat)
+            fast, fast_values = time_simulation(
+                lambda: ucode.UCCompiledSimulator(resolver),
+                args.cycles, args.seed, args.period, args.repeat)
+
+            print("%-8s %8s %14.0f %14.0f %7.1fx %6s" % (name,
+                "yes" if coalesce else "no", slow, fast, fast / slow,
+                "yes" if slow_values == fast_values else "NO"))
+            print("%-8s %8s compiled in %.3fs" % ("", "", build))
+            sys.stdout.flush()
+
+    return 0
+
+
+if(__name__ == "__main__"):
+    sys.exit(main())
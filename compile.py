@@ -2,7 +2,9 @@
 
 import os
 import sys
+import json
 import argparse
+import contextlib
 import logging
 
 import pyucode as ucode
@@ -15,6 +17,8 @@ class Program(object):
         """
         self.log = logging.getLogger(__name__)
 
+        # UCStats of each compile phase, if asked for.
+        self.stats = None
 
     def configureLogging(self,args):
         """
@@ -52,24 +56,208 @@ class Program(object):
         parser.add_argument("--opt-coalesce",
             help="Enable coalecsing of blocks to improve performance.",
             action="store_true")
+        parser.add_argument("--opt-schedule",
+            help="Re-order independent instructions within each block to\
+            pack them into fewer states.",
+            action="store_true")
+        parser.add_argument("--opt-unreachable",
+            help="Remove blocks which can never be reached from main. Always\
+            enabled by --opt-coalesce.",
+            action="store_true")
+        parser.add_argument("--opt-thread",
+            help="Re-target jumps through states which do nothing but jump\
+            to another state, and collapse redundant conditional jumps.",
+            action="store_true")
+        parser.add_argument("--opt-ifconvert",
+            help="Merge both arms of short conditional branches into one\
+            state of predicated statements.",
+            action="store_true")
+        parser.add_argument("--max-predicated", type=int, default=2,
+            help="Largest number of statements in each arm of a branch\
+            merged by --opt-ifconvert.")
+        parser.add_argument("--opt-minimise",
+            help="Merge states which always behave the same way into one.",
+            action="store_true")
+        parser.add_argument("--opt-share-regs",
+            help="Store variables which are never live at the same time in\
+            the same register.",
+            action="store_true")
+        parser.add_argument("--opt-share-ops",
+            help="Compute expensive operators used by different states with\
+            shared functional units.",
+            action="store_true")
+        parser.add_argument("--share-min-cost", type=float, default=None,
+            help="Only share operators whose cost class weighs at least\
+            this much. Defaults to the weight of a multiply.")
+        parser.add_argument("--share-min-width", type=int, default=8,
+            help="Only share operators which are at least this many bits\
+            wide.")
+        parser.add_argument("--state-encoding", default="binary",
+            choices=ucode.UCStateEncodings,
+            help="How to encode states. Gray codes follow the hottest\
+            transitions of the --profile, if there is one.")
+        parser.add_argument("--opt-unroll", type=int, default=1,
+            metavar="FACTOR",
+            help="Unroll inner loops this many times, so that coalescing\
+            and scheduling can overlap their iterations.")
+        parser.add_argument("--max-states", type=int, default=None,
+            help="Stop unrolling loops once the program would have more\
+            than this many states.")
+        parser.add_argument("--max-cycle-cost", type=float, default=None,
+            help="Stop coalescing blocks once the estimated critical path\
+            cost of a state would exceed this value.")
+        parser.add_argument("--cost-model",
+            help="YAML file of operator delay weights for the target.",
+            default=None)
+        parser.add_argument("--timing", default=None,
+            help="Write static minimum and maximum cycle counts between\
+            named blocks, loop lengths and acyclic region latencies to this\
+            JSON file.")
+        parser.add_argument("--timing-baseline", default=None,
+            help="JSON file written by --timing for an earlier build. Fail\
+            if any cycle count is now larger.")
+        parser.add_argument("--profile", default=None,
+            help="Block visit counts used to guide optimisation. Either a\
+            JSON file written by --profile-out, or a VCD file such as\
+            work/waves.vcd which dumps the _current_state_ register.")
+        parser.add_argument("--profile-design", default=None,
+            help="The generated verilog of the design a VCD --profile was\
+            dumped from, whose state encodings are used to decode it. By\
+            default the design is assumed to have been built with the same\
+            options as this one.")
+        parser.add_argument("--profile-report", default=None,
+            help="Write the cycles of the --profile spent in each state and\
+            on each source line to this file. Written as JSON if the path\
+            ends in .json, and as text otherwise.")
+        parser.add_argument("--profile-out", default=None,
+            help="Write the block visit counts of a --simulate run to this\
+            JSON file.")
+        parser.add_argument("--simulate", type=int, default=None,
+            metavar="CYCLES",
+            help="Simulate the compiled program for this many cycles.")
+        parser.add_argument("--stimulus", default=None,
+            help="File of input port values to drive when --simulate is set.")
+        parser.add_argument("--trace", default=None,
+            help="Write a trace of output port values to this file when\
+            --simulate is set. Use '-' for stdout.")
+        parser.add_argument("--sim-interpret", action="store_true",
+            help="Simulate by interpreting statements rather than compiling\
+            the program into python functions. Much slower.")
+        parser.add_argument("--timings", default=None,
+            help="Write the wall time, CPU time, peak memory and program\
+            size of each compile phase to this file as text. Use '-' for\
+            stdout.")
+        parser.add_argument("--stats-json", default=None,
+            help="Write the same per-phase statistics as --timings to this\
+            JSON file.")
+        parser.add_argument("--cprofile", default=None,
+            help="Profile each compile phase with cProfile, and write the\
+            profile of the phase which took longest to this file.")
+        parser.add_argument("--cprofile-phase", default=None,
+            metavar="PHASE",
+            help="Write the profile of this named phase to --cprofile\
+            rather than that of the slowest phase.")
         parser.add_argument("--verbose", "-v", action="store_true",
             help="Be verbose when displaying messages")
 
         args = parser.parse_args()
         return args
 
-    def main(self):
+    def simulate(self, args, resolver):
         """
-        Main entry point for the program
+        Run the resolved program in the cycle accurate simulator.
         """
-        args = self.parseArguments()
-        self.configureLogging(args)
+        self.log.info("> Simulating %d cycles" % args.simulate)
 
-        self.log.info("---------- uCode Compiler ----------")
+        if(args.sim_interpret):
+            sim = ucode.UCSimulator(resolver)
+        else:
+            sim = ucode.UCCompiledSimulator(resolver)
+        if(args.stimulus != None):
+            sim.stimulus = ucode.UCSimStimulus(args.stimulus)
+        if(args.profile_out != None):
+            sim.profile = ucode.UCProfile()
+
+        if(args.trace == "-"):
+            sim.trace = sys.stdout
+            sim.run(args.simulate)
+        elif(args.trace != None):
+            with open(args.trace, "w") as fh:
+                sim.trace = fh
+                sim.run(args.simulate)
+        else:
+            sim.run(args.simulate)
+
+        self.log.info("> Finished in state %s after %d cycles" %
+            (sim.state_name(), sim.cycle))
+
+        if(sim.profile != None):
+            self.log.info("> Writing profile to %s" % args.profile_out)
+            sim.profile.save(args.profile_out)
+
+    def check_timing(self, args, resolver):
+        """
+        Write the static timing analysis, and compare it against a baseline.
+        Returns False if any cycle count got worse.
+        """
+        timing = ucode.UCTimingAnalysis(resolver)
+
+        if(args.timing != None):
+            self.log.info("> Writing timing analysis to %s" % args.timing)
+            timing.save(args.timing)
+
+        if(args.timing_baseline != None):
+            self.log.info("> Comparing timing against %s" %
+                args.timing_baseline)
+            with open(args.timing_baseline, "r") as fh:
+                baseline = json.load(fh)
+            regressions = timing.compare(baseline)
+            for message in regressions:
+                self.log.error("Timing regression: %s" % message)
+            return len(regressions) == 0
+
+        return True
+
+    def load_profile(self, args):
+        """
+        Load the profile named by the --profile argument. VCD state
+        encodings are read from the --profile-design verilog and mapped
+        back to the blocks of the parsed program if it is given. Otherwise
+        they are found by building the program with the same options, but
+        without a profile.
+        """
+        self.log.info("> Loading profile %s" % args.profile)
+        profile = ucode.UCProfile()
+        if(args.profile.endswith(".vcd") and args.profile_design != None):
+            encodings = profile.read_design_encodings(args.profile_design)
+            profile.load_vcd(args.profile, self.parse(args),
+                             encodings = encodings)
+        elif(args.profile.endswith(".vcd")):
+            self.log.info("> Building the profiled design to decode states")
+            reference = self.build(args)
+            profile.load_vcd(args.profile, reference.program)
+        else:
+            profile.load(args.profile)
+        self.log.info("> Profile covers %d cycles" % profile.cycles)
+        return profile
+
+    def parse(self, args):
+        """
+        Parse the program named by the arguments and return it.
+        """
         self.log.info("> Loading sources")
 
         program = ucode.UCProgram()
-        program.parseSource(args.program)
+        with self.phase("parse"):
+            program.parseSource(args.program)
+        return program
+
+    def build(self, args, profile = None):
+        """
+        Parse the program and resolve it with the optimisations chosen by
+        the arguments. Returns the resolver.
+        """
+        program = self.parse(args)
         
         self.log.info("> Resolving objects")
 
@@ -78,31 +266,132 @@ class Program(object):
         resolver.addInstructions(program.instructions)
         resolver.addProgram(program)
         resolver.enable_coalescing = args.opt_coalesce
-        resolver.resolve()
+        resolver.enable_unreachable_removal = args.opt_unreachable
+        resolver.enable_scheduling = args.opt_schedule
+        resolver.enable_threading  = args.opt_thread
+        resolver.enable_minimisation = args.opt_minimise
+        resolver.enable_register_sharing = args.opt_share_regs
+        resolver.enable_operator_sharing = args.opt_share_ops
+        resolver.share_min_width = args.share_min_width
+        resolver.enable_if_conversion      = args.opt_ifconvert
+        resolver.max_predicated_statements = args.max_predicated
+        resolver.max_cycle_cost = args.max_cycle_cost
+        resolver.unroll_factor  = args.opt_unroll
+        resolver.max_states     = args.max_states
+        resolver.state_encoding = args.state_encoding
+        if(args.cost_model != None):
+            resolver.cost_model.load(args.cost_model)
+        if(args.share_min_cost != None):
+            resolver.share_min_cost = args.share_min_cost
+        resolver.profile = profile
+        resolver.stats   = self.stats
+        with self.phase("resolve", resolver.counters):
+            resolver.resolve()
+        return resolver
+
+    def phase(self, name, counters = None):
+        """
+        Return a context manager which records the code run inside it as a
+        phase of the compile, if statistics were asked for.
+        """
+        if(self.stats == None):
+            return contextlib.nullcontext()
+        return self.stats.phase(name, counters)
+
+    def save_stats(self, args):
+        """
+        Write the per-phase statistics and the profile asked for by the
+        arguments.
+        """
+        if(args.timings != None):
+            self.log.info("> Writing phase timings to %s" % args.timings)
+            self.stats.save_text(args.timings)
+        if(args.stats_json != None):
+            self.log.info("> Writing phase statistics to %s" % args.stats_json)
+            self.stats.save_json(args.stats_json)
+        if(args.cprofile != None):
+            phase = self.stats.save_profile(args.cprofile, args.cprofile_phase)
+            if(phase != None):
+                self.log.info("> Wrote profile of phase '%s' to %s" %
+                    (phase.name, args.cprofile))
+
+    def main(self):
+        """
+        Main entry point for the program
+        """
+        args = self.parseArguments()
+        self.configureLogging(args)
+
+        self.log.info("---------- uCode Compiler ----------")
+
+        if(args.timings != None or args.stats_json != None or
+           args.cprofile != None):
+            self.stats = ucode.UCStats(
+                memory    = args.timings != None or args.stats_json != None,
+                profiling = args.cprofile != None)
+
+        profile = None
+        if(args.profile != None):
+            with self.phase("load profile"):
+                profile = self.load_profile(args)
+
+        try:
+            resolver = self.build(args, profile)
+        except ucode.UCResolverError as e:
+            self.log.error(str(e))
+            return 1
         
         self.log.info("> Rendering template to %s" % args.output)
 
-        renderer = ucode.UCTemplater(resolver)
-        renderer.debug_states = args.debug_states
-        renderer.renderTo(args.output)
+        with self.phase("render"):
+            renderer = ucode.UCTemplater(resolver)
+            renderer.debug_states = args.debug_states
+            renderer.renderTo(args.output)
         
         # Generate per-program documentation
         progdocs = ucode.UCProgramDocgen(resolver)
 
         if(args.gendocs):
-            self.log.info("> Rendering instruction documentation to %s" % args.instrdocs)
-            dg = ucode.UCInstructionDocGen(resolver.instrs)
-            dg.renderTo(args.instrdocs)
-            
-            self.log.info("> Rendering program documentation to %s" % args.progdocs)
-            progdocs.gen_program_docs(args.progdocs)
+            with self.phase("docs"):
+                self.log.info("> Rendering instruction documentation to %s" % args.instrdocs)
+                dg = ucode.UCInstructionDocGen(resolver.instrs)
+                dg.renderTo(args.instrdocs)
+                
+                self.log.info("> Rendering program documentation to %s" % args.progdocs)
+                progdocs.gen_program_docs(args.progdocs)
         
         if(args.flowgraph):
             self.log.info("> Writing flow graph to '%s'" % args.graphpath)
-            progdocs.gen_flow_dot_graph(args.graphpath)
+            with self.phase("flowgraph"):
+                progdocs.gen_flow_dot_graph(args.graphpath, resolver.profile)
+
+        if(args.profile_report != None):
+            if(resolver.profile == None):
+                self.log.error("--profile-report needs a --profile to report on")
+            else:
+                self.log.info("> Writing profile report to %s" %
+                    args.profile_report)
+                with self.phase("profile report"):
+                    report = ucode.UCProfileReport(resolver.profile,
+                                                   resolver.program)
+                    report.save(args.profile_report)
         
+        result = 0
+        if(args.timing != None or args.timing_baseline != None):
+            with self.phase("timing"):
+                timing_ok = self.check_timing(args, resolver)
+            if(not timing_ok):
+                result = 1
+
+        if(args.simulate != None and result == 0):
+            with self.phase("simulate"):
+                self.simulate(args, resolver)
+
+        if(self.stats != None):
+            self.save_stats(args)
+
         self.log.info("> Done")
-        return 0
+        return result
 
 
 if(__name__ == "__main__"):
@@ -0,0 +1,239 @@
+
+"""
+Classes and functions for sharing registers between the variables of a
+resolved program which are never live at the same time.
+"""
+
+import logging
+
+from .UCInstructionStatement import UCInstructionStatement
+
+class UCRegisterAllocator(object):
+    """
+    Stores variables which are never live at the same time in the same
+    register, so the generated module has fewer flip-flops.
+
+    A variable is live on entry to a state if its value may be read before
+    it is next overwritten. Every state reads the values registered at the
+    end of the previous cycle, so a state which reads a variable and then
+    overwrites it still needs its old value. Only assignments to the whole
+    variable, without a predicate, overwrite it.
+
+    Two variables interfere, and need registers of their own, if they are
+    live on entry to the same state, or if one is written by a state which
+    the other is live out of. The interference graph is coloured greedily,
+    most constrained variables first, and each colour becomes one register,
+    named after the first declared variable which uses it.
+
+    Only `reg` variables which are not ports, are both read and written,
+    and are not used by the expression of a `comb` or `const` variable are
+    shared. Variables only share a register if they have the same bit
+    range.
+
+    Jumps to a variable are assumed to be able to reach any block which is
+    de-referenced, or which reads `_current_state_`. Blocks whose flow
+    changes are all conditional may also fall through to main.
+    """
+
+    def __init__(self, resolver):
+        """
+        Create a new register allocator for the program held by a resolver
+        whose instructions have already been resolved.
+        """
+        self.log       = logging.getLogger(__name__)
+        self.resolver  = resolver
+        self.program   = resolver.program
+        self.variables = resolver.variables
+
+        # Maps each variable which was moved onto the variable whose
+        # register it now uses.
+        self.mapping   = {}
+
+        # Number of flip-flops no longer needed.
+        self.saved     = 0
+
+    def successors(self, block):
+        """
+        Return the list of blocks which may run in the cycle after block.
+        """
+        main    = self.program.getBlock("main")
+        tr      = list(self.program.flow_graph.successors(block))
+        if(any(fc.to_variable for fc in block.flow_change)):
+            tr += [b for b in self.program.blocks if b.gets_dereferenced or
+                   self.resolver.reads_current_state(b)]
+        if(main != None and (len(block.flow_change) == 0 or
+                             block.flow_change[-1].conditional)):
+            tr.append(main)
+        return list(dict.fromkeys(tr))
+
+    def uses(self, block):
+        """
+        Return the bitmask of variables whose values block reads.
+        """
+        tr = block.read_write_masks()[0]
+        for fc in block.flow_change:
+            if(fc.to_variable):
+                tr |= fc.target.bit
+        return tr
+
+    def kills(self, block):
+        """
+        Return the bitmask of variables which block always overwrites.
+        """
+        tr = 0
+        for instr in block.statements:
+            if(len(instr.predicate) > 0):
+                continue
+            for statement in instr.statements:
+                for name in statement.overwritten_identifiers():
+                    var = instr.get_variable(name)
+                    if(var != None):
+                        tr |= var.bit
+        return tr
+
+    def liveness(self):
+        """
+        Return a dict mapping each block onto a tuple of the bitmasks of
+        the variables live on entry to it and live out of it.
+        """
+        blocks = self.program.blocks
+        succs  = dict((b, self.successors(b)) for b in blocks)
+        uses   = dict((b, self.uses(b)) for b in blocks)
+        kills  = dict((b, self.kills(b)) for b in blocks)
+
+        live_in  = dict((b, uses[b]) for b in blocks)
+        live_out = dict((b, 0) for b in blocks)
+
+        changed = True
+        while(changed):
+            changed = False
+            for block in reversed(blocks):
+                out = 0
+                for succ in succs[block]:
+                    out |= live_in.get(succ, 0)
+                live_out[block] = out
+                new_in = uses[block] | (out & ~kills[block])
+                if(new_in != live_in[block]):
+                    live_in[block] = new_in
+                    changed        = True
+
+        return dict((b, (live_in[b], live_out[b])) for b in blocks)
+
+    def candidates(self):
+        """
+        Return the list of variables which may share a register.
+        """
+        read    = 0
+        written = 0
+        for block in self.program.blocks:
+            read    |= self.uses(block)
+            written |= block.read_write_masks()[1]
+
+        # Variables used by comb and const expressions are read all the time.
+        wired = set([])
+        for var in self.variables.by_index:
+            if(var.isCombVar() or var.isConstVar()):
+                expr = UCInstructionStatement("_ = %s" % var.comb_expr)
+                if(expr.is_parsed()):
+                    wired.update(expr.read_identifiers())
+
+        return [v for v in self.variables.by_index
+                if v.isRegVar() and not v.isPort() and
+                   v.bit & read and v.bit & written and
+                   not v.name in wired]
+
+    def interference(self, candidates):
+        """
+        Return a dict mapping each candidate variable onto the bitmask of
+        the variables it must not share a register with.
+        """
+        mask = 0
+        for var in candidates:
+            mask |= var.bit
+
+        tr = dict((v, 0) for v in candidates)
+
+        def conflict(a, b):
+            for var in self.variables.getVariablesInMask(a & mask):
+                tr[var] |= b & ~var.bit
+
+        for block, (live_in, live_out) in self.liveness().items():
+            writes = block.read_write_masks()[1]
+            conflict(live_in, live_in)
+            conflict(writes, live_out | writes)
+            conflict(live_out, writes)
+
+        return tr
+
+    def colour(self, candidates, interference):
+        """
+        Return a list of lists of variables which may share a register.
+        """
+        order = sorted(candidates,
+            key = lambda v: (-bin(interference[v]).count("1"), v.id))
+
+        tr = []
+        for var in order:
+            for register in tr:
+                first = register[0]
+                if(first.hi != var.hi or first.lo != var.lo):
+                    continue
+                if(any(interference[var] & other.bit for other in register)):
+                    continue
+                register.append(var)
+                break
+            else:
+                tr.append([var])
+
+        return tr
+
+    def rename(self, instr):
+        """
+        Point the resolved arguments, variables and predicate of an
+        instruction at the variables whose registers they now use.
+        """
+        mapping = self.mapping
+        instr.resolved_args = dict((k, mapping.get(v, v))
+            for k, v in instr.resolved_args.items())
+        instr.resolved_vars = dict((k, mapping.get(v, v))
+            for k, v in instr.resolved_vars.items())
+        instr.predicate     = [(mapping.get(v, v), nonzero)
+                               for v, nonzero in instr.predicate]
+        instr.rw_masks      = None
+        instr.synthesised   = None
+
+    def allocate_program(self):
+        """
+        Share registers between the variables of the program. Returns the
+        number of flip-flops saved.
+        """
+        candidates   = self.candidates()
+        interference = self.interference(candidates)
+
+        for register in self.colour(candidates, interference):
+            register.sort(key = lambda v: v.id)
+            keep = register[0]
+            for var in register[1:]:
+                self.log.info("Variable '%s' shares the register of '%s'" %
+                    (var.name, keep.name))
+                var.shares        = keep
+                self.mapping[var] = keep
+                self.saved       += var.width
+
+        if(len(self.mapping) == 0):
+            return 0
+
+        renamed = set([])
+        for block in self.program.blocks:
+            for instr in block.statements:
+                if(not id(instr) in renamed):
+                    renamed.add(id(instr))
+                    self.rename(instr)
+            for fc in block.flow_change:
+                if(fc.conditional):
+                    fc.variable = self.mapping.get(fc.variable, fc.variable)
+                if(fc.to_variable):
+                    fc.target   = self.mapping.get(fc.target, fc.target)
+            block.invalidate_read_write_sets()
+
+        return self.saved
@@ -0,0 +1,337 @@
+
+"""
+Classes and functions for simulating many independent copies of a program
+at once, using NumPy arrays with one lane per copy.
+"""
+
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .UCSimulator   import UCSimulator
+from .UCSimulator   import mask_of
+from .UCSimCompiler import UCSimCompiler
+
+# Helper functions available to every batch compiled program. DT is the
+# dtype of every variable array, and is set when the module is loaded.
+UCBatchPrelude = '''
+import numpy as np
+
+def _arr(x):
+    return np.asarray(x).astype(DT, copy=False)
+
+def _flag(b):
+    return _arr(b)
+
+def _where(c, a, b):
+    return _arr(np.where(np.asarray(c) != 0, a, b))
+
+def _sgn(x, w):
+    x = _arr(x)
+    if DT == object:
+        return np.array([i - (1 << w) if (i >> (w - 1)) & 1 else i
+                         for i in x], dtype=object)
+    if w == 64:
+        return x.view(np.int64)
+    return x.astype(np.int64) - (((x >> (w - 1)) & 1).astype(np.int64) << w)
+
+def _asr(x, w, n):
+    return _arr(_sgn(x, w) >> n)
+
+def _ext(x, ow, w):
+    x = _arr(x)
+    return _arr(np.where((x >> (ow - 1)) & 1,
+                         x | (((1 << w) - 1) & ~((1 << ow) - 1)), x))
+
+def _bit(x, i):
+    return (_arr(x) >> _arr(i)) & 1
+
+def _put(x, y, hi, lo, tlo, tw):
+    x, y   = _arr(x), _arr(y)
+    hi, lo = np.asarray(hi).astype(np.int64), np.asarray(lo).astype(np.int64)
+    ok = (lo >= tlo) & (hi < tlo + tw) & (hi >= lo)
+    s  = _arr(np.where(ok, lo - tlo, 0))
+    m  = _arr(np.where(ok, _arr((1 << tw) - 1) >> _arr(tw - 1 - (hi - lo)), 0))
+    return _arr(np.where(ok, (x & ~(m << s)) | ((y & m) << s), x))
+
+def _rep(x, w, n):
+    tr = _arr(0)
+    for i in range(n):
+        tr = (tr << w) | x
+    return tr
+
+def _parity(x):
+    x = _arr(x)
+    if DT == object:
+        return np.array([bin(i).count('1') & 1 for i in x], dtype=object)
+    if hasattr(np, "bitwise_count"):
+        return _arr(np.bitwise_count(x) & 1)
+    # numpy before 2.0 has no bitwise_count, so fold the bits together.
+    for s in (32, 16, 8, 4, 2, 1):
+        x = x ^ (x >> _arr(s))
+    return x & _arr(1)
+
+def _div(a, b, w, s, rem):
+    a, b = _arr(a), _arr(b)
+    zero = b == 0
+    b    = np.where(zero, 1, b)
+    if s:
+        a, b = _sgn(a, w), _sgn(b, w)
+        q = abs(a) // abs(b)
+        q = np.where((a < 0) != (b < 0), -q, q)
+        r = _arr((a - q * b) if rem else q) & ((1 << w) - 1)
+    else:
+        r = a % b if rem else a // b
+    return _arr(np.where(zero, 0, r))
+'''
+
+
+class UCBatchCompiler(UCSimCompiler):
+    """
+    Generates a module like UCSimCompiler, where every value is a NumPy
+    array with one element per lane. Each block function is called as
+    `s_<encoding>(v, idx)`, where idx is the array of lanes currently in
+    that state. The variables a block reads are gathered for those lanes
+    once at the start, and the variables it writes are scattered back at
+    the end. Conditions become `numpy.where` selections, so lanes in the
+    same state may take different branches.
+    """
+
+    def __init__(self, sim):
+        UCSimCompiler.__init__(self, sim)
+        self.prelude   = UCBatchPrelude
+        self.reads     = {}
+        self.max_width = 0
+
+    def read(self, var):
+        self.reads[var.name] = var
+        return "r_%s" % var.name
+
+    def flag(self, condition):
+        return "_flag(%s)" % condition
+
+    def choose(self, condition, if_true, if_false):
+        return "_where(%s, %s, %s)" % (condition, if_true, if_false)
+
+    def logical(self, a, op, b):
+        return self.flag("(%s != 0) %s (%s != 0)" % (a, "&" if op == "&&" else "|", b))
+
+    def expr(self, node, width, signed, names, state):
+        self.max_width = max(self.max_width, width)
+        return UCSimCompiler.expr(self, node, width, signed, names, state)
+
+    def gen_block(self, block):
+        """
+        Return the source lines of the function which simulates the lanes
+        currently in one block.
+        """
+        self.reads = {}
+        lines, written, next_state = self.gen_body(block)
+
+        tr = ["", "def s_%d(v, idx):" % self.sim.program.get_block_encoding(block),
+              "    # %s" % self.sim.program.get_block_state_name(block)]
+        tr += ["    r_%s = v[%r][idx]" % (n, n) for n in sorted(self.reads)]
+        tr += ["    " + l for l in lines]
+        if(len(written) > 0):
+            tr.append("    nxt = %s" % next_state)
+            for name, local in written.items():
+                tr.append("    v[%r][idx] = %s" % (name, local))
+            next_state = "nxt"
+        tr.append("    return %s" % next_state)
+        return tr
+
+    def gen_source(self):
+        """
+        Return the full source of the compiled program module, which also
+        records the widest expression so the simulator can choose a dtype.
+        """
+        tr = UCSimCompiler.gen_source(self)
+        return tr + "MAX_WIDTH = %d\n" % self.max_width
+
+    def gen_wires(self):
+        """
+        Return the source lines of the wires function, which updates the
+        comb variables of every lane.
+        """
+        self.reads = {}
+        wires = self.wire_lines()
+        if(len(wires) == 0):
+            return ["", "wires = None"]
+
+        tr  = ["", "def wires(v):"]
+        tr += ["    r_%s = v[%r]" % (n, n) for n in sorted(self.reads)]
+        tr += ["    v[%r][:] = %s" % (v.name, code) for v, code in wires]
+        return tr
+
+
+class UCBatchSimulator(UCSimulator):
+    """
+    Simulates many independent lanes of the same program together. Every
+    program variable is a NumPy array with one element per lane, and the
+    current state is an array of state encodings. Each cycle, the lanes
+    are grouped by their current state and each group runs through the
+    compiled function for its block, so one python level step advances
+    every lane.
+
+    Inputs can be driven per lane by passing arrays to set_inputs, or from
+    a stimulus callback as for UCSimulator, which may return arrays or
+    scalars. A stop condition returns a boolean array of the lanes which
+    have finished. Finished lanes stop advancing, so `cycles` holds the
+    number of cycles each lane ran for. A profile sums the visits and
+    transitions of every lane.
+
+    Variables wider than 64 bits, or any wider intermediate expression,
+    make every array use python integers, which is much slower.
+    """
+
+    def __init__(self, resolver, lanes):
+        """
+        Create a new batch simulator of a resolved program with the given
+        number of lanes.
+        """
+        if(numpy == None):
+            raise ImportError("The batch simulator needs numpy to be installed")
+
+        self.lanes = lanes
+        self.dtype = None
+        UCSimulator.__init__(self, resolver)
+
+        namespace  = UCBatchCompiler(self).build()
+        self.dtype = numpy.uint64
+        if(namespace["MAX_WIDTH"] > 64 or self.state_var.width > 62 or
+           any(v.width > 64 for v in resolver.variables.by_index)):
+            self.dtype = object
+        namespace["DT"] = self.dtype
+
+        self.dispatch       = namespace["dispatch"]
+        self.wires_function = namespace["wires"]
+        self.reset()
+
+    def reset(self):
+        """
+        Reset every lane to zero and into main.
+        """
+        UCSimulator.reset(self)
+        if(self.dtype == None):
+            return
+
+        # The interpreter has evaluated the constant wires with scalars.
+        scalars     = self.values
+        self.values = {}
+        for name, value in scalars.items():
+            self.values[name] = numpy.full(self.lanes, value, dtype=self.dtype)
+
+        # Wide one-hot encodings do not fit in a machine integer.
+        state_dtype   = numpy.int64 if self.dtype != object else object
+        self.state    = numpy.full(self.lanes, self.main_encoding,
+                                   dtype=state_dtype)
+        self.cycles   = numpy.zeros(self.lanes, dtype=numpy.int64)
+        self.finished = numpy.zeros(self.lanes, dtype=bool)
+
+    def update_wires(self):
+        """
+        Re-evaluate the comb variables of every lane. While resetting, the
+        values are still scalars and the interpreter is used.
+        """
+        if(type(self.state) != numpy.ndarray):
+            UCSimulator.update_wires(self)
+        elif(self.wires_function != None):
+            self.wires_function(self.values)
+
+    def set_inputs(self, inputs):
+        """
+        Drive input ports from a dict of port name to either a scalar for
+        every lane, or an array with one value per lane.
+        """
+        for name, value in inputs.items():
+            mask = self.input_masks.get(name, None)
+            if(mask == None):
+                self.log.error("Cannot drive '%s', it is not an input port" %
+                    name)
+                continue
+            value = numpy.asarray(value)
+            if(self.dtype == object):
+                value = value.astype(object)
+            self.values[name][:] = value.astype(self.dtype) & mask
+
+    def lane(self, index):
+        """
+        Return a dict of every variable value for a single lane.
+        """
+        return dict((n, int(a[index])) for n, a in self.values.items())
+
+    def record(self, encoding, targets):
+        """
+        Add the lanes which just ran the block with the given encoding to
+        the profile, along with the states they go to next.
+        """
+        source = self.blocks_by_encoding[encoding].name
+        self.profile.visit(source, len(targets))
+        targets, counts = numpy.unique(targets & mask_of(self.state_var.width),
+                                       return_counts = True)
+        for target, count in zip(targets, counts):
+            block = self.blocks_by_encoding.get(int(target), None)
+            if(block != None):
+                self.profile.transition(source, block.name, int(count))
+
+    def step(self):
+        """
+        Simulate one clock cycle of every lane which has not finished.
+        Returns the number of lanes which were advanced.
+        """
+        if(self.stimulus != None):
+            inputs = self.stimulus(self.cycle, self)
+            if(inputs):
+                self.set_inputs(inputs)
+        self.update_wires()
+
+        active = ~self.finished
+        state  = self.state
+        nxt    = state.copy()
+        main   = self.main_encoding
+
+        for encoding in numpy.unique(state[active]):
+            idx      = numpy.nonzero(active & (state == encoding))[0]
+            function = self.dispatch.get(int(encoding), None)
+            if(function == None):
+                nxt[idx] = main
+            else:
+                nxt[idx] = function(self.values, idx)
+                if(self.profile != None):
+                    self.record(int(encoding), nxt[idx])
+
+        self.state = nxt & mask_of(self.state_var.width)
+        self.values[self.state_var.name][:] = self.state
+        self.cycles[active] += 1
+        self.cycle += 1
+        return int(numpy.count_nonzero(active))
+
+    def run(self, cycles, until = None):
+        """
+        Simulate up to the given number of cycles. If until is given, it is
+        called with the simulator after each cycle and returns a boolean
+        array of the lanes which should stop. Returns the number of cycles
+        simulated, which is less than cycles if every lane stopped early.
+        """
+        for i in range(0, cycles):
+            if(self.step() == 0):
+                return i
+            if(until != None):
+                self.finished |= numpy.asarray(until(self), dtype=bool)
+                if(self.finished.all()):
+                    return i + 1
+        return cycles
+
+    def report(self, fh):
+        """
+        Write a table of the cycle count and final output port values of
+        every lane to an open file.
+        """
+        names = [v.name for v in self.outputs]
+        fh.write("%6s %10s %s\n" % ("lane", "cycles", " ".join(names)))
+        for i in range(0, self.lanes):
+            fh.write("%6d %10d %s\n" % (i, self.cycles[i],
+                " ".join("%d" % self.values[n][i] for n in names)))
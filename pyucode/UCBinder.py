@@ -0,0 +1,286 @@
+
+"""
+Classes and functions for sharing expensive operators between the states
+of a resolved program.
+"""
+
+import logging
+
+from .UCInstructionStatement import UCExprIdentifier
+from .UCInstructionStatement import UCExprSelect
+from .UCInstructionStatement import UCExprUnary
+from .UCInstructionStatement import UCExprBinary
+from .UCInstructionStatement import UCExprTernary
+from .UCInstructionStatement import UCExprParen
+from .UCInstructionStatement import UCExprConcat
+from .UCInstructionStatement import UCExprReplicate
+from .UCInstructionStatement import UCExprCall
+
+from .UCState import UCProgramVariable
+
+from .UCSimulator import UCSimulator
+from .UCSimulator import UCSimCompareOps
+from .UCSimulator import UCSimLogicalOps
+from .UCSimulator import UCSimShiftOps
+
+# Operators which may be computed by a shared functional unit, and the
+# operator the unit uses. Both operands are unsigned, so arithmetic shifts
+# behave like logical ones.
+UCBinderOperators = {
+    "+"   : "+",
+    "-"   : "-",
+    "*"   : "*",
+    "/"   : "/",
+    "%"   : "%",
+    "<<"  : "<<",
+    "<<<" : "<<",
+    ">>"  : ">>",
+    ">>>" : ">>"
+}
+
+class UCFunctionalUnit(object):
+    """
+    A single operator whose operands are chosen by the current state, and
+    whose result is read by every state which uses it.
+    """
+
+    def __init__(self, index, op, width, rhs_width):
+        """
+        Create a new functional unit computing `lhs op rhs` at width bits,
+        where rhs is rhs_width bits wide.
+        """
+        self.op        = op
+        self.width     = width
+        self.rhs_width = rhs_width
+        self.lhs       = "_fu%d_a_" % index
+        self.rhs       = "_fu%d_b_" % index
+        self.result    = "_fu%d_y_" % index
+
+        # Names of the states which use the unit.
+        self.states    = []
+
+
+class UCOperatorBinder(object):
+    """
+    Binds expensive operators in different states onto shared functional
+    units. Only one state is active in any cycle, so a unit can serve one
+    operator of every state. In each state which uses it, the unit's
+    operand registers are set to the operands of the operator, and the
+    statement reads the unit's result instead. The operand registers are
+    zero in every other state.
+
+    Operators are shared if the cost model weight of their class is at
+    least the resolver's `share_min_cost`, and they are at least
+    `share_min_width` bits wide. Both operands must read a variable, and
+    a shift amount must be a variable or a bit select of one, since
+    operators of constants are cheap. Operators are sized by the verilog
+    rules of their context, and only operators in unsigned contexts of the
+    same width share a unit, so the unit computes exactly the same value.
+
+    Each unit adds a multiplexer in front of its operands. With a
+    `max_cycle_cost`, states which would go over it keep their own
+    operators.
+    """
+
+    def __init__(self, resolver):
+        """
+        Create a new binder for the program held by a resolver which has
+        already been resolved and had its states encoded.
+        """
+        self.log      = logging.getLogger(__name__)
+        self.resolver = resolver
+        self.program  = resolver.program
+        self.units    = []
+
+        # The simulator knows the verilog sizing rules and what every
+        # identifier of every instruction refers to.
+        self.sim       = UCSimulator(resolver)
+        self.evaluator = self.sim.evaluator
+
+    def width(self, node, names):
+        """
+        Return the self-determined width of an expression.
+        """
+        return self.evaluator.width(node, names, {})
+
+    def is_signed(self, node, names):
+        """
+        Return True if an expression is signed on its own.
+        """
+        return self.evaluator.is_signed(node, names)
+
+    def reads_variable(self, node, names):
+        """
+        Return True if an expression reads a program variable.
+        """
+        return any(type(self.evaluator.lookup(n.name, names)) ==
+                   UCProgramVariable for n in node.walk()
+                   if type(n) == UCExprIdentifier)
+
+    def candidate(self, node, width, signed, names):
+        """
+        Return the (operator, width, shift amount width) key of the units
+        an operator in a context of the given width and signedness may
+        share, or None.
+        """
+        op = UCBinderOperators.get(node.op, None)
+        if(op == None or signed or width < self.resolver.share_min_width):
+            return None
+        if(self.resolver.cost_model.operator_cost(node.op) <
+           self.resolver.share_min_cost):
+            return None
+        if(not self.reads_variable(node.lhs, names) or
+           not self.reads_variable(node.rhs, names)):
+            return None
+        if(self.is_signed(node.lhs, names)):
+            return None
+
+        if(node.op in UCSimShiftOps):
+            amount = node.rhs
+            while(type(amount) == UCExprParen):
+                amount = amount.operand
+            if(not type(amount) in (UCExprIdentifier, UCExprSelect)):
+                return None
+            return (op, width, self.width(node.rhs, names))
+
+        if(self.is_signed(node.rhs, names)):
+            return None
+        return (op, width, width)
+
+    def operators(self, node, width, signed, names, tr):
+        """
+        Append a tuple of (node, key) to tr for every operator which may
+        share a unit in an expression evaluated in a context of the given
+        width and signedness.
+        """
+        t = type(node)
+
+        def alone(child):
+            self.operators(child, self.width(child, names),
+                           self.is_signed(child, names), names, tr)
+
+        if(t == UCExprParen):
+            self.operators(node.operand, width, signed, names, tr)
+
+        elif(t == UCExprTernary):
+            alone(node.condition)
+            self.operators(node.if_true, width, signed, names, tr)
+            self.operators(node.if_false, width, signed, names, tr)
+
+        elif(t == UCExprUnary and node.op in ("~", "-", "+")):
+            self.operators(node.operand, width, signed, names, tr)
+
+        elif(t == UCExprUnary):
+            alone(node.operand)
+
+        elif(t == UCExprBinary):
+            key = self.candidate(node, width, signed, names)
+            if(key != None):
+                tr.append((node, key))
+
+            if(node.op in UCSimShiftOps):
+                self.operators(node.lhs, width, signed, names, tr)
+                alone(node.rhs)
+            elif(node.op in UCSimLogicalOps):
+                alone(node.lhs)
+                alone(node.rhs)
+            elif(node.op in UCSimCompareOps):
+                w = max(self.width(node.lhs, names),
+                        self.width(node.rhs, names))
+                s = (self.is_signed(node.lhs, names) and
+                     self.is_signed(node.rhs, names))
+                self.operators(node.lhs, w, s, names, tr)
+                self.operators(node.rhs, w, s, names, tr)
+            else:
+                self.operators(node.lhs, width, signed, names, tr)
+                self.operators(node.rhs, width, signed, names, tr)
+
+        elif(t == UCExprConcat or t == UCExprReplicate):
+            for part in node.parts:
+                alone(part)
+
+        elif(t == UCExprCall):
+            for arg in node.args:
+                alone(arg)
+
+    def block_operators(self, block):
+        """
+        Return the list of (instruction, statement index, node, key) tuples
+        for every operator of a block which may share a unit.
+        """
+        tr = []
+        for instr in block.statements:
+            names = self.sim.names[instr]
+            for i, statement in enumerate(instr.statements):
+                if(not statement.is_parsed()):
+                    continue
+                width = max(self.width(statement.lhs, names),
+                            self.width(statement.rhs, names))
+                found = []
+                self.operators(statement.rhs, width,
+                               self.is_signed(statement.rhs, names),
+                               names, found)
+                tr += [(instr, i, node, key) for node, key in found]
+        return tr
+
+    def bind_program(self):
+        """
+        Bind the operators of every state onto shared functional units.
+        Returns the number of operators removed from the design.
+        """
+        max_cost = self.resolver.max_cycle_cost
+        mux      = self.resolver.cost_model.weights["mux"]
+
+        # Maps each key onto a list with one list of operators per state.
+        uses = {}
+        for block in self.program.blocks:
+            if(max_cost != None and
+               self.resolver.block_cost(block) + mux > max_cost):
+                continue
+            found = {}
+            for use in self.block_operators(block):
+                found.setdefault(use[3], []).append(use)
+            for key, operators in found.items():
+                uses.setdefault(key, []).append((block, operators))
+
+        bindings = {}
+        removed  = 0
+        for key in sorted(uses):
+            op, width, rhs_width = key
+            count = max(len(operators) for block, operators in uses[key])
+
+            # The n'th operator of each state goes to the n'th unit.
+            for n in range(0, count):
+                users = [(block, operators[n]) for block, operators
+                         in uses[key] if len(operators) > n]
+                if(len(users) < 2):
+                    continue
+
+                unit = UCFunctionalUnit(len(self.units), op, width,
+                                        max(u[1][3][2] for u in users))
+                self.units.append(unit)
+                for block, (instr, i, node, _) in users:
+                    unit.states.append(block.name)
+                    bound = bindings.setdefault(block, {})
+                    bound.setdefault(instr, {}).setdefault(i, []).append(
+                        (node, unit))
+
+                removed += len(users) - 1
+                self.log.info("Sharing a %d bit '%s' between %d states as %s" %
+                    (width, op, len(users), unit.result))
+
+        # Operands of a shared operator are set before any shared operator
+        # which reads its result.
+        for instrs in bindings.values():
+            for instr, statements in instrs.items():
+                for i, bound in statements.items():
+                    order = dict((n, k) for k, n in
+                                 enumerate(instr.statements[i].rhs.walk()))
+                    bound.sort(key = lambda b: -order[b[0]])
+
+        for block, instrs in bindings.items():
+            block.statements = [i.bound(instrs[i]) if i in instrs else i
+                                for i in block.statements]
+
+        self.program.functional_units = self.units
+        return removed
@@ -0,0 +1,195 @@
+
+"""
+Classes and functions for estimating the combinatorial delay of program
+blocks, so that coalescing can trade clock cycles against clock speed.
+"""
+
+import logging
+
+import yaml
+
+from .UCInstructionStatement import UCExprUnary
+from .UCInstructionStatement import UCExprBinary
+from .UCInstructionStatement import UCExprTernary
+
+# Which cost class each operator belongs to.
+UCCostOperatorClasses = {
+    "+"   : "add",
+    "-"   : "add",
+    "*"   : "mul",
+    "/"   : "div",
+    "%"   : "div",
+    "<<"  : "shift",
+    ">>"  : "shift",
+    "<<<" : "shift",
+    ">>>" : "shift",
+    "=="  : "compare",
+    "!="  : "compare",
+    "<"   : "compare",
+    "<="  : "compare",
+    ">"   : "compare",
+    ">="  : "compare",
+    "&"   : "logic",
+    "|"   : "logic",
+    "^"   : "logic",
+    "~"   : "logic",
+    "~&"  : "logic",
+    "~|"  : "logic",
+    "~^"  : "logic",
+    "^~"  : "logic",
+    "&&"  : "logic",
+    "||"  : "logic",
+    "!"   : "logic",
+    "?"   : "mux"
+}
+
+# Default delay weights for each class of operator. These are relative
+# numbers, roughly in units of a single LUT level.
+UCCostDefaults = {
+    "add"     : 4,
+    "mul"     : 12,
+    "div"     : 32,
+    "shift"   : 3,
+    "compare" : 3,
+    "logic"   : 1,
+    "mux"     : 1
+}
+
+class UCCostModel(object):
+    """
+    Assigns a delay weight to every operator class, and uses them to
+    estimate the critical path through statements and blocks.
+
+    Weights for a particular target can be loaded from a YAML file which
+    maps class names onto numbers, for example:
+
+    ```
+    add     : 6
+    mul     : 4     # Hard DSP multipliers.
+    shift   : 5
+    compare : 3
+    ```
+
+    Any class not mentioned keeps its default weight.
+    """
+
+    def __init__(self, weights = None):
+        """
+        Create a new cost model using the default weights, updated with
+        the supplied dictionary of weights if given.
+        """
+        self.log     = logging.getLogger(__name__)
+        self.weights = dict(UCCostDefaults)
+        self.statement_costs = {}
+        if(weights != None):
+            self.setWeights(weights)
+
+    def setWeights(self, weights):
+        """
+        Update the weights of the cost classes named in the supplied dict.
+        """
+        for name in weights:
+            if(name in self.weights):
+                self.weights[name] = float(weights[name])
+            else:
+                self.log.error("Unknown operator cost class '%s'. Should be one of: %s" %
+                    (name, ", ".join(sorted(self.weights))))
+        self.statement_costs = {}
+
+    def load(self, filepath):
+        """
+        Load a set of weights from a YAML file.
+        """
+        with open(filepath, "r") as fh:
+            weights = yaml.safe_load(fh)
+
+        if(not type(weights) is dict):
+            self.log.error("Cost model '%s' should be a mapping of operator class to weight" %
+                filepath)
+            return
+
+        self.setWeights(weights)
+
+    def operator_cost(self, op):
+        """
+        Return the delay weight of a single operator.
+        """
+        return self.weights.get(UCCostOperatorClasses.get(op, None), 0)
+
+    def expression_cost(self, node):
+        """
+        Return the cost of the most expensive path through an expression
+        tree, from any leaf to the root.
+        """
+        cost = 0
+        if(type(node) == UCExprUnary or type(node) == UCExprBinary):
+            cost = self.operator_cost(node.op)
+        elif(type(node) == UCExprTernary):
+            cost = self.operator_cost("?")
+
+        children = node.children()
+        if(len(children) > 0):
+            cost += max(self.expression_cost(c) for c in children)
+        return cost
+
+    def statement_cost(self, statement):
+        """
+        Return the critical path cost of a single UCInstructionStatement.
+        Statements are cached by source text, since operators do not change
+        when the arguments are resolved.
+        """
+        if(statement.src in self.statement_costs):
+            return self.statement_costs[statement.src]
+
+        cost = 0
+        if(statement.is_parsed()):
+            cost = self.expression_cost(statement.rhs)
+
+        self.statement_costs[statement.src] = cost
+        return cost
+
+    def instruction_cost(self, instr):
+        """
+        Return the critical path cost of an instruction.
+        """
+        cost = 0
+        for statement in instr.statements:
+            cost = max(cost, self.statement_cost(statement))
+
+        # A predicated instruction only writes through a multiplexer, once
+        # its conditions are known.
+        if(len(instr.predicate) > 0):
+            cost = max(cost, self.weights["compare"]) + self.weights["mux"]
+        return cost
+
+    def flow_change_cost(self, flow_change):
+        """
+        Return the cost of deciding the next state from a list of flow
+        changes: a comparison against zero, then one multiplexer per
+        conditional jump.
+        """
+        conditionals = len([fc for fc in flow_change if fc.conditional])
+        if(conditionals == 0):
+            return 0
+        return self.weights["compare"] + self.weights["mux"] * conditionals
+
+    def block_cost(self, statements, flow_change):
+        """
+        Return the critical path cost of a block made of the supplied
+        resolved instructions and flow changes. All statements in a state
+        read the current register values, so they evaluate in parallel.
+        Each extra write to the same variable adds a multiplexer in front
+        of its next value.
+        """
+        cost   = self.flow_change_cost(flow_change)
+        writes = {}
+
+        for instr in statements:
+            cost = max(cost, self.instruction_cost(instr))
+            for var in instr.read_write_sets()[1]:
+                writes[var] = writes.get(var, 0) + 1
+
+        if(len(writes) > 0):
+            cost += self.weights["mux"] * (max(writes.values()) - 1)
+
+        return cost
@@ -0,0 +1,314 @@
+
+"""
+Classes and functions for indexing the control flow between the blocks of
+a resolved program.
+"""
+
+import logging
+
+class UCFlowGraph(object):
+    """
+    An index of the control flow edges between program blocks. Each edge
+    is a UCProgramFlowChange object whose target is a UCProgramBlock. Flow
+    changes which jump to a variable are not edges, since their target is
+    only known at run time.
+
+    The block flow change lists remain the source of truth for the order of
+    the edges leaving a block. The graph keeps a map from each block onto
+    the edges which enter it, so predecessor and successor queries never
+    need to look at the rest of the program.
+    """
+
+    def __init__(self):
+        """
+        Create a new, empty flow graph.
+        """
+        self.log = logging.getLogger(__name__)
+
+        # Maps each block onto the list of flow changes leaving it.
+        self.out_edges = {}
+
+        # Maps each block onto a dict of flow change : source block for
+        # each flow change which targets it.
+        self.in_edges  = {}
+
+        # Maps each edge (flow change) onto the block it leaves.
+        self.source    = {}
+
+    def __contains__(self, block):
+        """
+        Returns True if the block is a node in the graph.
+        """
+        return block in self.out_edges
+
+    def build(self, blocks):
+        """
+        Discard the current contents of the graph and re-index the supplied
+        list of blocks. All flow change targets must already be resolved.
+        """
+        self.out_edges = {}
+        self.in_edges  = {}
+        self.source    = {}
+
+        for block in blocks:
+            self.out_edges[block] = []
+            self.in_edges[block]  = {}
+
+        for block in blocks:
+            for flow_change in block.flow_change:
+                self.add_edge(block, flow_change)
+
+    def add_block(self, block):
+        """
+        Add a new block and all of the edges leaving it to the graph.
+        """
+        if(not block in self.out_edges):
+            self.out_edges[block] = []
+            self.in_edges[block]  = {}
+
+        for flow_change in block.flow_change:
+            self.add_edge(block, flow_change)
+
+    def remove_block(self, block):
+        """
+        Remove a block and all of the edges leaving it from the graph.
+        Any edges which still target the block are left dangling, so they
+        should be re-targeted first.
+        """
+        if(not block in self.out_edges):
+            return
+
+        for flow_change in list(self.out_edges[block]):
+            self.remove_edge(flow_change)
+
+        if(len(self.in_edges[block]) > 0):
+            self.log.debug("Removed block '%s' still has %d incoming edges" %
+                (block.name, len(self.in_edges[block])))
+
+        del self.out_edges[block]
+        del self.in_edges[block]
+
+    def is_edge(self, flow_change):
+        """
+        Returns True if the flow change jumps directly to a block.
+        """
+        return (not flow_change.to_variable and
+                flow_change.target in self.in_edges)
+
+    def add_edge(self, block, flow_change):
+        """
+        Add a single flow change leaving block to the graph. Jumps to
+        variables are ignored.
+        """
+        if(not self.is_edge(flow_change)):
+            return
+
+        self.out_edges[block].append(flow_change)
+        self.in_edges[flow_change.target][flow_change] = block
+        self.source[flow_change] = block
+
+    def remove_edge(self, flow_change):
+        """
+        Remove a single flow change from the graph.
+        """
+        if(not flow_change in self.source):
+            return
+
+        block = self.source.pop(flow_change)
+        self.out_edges[block].remove(flow_change)
+        if(flow_change.target in self.in_edges):
+            self.in_edges[flow_change.target].pop(flow_change, None)
+
+    def retarget(self, flow_change, target):
+        """
+        Make a single flow change jump to target instead of its current
+        target, updating only the edge itself.
+        """
+        block = self.source.get(flow_change, None)
+
+        if(block != None):
+            self.in_edges[flow_change.target].pop(flow_change, None)
+
+        flow_change.target      = target
+        flow_change.to_variable = False
+
+        if(block != None):
+            self.in_edges[target][flow_change] = block
+
+    def retarget_all(self, old_target, new_target):
+        """
+        Make every edge which jumps to old_target jump to new_target instead.
+        Returns the number of edges changed.
+        """
+        edges = list(self.in_edges[old_target])
+        for flow_change in edges:
+            self.retarget(flow_change, new_target)
+        return len(edges)
+
+    def set_flow_change(self, block, flow_change):
+        """
+        Replace the list of flow changes at the end of block, updating the
+        edges which leave it.
+        """
+        for old in list(self.out_edges[block]):
+            self.remove_edge(old)
+
+        block.flow_change = flow_change
+
+        for new in flow_change:
+            self.add_edge(block, new)
+
+    def edges_into(self, block):
+        """
+        Return the list of flow changes which target the supplied block.
+        """
+        return list(self.in_edges[block])
+
+    def edges_from(self, block):
+        """
+        Return the list of flow changes which leave the supplied block and
+        jump directly to another block.
+        """
+        return list(self.out_edges[block])
+
+    def in_degree(self, block):
+        """
+        Returns the number of flow changes which target the block.
+        """
+        return len(self.in_edges[block])
+
+    def out_degree(self, block):
+        """
+        Returns the number of flow changes leaving the block which jump
+        directly to another block.
+        """
+        return len(self.out_edges[block])
+
+    def predecessors(self, block):
+        """
+        Return the list of distinct blocks which can jump into block.
+        """
+        return list(dict.fromkeys(self.in_edges[block].values()))
+
+    def successors(self, block):
+        """
+        Return the list of distinct blocks which block can jump to, in the
+        order of its flow changes.
+        """
+        return list(dict.fromkeys(fc.target for fc in self.out_edges[block]))
+
+    def post_order(self, root):
+        """
+        Return the list of blocks reachable from root in depth first
+        post-order.
+        """
+        visited = set([root])
+        order   = []
+        stack   = [(root, iter(self.successors(root)))]
+
+        while(len(stack) > 0):
+            block, children = stack[-1]
+            descended = False
+            for child in children:
+                if(not child in visited):
+                    visited.add(child)
+                    stack.append((child, iter(self.successors(child))))
+                    descended = True
+                    break
+            if(not descended):
+                stack.pop()
+                order.append(block)
+
+        return order
+
+    def reverse_post_order(self, root):
+        """
+        Return the list of blocks reachable from root in reverse post-order.
+        """
+        order = self.post_order(root)
+        order.reverse()
+        return order
+
+    def immediate_dominators(self, root):
+        """
+        Compute the immediate dominator of every block reachable from root,
+        using the iterative algorithm of Cooper, Harvey and Kennedy.
+        Returns a dict mapping each block onto its immediate dominator. The
+        root maps onto itself.
+        """
+        order = self.reverse_post_order(root)
+        index = dict((block, i) for i, block in enumerate(order))
+        idom  = {root: root}
+
+        def intersect(a, b):
+            while(not a is b):
+                while(index[a] > index[b]):
+                    a = idom[a]
+                while(index[b] > index[a]):
+                    b = idom[b]
+            return a
+
+        changed = True
+        while(changed):
+            changed = False
+            for block in order[1:]:
+                new_idom = None
+                for pred in self.predecessors(block):
+                    if(not pred in idom):
+                        continue
+                    if(new_idom == None):
+                        new_idom = pred
+                    else:
+                        new_idom = intersect(pred, new_idom)
+
+                if(not idom.get(block) is new_idom):
+                    idom[block] = new_idom
+                    changed     = True
+
+        return idom
+
+    def dominates(self, idom, a, b):
+        """
+        Given the immediate dominators returned by immediate_dominators,
+        return True if block a dominates block b.
+        """
+        if(not b in idom):
+            return False
+
+        while(True):
+            if(b is a):
+                return True
+            parent = idom[b]
+            if(parent is b):
+                return False
+            b = parent
+
+    def natural_loops(self, root):
+        """
+        Find the natural loops of the blocks reachable from root. A back
+        edge is one whose target dominates its source, and the loop it forms
+        is the target (the header) plus every block which can reach the
+        source without going through the header. Loops which share a header
+        are combined. Returns a list of (header, set of blocks) tuples in
+        reverse post-order of their headers.
+        """
+        idom  = self.immediate_dominators(root)
+        loops = {}
+
+        for header in self.reverse_post_order(root):
+            for flow_change in self.in_edges[header]:
+                latch = self.source[flow_change]
+                if(not latch in idom or not self.dominates(idom, header, latch)):
+                    continue
+
+                body  = loops.setdefault(header, set([header]))
+                queue = [latch]
+                while(len(queue) > 0):
+                    block = queue.pop()
+                    if(block in body):
+                        continue
+                    body.add(block)
+                    queue += [p for p in self.predecessors(block) if p in idom]
+
+        return [(h, loops[h]) for h in self.reverse_post_order(root)
+                if h in loops]
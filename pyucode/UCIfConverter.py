@@ -0,0 +1,188 @@
+
+"""
+Classes and functions for turning short conditional branches of a resolved
+program into predicated statements.
+"""
+
+import logging
+
+from .UCProgram import UCProgramFlowChange
+from .UCProgram import UCProgramFlowGoto
+from .UCProgram import UCProgramFlowIfEqz
+from .UCProgram import UCProgramFlowIfNez
+
+class UCIfConverter(object):
+    """
+    Merges the two arms of small branch diamonds into a single state. A
+    diamond is a block which ends with
+
+        ifnez   c   then_arm
+        goto        else_arm
+
+    or the ifeqz equivalent, where each arm is only entered from that
+    block, and both arms jump straight on to the same join block. The
+    statements of both arms are moved into the then arm, each predicated on
+    the value of `c` which would have chosen it, and the else arm is
+    removed. The branch becomes a goto.
+
+    The converted state runs in the cycle either arm would have, so it sees
+    the same values, except for `c`, which is now read a cycle later. The
+    branch is only converted if the block does not write `c`, and `c` is
+    not an input port or comb variable whose value may change in between.
+
+    Converting a diamond does not shorten any path on its own. It leaves
+    the join block with one predecessor, and the branch block with an
+    unconditional jump, so coalescing can then merge the three states.
+    """
+
+    def __init__(self, resolver):
+        """
+        Create a new if-converter for the program held by a resolver whose
+        instructions have already been resolved.
+        """
+        self.log      = logging.getLogger(__name__)
+        self.resolver = resolver
+        self.program  = resolver.program
+
+    def branch(self, block):
+        """
+        If block ends in a two way branch on a single variable, return a
+        tuple of (variable, then target, else target, nonzero), where
+        nonzero is True if the then target is taken when the variable is
+        non-zero. Otherwise return None.
+        """
+        graph = self.program.flow_graph
+        if(len(block.flow_change) != 2):
+            return None
+
+        first, second = block.flow_change
+        if(not first.conditional):
+            return None
+        if(not graph.is_edge(first) or not graph.is_edge(second)):
+            return None
+
+        nonzero = first.change_type == UCProgramFlowIfNez
+
+        # A second test must be the opposite of the first, so it always
+        # passes.
+        if(second.conditional):
+            opposite = UCProgramFlowIfEqz if nonzero else UCProgramFlowIfNez
+            if(not (second.variable is first.variable and
+                    second.change_type == opposite)):
+                return None
+
+        return (first.variable, first.target, second.target, nonzero)
+
+    def join(self, arm):
+        """
+        Return the block an arm always jumps to next, or None.
+        """
+        if(len(arm.flow_change) != 1):
+            return None
+        fc = arm.flow_change[0]
+        if(fc.conditional or not self.program.flow_graph.is_edge(fc)):
+            return None
+        return fc.target
+
+    def is_arm(self, block, arm):
+        """
+        Return true if arm is small enough to predicate, and is only ever
+        entered from block.
+        """
+        if(arm is block or arm.name == "main" or arm.gets_dereferenced):
+            return False
+        if(self.program.flow_graph.predecessors(arm) != [block]):
+            return False
+        if(len(arm.statements) > self.resolver.max_predicated_statements):
+            return False
+        return not self.resolver.reads_current_state(arm)
+
+    def diamond(self, block):
+        """
+        Return a tuple of (variable, then arm, else arm, nonzero) if block
+        heads a diamond which may be converted, or None.
+        """
+        branch = self.branch(block)
+        if(branch == None):
+            return None
+
+        variable, then_arm, else_arm, nonzero = branch
+        if(then_arm is else_arm):
+            return None
+        if(not self.is_arm(block, then_arm) or
+           not self.is_arm(block, else_arm)):
+            return None
+
+        join = self.join(then_arm)
+        if(join == None or join is not self.join(else_arm) or
+           join is then_arm or join is else_arm):
+            return None
+
+        if(variable.isInPort() or variable.isCombVar() or
+           variable.bit & block.read_write_masks()[1]):
+            return None
+
+        if(self.resolver.max_cycle_cost != None):
+            statements = self.predicated(then_arm, else_arm, variable,
+                                         nonzero)
+            cost = self.resolver.cost_model.block_cost(statements,
+                                                       then_arm.flow_change)
+            if(cost > self.resolver.max_cycle_cost):
+                return None
+
+        return branch
+
+    def predicated(self, then_arm, else_arm, variable, nonzero):
+        """
+        Return the list of predicated statements of both arms.
+        """
+        return ([i.predicated(variable, nonzero)
+                 for i in then_arm.statements] +
+                [i.predicated(variable, not nonzero)
+                 for i in else_arm.statements])
+
+    def convert(self, block, diamond):
+        """
+        Merge the arms of the diamond headed by block into its then arm.
+        """
+        variable, then_arm, else_arm, nonzero = diamond
+        graph = self.program.flow_graph
+
+        self.log.info("If-converting '%s' and '%s' after '%s'" %
+            (then_arm.name, else_arm.name, block.name))
+
+        then_arm.statements      = self.predicated(then_arm, else_arm,
+                                                   variable, nonzero)
+        then_arm.src_statements += else_arm.src_statements
+        then_arm.src_lines      += else_arm.src_lines
+        then_arm.invalidate_read_write_sets()
+
+        goto = UCProgramFlowChange(None)
+        goto.change_type = UCProgramFlowGoto
+        goto.target      = then_arm
+        goto.src         = "goto %s" % then_arm.name
+        graph.set_flow_change(block, [goto])
+        block.invalidate_read_write_sets()
+
+        graph.set_flow_change(else_arm, [])
+        self.program.remove_blocks([else_arm])
+
+    def convert_program(self):
+        """
+        Convert every suitable diamond in the program, including those
+        whose arms were diamonds themselves. Returns the number of diamonds
+        converted.
+        """
+        converted = 0
+        changed   = True
+        while(changed):
+            changed = False
+            for block in list(self.program.blocks):
+                if(not block in self.program.flow_graph):
+                    continue
+                diamond = self.diamond(block)
+                if(diamond != None):
+                    self.convert(block, diamond)
+                    converted += 1
+                    changed    = True
+        return converted
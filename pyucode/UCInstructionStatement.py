@@ -4,9 +4,494 @@ A set of classes for representing the operations which occur inside of
 instructions.
 """
 
-import logging as log
+import os
+import copy
+import logging
+
+import ply.lex  as lex
+import ply.yacc as yacc
+
+
+class UCExprNode(object):
+    """
+    Base class for all nodes of a parsed statement expression tree.
+    Expression trees are never modified once built, so they can be shared
+    between every statement with the same source text.
+    """
+
+    def children(self):
+        """
+        Return the list of child nodes of this node.
+        """
+        return []
+
+    def walk(self):
+        """
+        Yield this node and every node beneath it, depth first.
+        """
+        stack = [self]
+        while(len(stack) > 0):
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children()))
+
+    def identifiers(self):
+        """
+        Return the list of identifier names used in the expression, in
+        order of appearance.
+        """
+        return [n.name for n in self.walk() if type(n) == UCExprIdentifier]
+
+    def render(self, names):
+        """
+        Render the expression as verilog. names is a function which maps
+        each identifier name onto the text which should replace it.
+        """
+        raise NotImplementedError()
+
+    def replaced(self, replacements):
+        """
+        Return this expression with every node which is a key of the
+        replacements dict swapped for its value. Nodes on the path to a
+        replaced node are copied, so the original tree is left alone.
+        """
+        if(self in replacements):
+            return replacements[self]
+
+        tr = None
+        for attr, value in self.__dict__.items():
+            if(isinstance(value, UCExprNode)):
+                new = value.replaced(replacements)
+            elif(type(value) == list):
+                new = [v.replaced(replacements)
+                       if isinstance(v, UCExprNode) else v for v in value]
+                if(all(a is b for a, b in zip(new, value))):
+                    new = value
+            else:
+                continue
+            if(not new is value):
+                if(tr == None):
+                    tr = copy.copy(self)
+                setattr(tr, attr, new)
+
+        return self if tr == None else tr
+
+
+class UCExprConstant(UCExprNode):
+    """
+    A literal number, such as `4`, `12'b0` or `32'hFFFF_0000`.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+    def value_and_width(self):
+        """
+        Return a tuple of (integer value, width in bits). Unsized literals
+        are 32 bits wide, as in verilog. Any x or z digits are read as 0.
+        """
+        if(not "'" in self.text):
+            return (int(self.text.replace("_","")), 32)
+
+        size, _, digits = self.text.partition("'")
+        digits = digits.lstrip("sS")
+        base   = {"b":2, "o":8, "d":10, "h":16}[digits[0].lower()]
+        digits = digits[1:].replace("_","")
+        for xz in "xXzZ?":
+            digits = digits.replace(xz, "0")
+        value  = int(digits, base)
+        width  = int(size) if size != "" else 32
+        return (value & ((1 << width) - 1), width)
+
+    def render(self, names):
+        return self.text
+
+
+class UCExprIdentifier(UCExprNode):
+    """
+    A reference to a named instruction argument or program variable.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def render(self, names):
+        return names(self.name)
+
+
+class UCExprSelect(UCExprNode):
+    """
+    A bit or part select of an identifier: `a[3]` or `a[7:0]`.
+    """
+
+    def __init__(self, operand, hi, lo=None):
+        self.operand = operand
+        self.hi      = hi
+        self.lo      = lo
+
+    def children(self):
+        if(self.lo == None):
+            return [self.operand, self.hi]
+        return [self.operand, self.hi, self.lo]
+
+    def render(self, names):
+        if(self.lo == None):
+            return "%s[%s]" % (self.operand.render(names),
+                               self.hi.render(names))
+        return "%s[%s:%s]" % (self.operand.render(names),
+                              self.hi.render(names),
+                              self.lo.render(names))
+
+
+class UCExprUnary(UCExprNode):
+    """
+    A prefix operator applied to a single operand.
+    """
+
+    def __init__(self, op, operand):
+        self.op      = op
+        self.operand = operand
+
+    def children(self):
+        return [self.operand]
+
+    def render(self, names):
+        return "%s%s" % (self.op, self.operand.render(names))
+
+
+class UCExprBinary(UCExprNode):
+    """
+    An infix operator applied to two operands.
+    """
+
+    def __init__(self, op, lhs, rhs):
+        self.op  = op
+        self.lhs = lhs
+        self.rhs = rhs
+
+    def children(self):
+        return [self.lhs, self.rhs]
+
+    def render(self, names):
+        return "%s %s %s" % (self.lhs.render(names), self.op,
+                             self.rhs.render(names))
+
+
+class UCExprTernary(UCExprNode):
+    """
+    A `condition ? if_true : if_false` selection.
+    """
+
+    def __init__(self, condition, if_true, if_false):
+        self.condition = condition
+        self.if_true   = if_true
+        self.if_false  = if_false
+
+    def children(self):
+        return [self.condition, self.if_true, self.if_false]
+
+    def render(self, names):
+        return "%s ? %s : %s" % (self.condition.render(names),
+                                 self.if_true.render(names),
+                                 self.if_false.render(names))
+
+
+class UCExprParen(UCExprNode):
+    """
+    A bracketed sub-expression. Kept so that rendered expressions group
+    exactly as they were written.
+    """
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def children(self):
+        return [self.operand]
+
+    def render(self, names):
+        return "(%s)" % self.operand.render(names)
+
+
+class UCExprConcat(UCExprNode):
+    """
+    A concatenation `{a, b, c}`.
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def children(self):
+        return list(self.parts)
+
+    def render(self, names):
+        return "{%s}" % ", ".join(p.render(names) for p in self.parts)
+
+
+class UCExprReplicate(UCExprNode):
+    """
+    A replication `{count{a, b}}`.
+    """
+
+    def __init__(self, count, parts):
+        self.count = count
+        self.parts = parts
+
+    def children(self):
+        return [self.count] + list(self.parts)
+
+    def render(self, names):
+        return "{%s{%s}}" % (self.count.render(names),
+                             ", ".join(p.render(names) for p in self.parts))
+
+
+class UCExprCall(UCExprNode):
+    """
+    A call to a verilog system function such as `$signed( a )`.
+    """
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args     = args
+
+    def children(self):
+        return list(self.args)
+
+    def render(self, names):
+        return "%s(%s)" % (self.function,
+                           ", ".join(a.render(names) for a in self.args))
+
+
+class UCStatementParser(object):
+    """
+    A ply based lexer and parser for instruction statements. Operators bind
+    with the same precedence as in verilog, so a rendered statement means
+    the same thing as its source. The LALR tables are cached in the
+    UCStatementParseTab module next to this file, so they are only
+    generated when the grammar changes.
+    """
+
+    tokens = (
+        "ID", "SYSID", "NUMBER",
+        "LOR", "LAND", "EQ", "NE", "LE", "GE",
+        "ASHL", "ASHR", "SHL", "SHR",
+        "NAND", "NOR", "XNOR",
+    )
+
+    literals = "=+-*/%&|^~!<>?:,()[]{}"
+
+    t_ignore = " \t"
+
+    t_LOR    = r"\|\|"
+    t_LAND   = r"&&"
+    t_EQ     = r"=="
+    t_NE     = r"!="
+    t_LE     = r"<="
+    t_GE     = r">="
+    t_ASHL   = r"<<<"
+    t_ASHR   = r">>>"
+    t_SHL    = r"<<"
+    t_SHR    = r">>"
+    t_NAND   = r"~&"
+    t_NOR    = r"~\|"
+    t_XNOR   = r"~\^|\^~"
+    t_SYSID  = r"\$[a-zA-Z_][a-zA-Z0-9_]*"
+    t_ID     = r"[a-zA-Z_][a-zA-Z0-9_]*"
+
+    def t_NUMBER(self, t):
+        r"[0-9]*'[sS]?[bBoOdDhH][0-9a-fA-F_xXzZ?]+|[0-9][0-9_]*"
+        return t
+
+    def t_error(self, t):
+        raise UCStatementSyntaxError(t.value[0], t.lexpos)
+
+    precedence = (
+        ("right", "?", ":"),
+        ("left",  "LOR"),
+        ("left",  "LAND"),
+        ("left",  "|", "NOR"),
+        ("left",  "^", "XNOR"),
+        ("left",  "&", "NAND"),
+        ("left",  "EQ", "NE"),
+        ("left",  "<", "LE", ">", "GE"),
+        ("left",  "SHL", "SHR", "ASHL", "ASHR"),
+        ("left",  "+", "-"),
+        ("left",  "*", "/", "%"),
+        ("right", "UNARY"),
+    )
+
+    def p_statement(self, p):
+        "statement : lvalue '=' expression"
+        p[0] = (p[1], p[3])
+
+    def p_lvalue_id(self, p):
+        "lvalue : identifier"
+        p[0] = p[1]
+
+    def p_lvalue_select(self, p):
+        "lvalue : select"
+        p[0] = p[1]
+
+    def p_lvalue_concat(self, p):
+        "lvalue : '{' lvalue_list '}'"
+        p[0] = UCExprConcat(p[2])
+
+    def p_lvalue_list(self, p):
+        """lvalue_list : lvalue
+                       | lvalue_list ',' lvalue"""
+        if(len(p) == 2):
+            p[0] = [p[1]]
+        else:
+            p[0] = p[1] + [p[3]]
+
+    def p_identifier(self, p):
+        "identifier : ID"
+        p[0] = UCExprIdentifier(p[1])
+
+    def p_select_part(self, p):
+        "select : identifier '[' expression ':' expression ']'"
+        p[0] = UCExprSelect(p[1], p[3], p[5])
+
+    def p_select_bit(self, p):
+        "select : identifier '[' expression ']'"
+        p[0] = UCExprSelect(p[1], p[3])
+
+    def p_expression_binary(self, p):
+        """expression : expression LOR  expression
+                      | expression LAND expression
+                      | expression '|'  expression
+                      | expression NOR  expression
+                      | expression '^'  expression
+                      | expression XNOR expression
+                      | expression '&'  expression
+                      | expression NAND expression
+                      | expression EQ   expression
+                      | expression NE   expression
+                      | expression '<'  expression
+                      | expression LE   expression
+                      | expression '>'  expression
+                      | expression GE   expression
+                      | expression SHL  expression
+                      | expression SHR  expression
+                      | expression ASHL expression
+                      | expression ASHR expression
+                      | expression '+'  expression
+                      | expression '-'  expression
+                      | expression '*'  expression
+                      | expression '/'  expression
+                      | expression '%'  expression"""
+        p[0] = UCExprBinary(p[2], p[1], p[3])
+
+    def p_expression_ternary(self, p):
+        "expression : expression '?' expression ':' expression"
+        p[0] = UCExprTernary(p[1], p[3], p[5])
+
+    def p_expression_unary(self, p):
+        """expression : '!' expression %prec UNARY
+                      | '~' expression %prec UNARY
+                      | '-' expression %prec UNARY
+                      | '+' expression %prec UNARY
+                      | '&' expression %prec UNARY
+                      | '|' expression %prec UNARY
+                      | '^' expression %prec UNARY
+                      | NAND expression %prec UNARY
+                      | NOR  expression %prec UNARY
+                      | XNOR expression %prec UNARY"""
+        p[0] = UCExprUnary(p[1], p[2])
+
+    def p_expression_primary(self, p):
+        """expression : identifier
+                      | select"""
+        p[0] = p[1]
+
+    def p_expression_number(self, p):
+        "expression : NUMBER"
+        p[0] = UCExprConstant(p[1])
+
+    def p_expression_paren(self, p):
+        "expression : '(' expression ')'"
+        p[0] = UCExprParen(p[2])
+
+    def p_expression_concat(self, p):
+        "expression : '{' expression_list '}'"
+        p[0] = UCExprConcat(p[2])
+
+    def p_expression_replicate(self, p):
+        "expression : '{' expression '{' expression_list '}' '}'"
+        p[0] = UCExprReplicate(p[2], p[4])
+
+    def p_expression_call(self, p):
+        "expression : SYSID '(' expression_list ')'"
+        p[0] = UCExprCall(p[1], p[3])
+
+    def p_expression_list(self, p):
+        """expression_list : expression
+                           | expression_list ',' expression"""
+        if(len(p) == 2):
+            p[0] = [p[1]]
+        else:
+            p[0] = p[1] + [p[3]]
+
+    def p_error(self, p):
+        if(p == None):
+            raise UCStatementSyntaxError("end of statement", None)
+        raise UCStatementSyntaxError(p.value, p.lexpos)
+
+    def __init__(self):
+        """
+        Build the lexer, and load or generate the parse tables.
+        """
+        log = logging.getLogger(__name__)
+        self.lexer  = lex.lex(module=self, errorlog=log)
+        self.parser = yacc.yacc(module=self,
+                                tabmodule="UCStatementParseTab",
+                                outputdir=os.path.dirname(__file__),
+                                debug=False,
+                                errorlog=log)
+
+    def tokenise(self, src):
+        """
+        Return the list of token strings in src.
+        """
+        self.lexer.input(src)
+        return [t.value for t in self.lexer]
+
+    def parse(self, src):
+        """
+        Parse src into a tuple of (lvalue, expression) trees. Raises
+        UCStatementSyntaxError if src is not a valid statement.
+        """
+        return self.parser.parse(src, lexer=self.lexer)
+
+
+class UCStatementSyntaxError(Exception):
+    """
+    Raised when an instruction statement cannot be parsed.
+    """
+
+    def __init__(self, token, column):
+        self.token  = token
+        self.column = column
+        if(column == None):
+            Exception.__init__(self, "unexpected %s" % token)
+        else:
+            Exception.__init__(self, "unexpected '%s' at column %d" %
+                (token, column + 1))
+
+
+# The statement parser is built on first use and shared. Parsed trees are
+# cached by source text, since many instructions share statements.
+_parser    = None
+_ast_cache = {}
+
+def get_statement_parser():
+    """
+    Return the shared UCStatementParser instance.
+    """
+    global _parser
+    if(_parser == None):
+        _parser = UCStatementParser()
+    return _parser
 
-import ply.lex as lex
 
 class UCInstructionStatement(object):
     """
@@ -16,9 +501,17 @@ class UCInstructionStatement(object):
     An EBNF grammar for statements would be:
 
     ```
-    statement ::= <variable> = <expression> \n
+    statement ::= <lvalue> = <expression> \n
+
+    lvalue    ::= <variable>
+                | <variable> [ <expression> ]
+                | <variable> [ <expression> : <expression> ]
+                | { <lvalue> <lvalue_concatenation> }
+
+    lvalue_concatenation ::= , <lvalue> <lvalue_concatenation>
+                           |
 
-    variable  ::= (a-bA-B0-9_)+
+    variable  ::= (a-zA-Z_)(a-zA-Z0-9_)*
 
     constant  ::= (0-9)*'[h](0-9a-fA-F)+
                 | (0-9)*'[d](0-9)+
@@ -26,26 +519,32 @@ class UCInstructionStatement(object):
                 | (0-9)*'[o](0-7)+
                 | (0-9)+
 
-    expression ::= <term> <infix_op> <term>
-                 | <prefix_op> <term>
+    expression ::= <expression> <infix_op> <expression>
+                 | <prefix_op> <expression>
+                 | <expression> ? <expression> : <expression>
                  | <term>
 
     term       ::= <constant>
                  | <variable>
+                 | <variable> [ <expression> ]
+                 | <variable> [ <expression> : <expression> ]
+                 | $<function> ( <expression> <concatenation> )
                  | ( <expression> )
                  | { <expression> <concatenation> }
-                 | { <constant> { expression } }
+                 | { <expression> { <expression> <concatenation> } }
 
     concatenation ::= , <expression> <concatenation>
                     |
 
-    infix_op   ::= + \| - | & ^ * && \|\| << >> <<< >>> > < == >= <=
+    infix_op   ::= || && | ~| ^ ~^ & ~& == != < <= > >= << >> <<< >>>
+                 | + - * / %
 
-    prefix_op  ::= - \| &
+    prefix_op  ::= ! ~ - + & | ^ ~& ~| ~^
     ```
 
-    Note that operator precedence is left un-defined. The **only** way to
-    express precedence is to use brackets.
+    Operators have the same precedence as in verilog. Brackets are kept
+    when the statement is synthesised, so they can always be used to make
+    the grouping explicit.
     """
 
     def __init__(self, src=None, lineNo = 0):
@@ -57,17 +556,119 @@ class UCInstructionStatement(object):
         assert type(lineNo) == int , \
             "lineNo should be of type int, not %s" % type(lineNo)
 
-        self.src = src
+        self.src    = src
+        self.lineNo = lineNo
+        self.lhs    = None
+        self.rhs    = None
         self.parse()
 
     def get_tokens(self):
         """
         Return a string tokenised version of the sourcefor this statement.
         """
-        return self.src.split(" ")
+        return get_statement_parser().tokenise(self.src)
 
     def parse(self):
         """
-        Parse the string representation of the statement 
+        Parse the string representation of the statement into an lvalue
+        and expression tree. Trees are cached by source text, so each
+        distinct statement is only ever parsed once.
         """
-        
+        if(self.src in _ast_cache):
+            self.lhs, self.rhs = _ast_cache[self.src]
+            return
+
+        try:
+            self.lhs, self.rhs = get_statement_parser().parse(self.src)
+        except UCStatementSyntaxError as e:
+            logging.getLogger(__name__).error(
+                "Line %d: Could not parse statement '%s': %s" %
+                (self.lineNo, self.src, e))
+            return
+
+        _ast_cache[self.src] = (self.lhs, self.rhs)
+
+    def is_parsed(self):
+        """
+        Returns True if the statement was parsed successfully.
+        """
+        return self.lhs != None
+
+    def written_identifiers(self):
+        """
+        Return the list of identifier names assigned to by the statement.
+        """
+        if(not self.is_parsed()):
+            return []
+
+        tr    = []
+        stack = [self.lhs]
+        while(len(stack) > 0):
+            node = stack.pop()
+            if(type(node) == UCExprIdentifier):
+                tr.append(node.name)
+            elif(type(node) == UCExprSelect):
+                tr.append(node.operand.name)
+            elif(type(node) == UCExprConcat):
+                stack.extend(reversed(node.parts))
+        return tr
+
+    def overwritten_identifiers(self):
+        """
+        Return the list of identifier names whose every bit is assigned to
+        by the statement, which excludes those assigned through a select.
+        """
+        if(not self.is_parsed()):
+            return []
+
+        tr    = []
+        stack = [self.lhs]
+        while(len(stack) > 0):
+            node = stack.pop()
+            if(type(node) == UCExprIdentifier):
+                tr.append(node.name)
+            elif(type(node) == UCExprConcat):
+                stack.extend(reversed(node.parts))
+        return tr
+
+    def read_identifiers(self):
+        """
+        Return the list of identifier names read by the statement. This
+        includes any identifiers used to select bits of the lvalue.
+        """
+        if(not self.is_parsed()):
+            return []
+
+        tr = self.rhs.identifiers()
+        for node in self.lhs.walk():
+            if(type(node) == UCExprSelect):
+                tr += node.hi.identifiers()
+                if(node.lo != None):
+                    tr += node.lo.identifiers()
+        return tr
+
+    def render(self, write_name, read_name):
+        """
+        Render the statement as a verilog assignment, without the
+        terminating semicolon. write_name and read_name are functions
+        mapping identifier names onto the text used when the identifier
+        is assigned to or read from respectively.
+        """
+        if(not self.is_parsed()):
+            return "/* %s */" % self.src
+
+        def render_lvalue(node):
+            if(type(node) == UCExprIdentifier):
+                return write_name(node.name)
+            elif(type(node) == UCExprSelect):
+                tr = "%s[%s" % (write_name(node.operand.name),
+                                node.hi.render(read_name))
+                if(node.lo != None):
+                    tr += ":%s" % node.lo.render(read_name)
+                return tr + "]"
+            else:
+                return "{%s}" % ", ".join(render_lvalue(p)
+                                          for p in node.parts)
+
+        return "%s = %s" % (render_lvalue(self.lhs),
+                            self.rhs.render(read_name))
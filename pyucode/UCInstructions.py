@@ -3,14 +3,19 @@
 Classes and functions for representing instructions.
 """
 
-import re
 import sys
+import copy
 import logging as log
 
+from .UCLexer import UCLexer
+
 from .UCInstructionStatement import UCInstructionStatement
+from .UCInstructionStatement import UCExprIdentifier
 
 class UCInstructionArgument(object):
 
+    __slots__ = ["constant", "variable", "name", "hi", "lo", "src"]
+
     def __init__(self, src=None):
         """
         Create a new instruction argument using a string source.
@@ -21,6 +26,7 @@ class UCInstructionArgument(object):
         self.name     = None
         self.hi       = 0 
         self.lo       = 0 
+        self.src      = None
 
         if src != None:
             self.parse(src)
@@ -37,9 +43,9 @@ class UCInstructionArgument(object):
             self.constant = True
 
         if(len(tokens) == 3):
-            self.name = tokens[2]
+            self.name = sys.intern(tokens[2])
         else:
-            self.name = tokens[-1]
+            self.name = sys.intern(tokens[-1])
             bits = src.split("[")[1].split("]")[0]
             bits_split = bits.split(":")
             self.hi = int(bits_split[0])
@@ -48,28 +54,133 @@ class UCInstructionArgument(object):
 
 class UCInstruction(object):
     """
-    Represents a single instruction
+    Represents the definition of a single instruction. Definitions are
+    shared by every use of the instruction in a program, and are not
+    changed once parsed. Each use is a UCResolvedInstruction.
     """
 
+    __slots__ = ["name", "arguments", "statements", "description", "resolved",
+                 "arguments_by_name", "rw_names"]
+
     def __init__(self, name, arguments, statements, desc=""):
         """
         Create a new instruction with the supplied name, list of arguments
         and list of statements.
         """
         
-        self.name       = name
+        self.name       = sys.intern(name)
         self.arguments  = arguments
         self.statements = statements
-        self.resolved_args = {}
         self.description = desc
         self.resolved = False
+        self.arguments_by_name = dict((a.name, a) for a in arguments)
 
+        # Names of the identifiers read and written by the statements,
+        # found on first use.
+        self.rw_names = None
 
-    def is_argument(self, token):
+
+    def get_argument(self, arg_name):
         """
-        Checks if the supplied token name is an argument to the instruction.
+        Returns an argument to the instruction with the supplied name,
+        or None if the instruction has no such named argument.
         """
-        return token in self.resolved_args
+        return self.arguments_by_name.get(arg_name, None)
+    
+
+    def read_write_names(self):
+        """
+        Returns a tuple of the sets of identifier names read and written by
+        the statements of the instruction, whether they are arguments or
+        not. The sets are only computed once.
+        """
+        if(self.rw_names == None):
+            read    = set([])
+            written = set([])
+            for statement in self.statements:
+                read.update(statement.read_identifiers())
+                written.update(statement.written_identifiers())
+            self.rw_names = (frozenset(read), frozenset(written))
+        return self.rw_names
+
+
+    def identifiers(self):
+        """
+        Returns the set of identifier names used by the statements of the
+        instruction, whether they are arguments or not.
+        """
+        read, written = self.read_write_names()
+        return read | written
+
+
+    def resolved_with(self, resolved_args, resolved_vars):
+        """
+        Return a new use of this instruction whose arguments are given by
+        resolved_args, and whose other identifiers name the program
+        variables in resolved_vars.
+        """
+        return UCResolvedInstruction(self, resolved_args, resolved_vars)
+
+
+class UCResolvedInstruction(object):
+    """
+    Represents a single use of an instruction in a resolved program. The
+    name, arguments and statements belong to the shared UCInstruction
+    definition, and only the values bound to the arguments, and what
+    optimisation passes add, belong to the use.
+    """
+
+    __slots__ = ["definition", "resolved_args", "resolved_vars", "rw_masks",
+                 "synthesised", "predicate", "bindings"]
+
+    # Uses only exist once an instruction has been resolved.
+    resolved = True
+
+    def __init__(self, definition, resolved_args, resolved_vars):
+        """
+        Create a new use of the UCInstruction definition, whose arguments
+        are bound to the values in resolved_args, and whose statements
+        refer to the program variables in resolved_vars by any other
+        identifiers.
+        """
+        self.definition    = definition
+        self.resolved_args = resolved_args
+
+        # Maps identifiers in the statements which are not arguments onto
+        # the program variables they name. Shared by every use of the
+        # definition until register sharing renames them.
+        self.resolved_vars = resolved_vars
+
+        # Read and write bitmasks, computed on first use.
+        self.rw_masks = None
+
+        # Synthesised verilog statements, cached on first use.
+        self.synthesised = None
+
+        # List of (variable, nonzero) conditions which must all hold for
+        # the instruction to take effect. Set by if-conversion.
+        self.predicate = []
+
+        # Maps the index of a statement onto a list of (operator node,
+        # UCFunctionalUnit) tuples, for operators which are computed by a
+        # shared functional unit. Set by operator sharing.
+        self.bindings  = {}
+
+    @property
+    def name(self):
+        return self.definition.name
+
+    @property
+    def arguments(self):
+        return self.definition.arguments
+
+    @property
+    def statements(self):
+        return self.definition.statements
+
+    @property
+    def description(self):
+        return self.definition.description
 
 
     def get_argument(self, arg_name):
@@ -77,11 +188,63 @@ class UCInstruction(object):
         Returns an argument to the instruction with the supplied name,
         or None if the instruction has no such named argument.
         """
-        for a in self.arguments:
-            if(a.name == arg_name):
-                return a
-        return None
-    
+        return self.definition.arguments_by_name.get(arg_name, None)
+
+
+    def identifiers(self):
+        """
+        Returns the set of identifier names used by the statements of the
+        instruction, whether they are arguments or not.
+        """
+        return self.definition.identifiers()
+
+
+    def is_argument(self, token):
+        """
+        Checks if the supplied token name is an argument to the instruction.
+        """
+        return token in self.resolved_args
+
+
+    def get_variable(self, name):
+        """
+        Returns the program variable which an identifier in one of the
+        instruction statements refers to once resolved. Returns None if
+        the identifier is a constant argument or an unknown name.
+        """
+        argument = self.get_argument(name)
+        if(argument != None):
+            if(argument.variable):
+                return self.resolved_args.get(name, None)
+            return None
+        return self.resolved_vars.get(name, None)
+
+
+    def predicated(self, variable, nonzero):
+        """
+        Return a copy of this resolved instruction which only takes effect
+        when variable is non-zero, or zero if nonzero is False, as well as
+        when any existing predicate holds.
+        """
+        tr = copy.copy(self)
+        tr.predicate   = self.predicate + [(variable, nonzero)]
+        tr.rw_masks    = None
+        tr.synthesised = None
+        return tr
+
+
+    def bound(self, bindings):
+        """
+        Return a copy of this resolved instruction whose operators are
+        computed by the shared functional units given in bindings, which
+        maps the index of a statement onto a list of (operator node,
+        UCFunctionalUnit) tuples. Only the synthesised verilog changes.
+        """
+        tr = copy.copy(self)
+        tr.bindings    = bindings
+        tr.synthesised = None
+        return tr
+
 
     def read_write_sets(self):
         """
@@ -90,7 +253,8 @@ class UCInstruction(object):
         This function cannot be called before the program has been resolved.
         Each set is returned as a list in a tuple of the form 
         `(read set, write set)`. The list contains objects of type
-        UCPort or UCProgramVariable
+        UCPort or UCProgramVariable. Only the bitmasks are cached, since
+        sets take far more memory.
         """
         assert (self.resolved) , \
             "Instructions must be resolved before read set is constructed."
@@ -98,68 +262,118 @@ class UCInstruction(object):
         readset = set([])
         writeset= set([])
 
-        for statement in self.statements:
+        read, written = self.definition.read_write_names()
 
-            tokens  = statement.get_tokens()
-            eq_seen = False
-            for t in tokens:
-                if(t == "="):
-                    eq_seen = True
-                    continue
+        for name in read:
+            var = self.get_variable(name)
+            if(var != None):
+                readset.add(var)
 
-                if(eq_seen and self.is_argument(t)):
-                    if(not self.get_argument(t).constant):
-                        readset.add(self.resolved_args[t])
+        for name in written:
+            var = self.get_variable(name)
+            if(var != None):
+                writeset.add(var)
 
-                elif((not eq_seen) and self.is_argument(t)):
-                    if(not self.get_argument(t).constant):
-                        writeset.add(self.resolved_args[t])
+        for var, nonzero in self.predicate:
+            readset.add(var)
 
         return (readset,writeset)
 
 
+    def read_write_masks(self):
+        """
+        Returns the variables read and written by the instruction instance
+        as a tuple of integer bitmasks `(read mask, write mask)`, where each
+        variable contributes its `bit`.
+        """
+        if(self.rw_masks == None):
+            readset, writeset = self.read_write_sets()
+            read_mask  = 0
+            write_mask = 0
+            for v in readset:
+                read_mask |= v.bit
+            for v in writeset:
+                write_mask |= v.bit
+            self.rw_masks = (read_mask, write_mask)
+
+        return self.rw_masks
+
+
+    def synth_identifier(self, name, written):
+        """
+        Return the verilog used for an identifier in one of the instruction
+        statements. Written variables use their `n_*` next value.
+        """
+        if(self.is_argument(name)):
+            argument_value = self.resolved_args[name]
+            argument_info  = self.get_argument(name)
+
+            if(argument_info.constant):
+                if(written):
+                    log.error("Cannot assign to constant argument")
+                return "%s" % argument_value
+            elif(argument_info.variable and written):
+                return "n_%s" % argument_value.name
+            elif(argument_info.variable):
+                return "%s" % argument_value.name
+            else:
+                log.error("Argument neither constant or variable: '%s'" %argument_info.name)
+
+        # Variables may have been renamed by register sharing.
+        var = self.resolved_vars.get(name, None)
+        if(var != None):
+            name = var.name
+
+        if(written):
+            return "n_%s" % name
+        return name
+
+
     def synth_statements(self):
         """
         Synthesises the set of instruction statements into something
         we can put into the verilog statemachine. Returns a list of
-        the statements as strings.
+        the statements as strings. Resolved instructions only do this once.
         """
+        if(self.synthesised != None):
+            return self.synthesised
+
+        guard = ""
+        if(len(self.predicate) > 0):
+            guard = "if ( %s ) " % " && ".join(
+                "%s %s 0" % (var.name, "!=" if nonzero else "==")
+                for var, nonzero in self.predicate)
+
+        write_name = lambda name: self.synth_identifier(name, True)
+        read_name  = lambda name: self.synth_identifier(name, False)
+
         tr = []
-        for statement in self.statements:
+        for i, statement in enumerate(self.statements):
             as_source = "// %s" % statement.src
+
+            # Shared units take their operands from whichever state is
+            # active, and the statement reads their result instead.
+            # Operators inside a shared operator may be shared too.
+            bindings = self.bindings.get(i, [])
+            replace  = dict((node, UCExprIdentifier(unit.result))
+                            for node, unit in bindings)
+            for node, unit in bindings:
+                tr.append("%s = %s ; %s" % (unit.lhs,
+                    node.lhs.replaced(replace).render(read_name), as_source))
+                tr.append("%s = %s ; %s" % (unit.rhs,
+                    node.rhs.replaced(replace).render(read_name), as_source))
+            if(len(bindings) > 0):
+                statement     = copy.copy(statement)
+                statement.rhs = statement.rhs.replaced(replace)
             
-            arg_statement = ""
-            tokens = statement.get_tokens()
-            eq_seen = False
-
-            for t in tokens:
-
-                if(t == "="):
-                    eq_seen = True
-
-                if(self.is_argument(t)):
-                    argument_value = self.resolved_args[t]
-                    argument_info  = self.get_argument(t)
-
-                    if(argument_info.constant):
-                        arg_statement += "%s " % argument_value
-                        if(not eq_seen):
-                            log.error("Cannot assign to constant argument")
-                    elif(argument_info.variable and not eq_seen):
-                        arg_statement += "n_%s " % argument_value.name
-                    elif(argument_info.variable and eq_seen):
-                        arg_statement += "%s " % argument_value.name
-                    else:
-                        log.error("Argument neither constant or variable: '%s'" %argument_info.name)
-                else:
-                    if(eq_seen):
-                        arg_statement += "%s " % t
-                    else:
-                        arg_statement += "n_%s " % t
+            arg_statement = guard + statement.render(write_name, read_name)
             
-            arg_statement += "; %s" % as_source
+            arg_statement += " ; %s" % as_source
             tr.append(arg_statement)
 
+        if(self.resolved):
+            self.synthesised = tr
+
         return tr
 
 
@@ -204,16 +418,9 @@ class UCInstructionCollection(object):
 
     def parse(self, filepath):
         """
-        Given a filepath, parse all of the instructions inside it.
+        Given a filepath, parse all of the instructions inside it. The file
+        is read one line at a time.
         """
-        lines = []
-
-        with open(filepath,"r") as fh:
-            lines = fh.readlines()
-            lines = [l.strip(" \n") for l in lines]
-            lines = [l for l in lines if l != ""]
-            lines = [re.sub(" +"," ",l) for l in lines]
-
         self.filepath = filepath
     
         IGNORE=1
@@ -222,7 +429,6 @@ class UCInstructionCollection(object):
         ERROR = 5
         
         pstate = IGNORE
-        lno    = 0
 
         current_comment     = ""
         current_name        = None
@@ -230,11 +436,11 @@ class UCInstructionCollection(object):
         current_statements  = []
 
 
-        for line in lines:
-            lno += 1
-            tokens = line.split(" ")
+        for source_line in UCLexer(filepath):
+            tokens = source_line.words
+            line   = source_line.text
 
-            if(line.startswith("//")):
+            if(source_line.is_comment()):
                 current_comment += line[2:] + "\n"
                 continue
 
@@ -244,6 +450,8 @@ class UCInstructionCollection(object):
                     current_name = tokens[1]
                     pstate = ARGS
                 else:
+                    log.error("%s: Expected 'define': %s" %
+                        (source_line.location(), line))
                     pstate = ERROR
 
             elif ( pstate == ARGS       ):
@@ -255,6 +463,8 @@ class UCInstructionCollection(object):
                 elif(tokens[0] == "begin"):
                     pstate = STATEMENTS
                 else:
+                    log.error("%s: Expected 'argument' or 'begin': %s" %
+                        (source_line.location(), line))
                     pstate = ERROR
 
             elif ( pstate == STATEMENTS ):
@@ -270,10 +480,11 @@ class UCInstructionCollection(object):
                     current_comment = ""
                     pstate = IGNORE 
                 else:
-                    current_statements.append(UCInstructionStatement(src=line))
+                    current_statements.append(
+                        UCInstructionStatement(src=line,
+                                               lineNo=source_line.number))
 
             else:
-                print("Parse error on line %d" % (lno))
                 break
 
 
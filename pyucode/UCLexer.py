@@ -0,0 +1,90 @@
+
+"""
+Classes for splitting program and instruction files into lines of
+words.
+"""
+
+import re
+
+# Runs of characters between spaces. Only spaces separate words, so a tab
+# is part of the word it touches, as it always has been.
+_word_re = re.compile(r"[^ ]+")
+
+
+class UCSourceLine(object):
+    """
+    A single non-blank line of a source file. The words of the line are
+    the runs of characters between its spaces, and text is the line with
+    leading and trailing spaces removed and every run of spaces replaced
+    by one. The column of each word is only worked out when asked for,
+    since it is only needed for error messages.
+    """
+
+    __slots__ = ["filepath", "number", "raw", "text", "words"]
+
+    def __init__(self, filepath, number, raw, text, words):
+        """
+        Create a new line of the file at filepath, with a 1-based line
+        number, the raw text read from the file, its normalised text, and
+        its words.
+        """
+        self.filepath = filepath
+        self.number   = number
+        self.raw      = raw
+        self.text     = text
+        self.words    = words
+
+    @property
+    def columns(self):
+        """
+        The list of the 1-based columns each word starts at.
+        """
+        raw = self.raw.rstrip("\n")
+        return [m.start() + 1 for m in _word_re.finditer(raw)]
+
+    def is_comment(self):
+        """
+        Returns True if the line is a `//` comment.
+        """
+        return self.words[0].startswith("//")
+
+    def location(self, index = 0):
+        """
+        Return the "file:line:column" location of a word of the line, for
+        error messages.
+        """
+        return "%s:%d:%d" % (self.filepath, self.number, self.columns[index])
+
+
+class UCLexer(object):
+    """
+    Reads a program or instruction file one line at a time, and yields
+    each line which is not blank as a UCSourceLine. Only the current line
+    is held in memory, so files of any size can be read.
+    """
+
+    def __init__(self, filepath):
+        """
+        Create a new lexer for the file at filepath.
+        """
+        self.filepath = filepath
+
+    def __iter__(self):
+        return self.lines()
+
+    def lines(self):
+        """
+        Generate the UCSourceLines of the file.
+        """
+        filepath = self.filepath
+
+        with open(filepath, "r") as fh:
+            for number, raw in enumerate(fh, 1):
+                text = raw.strip(" \n")
+                if(text == ""):
+                    continue
+                words = text.split(" ")
+                if("" in words):
+                    words = [w for w in words if w != ""]
+                    text  = " ".join(words)
+                yield UCSourceLine(filepath, number, raw, text, words)
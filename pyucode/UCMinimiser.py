@@ -0,0 +1,138 @@
+
+"""
+Classes and functions for merging the equivalent states of a resolved
+program.
+"""
+
+import logging
+
+class UCStateMinimiser(object):
+    """
+    Merges blocks which always behave the same way, so the state machine
+    has fewer states. Two blocks are equivalent if they synthesise to the
+    same statements, test the same variables in their flow changes, and
+    each of their flow changes goes to equivalent blocks.
+
+    Equivalence is found by partition refinement. Blocks start out grouped
+    by a hash of their statements and flow change signatures, then groups
+    are split until every block in a group jumps to the same groups as the
+    others. Each group is then replaced by one block, which is main if the
+    group contains it, and otherwise the first in program order.
+
+    Blocks which are de-referenced keep their own state, since their
+    encoding may be stored in a variable. So do blocks which read the state
+    register, as they behave differently in each state.
+    """
+
+    def __init__(self, resolver):
+        """
+        Create a new minimiser for the program held by a resolver whose
+        instructions have already been resolved.
+        """
+        self.log      = logging.getLogger(__name__)
+        self.resolver = resolver
+        self.program  = resolver.program
+
+    def signature(self, block):
+        """
+        Return a hashable description of everything about a block except
+        where its flow changes go. Blocks which must never be merged get a
+        signature of their own.
+        """
+        if(block.gets_dereferenced or self.resolver.reads_current_state(block)):
+            return ("unique", block.id)
+
+        statements = tuple(s.split(" ; //")[0] for s in
+            self.program.synth_block_statements(block, annotate=False))
+
+        flow = []
+        for fc in block.flow_change:
+            variable = fc.variable.name if fc.conditional else None
+            target   = fc.target.name if fc.to_variable else None
+            flow.append((fc.change_type, variable, target))
+
+        return (statements, tuple(flow))
+
+    def partition(self):
+        """
+        Return a dict mapping each block onto the number of its group of
+        equivalent blocks.
+
+        Groups are refined from a worklist, as in Hopcroft's algorithm.
+        When a group splits, only the groups of blocks which jump into one
+        of the parts split off from it are re-examined, and the largest
+        part keeps the old group number, so jumps into it need not be
+        looked at again. Re-examining a group re-keys all of its members,
+        so this is O(n.m) in the worst case for n blocks and m flow
+        changes, rather than Hopcroft's O(m.log n), but a group is only
+        looked at again when something it jumps to has split.
+        """
+        blocks  = self.program.blocks
+        graph   = self.program.flow_graph
+
+        group   = {}
+        members = []
+        keys    = {}
+        for block in blocks:
+            key = self.signature(block)
+            if(key not in keys):
+                keys[key] = len(members)
+                members.append([])
+            group[block] = keys[key]
+            members[group[block]].append(block)
+
+        pending = set(range(len(members)))
+
+        while(pending):
+            splitter = pending.pop()
+            affected = set(group[p] for block in members[splitter]
+                           for p in graph.predecessors(block))
+
+            for g in sorted(affected):
+                parts = {}
+                for block in members[g]:
+                    key = tuple(group[fc.target] if graph.is_edge(fc) else None
+                                for fc in block.flow_change)
+                    parts.setdefault(key, []).append(block)
+                if(len(parts) < 2):
+                    continue
+
+                parts = sorted(parts.values(), key=len, reverse=True)
+                members[g] = parts[0]
+                for part in parts[1:]:
+                    for block in part:
+                        group[block] = len(members)
+                    pending.add(len(members))
+                    members.append(part)
+
+        return group
+
+    def minimise_program(self):
+        """
+        Merge every group of equivalent blocks into one. Returns the number
+        of states removed.
+        """
+        graph   = self.program.flow_graph
+        main    = self.program.getBlock("main")
+        group   = self.partition()
+
+        members = {}
+        for block in self.program.blocks:
+            members.setdefault(group[block], []).append(block)
+
+        to_remove = []
+        for blocks in members.values():
+            if(len(blocks) < 2):
+                continue
+
+            keep = main if main in blocks else blocks[0]
+            for block in blocks:
+                if(block is keep):
+                    continue
+                self.log.info("Merging state '%s' into equivalent state '%s'"
+                    % (block.name, keep.name))
+                graph.retarget_all(block, keep)
+                to_remove.append(block)
+
+        self.program.remove_blocks(to_remove)
+        return len(to_remove)
@@ -0,0 +1,302 @@
+
+"""
+Classes and functions for recording how often each block of a program is
+executed, so that optimisations can concentrate on the hot paths.
+"""
+
+import json
+import logging
+import re
+
+from .UCVcd import UCVcdReader
+
+class UCProfile(object):
+    """
+    Counts how many cycles were spent in each block, and how many times
+    each flow change between two blocks was taken. Blocks are identified
+    by name, so a profile collected from one build of a program can guide
+    the optimisation of another. Profiles should be collected without
+    coalescing, so that every atomic block still has its own state.
+
+    Profiles can be recorded by a simulator (set its `profile` attribute),
+    read from the `_current_state_` register in a VCD file, and saved to
+    or loaded from JSON files of the form:
+
+    ```
+    {
+        "cycles" : 1200,
+        "blocks" : {"main": 10, "loop": 500, ...},
+        "edges"  : [["main", "loop", 10], ...]
+    }
+    ```
+    """
+
+    def __init__(self):
+        """
+        Create a new, empty profile.
+        """
+        self.log    = logging.getLogger(__name__)
+        self.cycles = 0
+        self.blocks = {}
+        self.edges  = {}
+
+    def visit(self, name, count = 1):
+        """
+        Record count cycles spent in the named block.
+        """
+        self.blocks[name] = self.blocks.get(name, 0) + count
+        self.cycles      += count
+
+    def transition(self, source, target, count = 1):
+        """
+        Record count transitions from one named block to another.
+        """
+        key = (source, target)
+        self.edges[key] = self.edges.get(key, 0) + count
+
+    def block_count(self, name):
+        """
+        Return the number of cycles spent in the named block.
+        """
+        return self.blocks.get(name, 0)
+
+    def edge_count(self, source, target):
+        """
+        Return the number of times the flow change from source to target
+        was taken.
+        """
+        return self.edges.get((source, target), 0)
+
+    def hottest(self, count = None):
+        """
+        Return a list of (name, cycles) tuples for the blocks with the most
+        cycles, hottest first.
+        """
+        tr = sorted(self.blocks.items(), key = lambda i: (-i[1], i[0]))
+        if(count != None):
+            tr = tr[:count]
+        return tr
+
+    def merge(self, other):
+        """
+        Add the counts of another profile to this one.
+        """
+        for name, count in other.blocks.items():
+            self.visit(name, count)
+        for (source, target), count in other.edges.items():
+            self.transition(source, target, count)
+
+    def save(self, filepath):
+        """
+        Write the profile to a JSON file.
+        """
+        data = {
+            "cycles" : self.cycles,
+            "blocks" : dict(self.blocks),
+            "edges"  : [[s, t, c] for (s, t), c in sorted(self.edges.items())]
+        }
+        with open(filepath, "w") as fh:
+            json.dump(data, fh, indent=4, sort_keys=True)
+
+    def load(self, filepath):
+        """
+        Add the counts from a JSON file written by save. Files ending in
+        `.vcd` are read with load_vcd instead, which needs the program.
+        """
+        with open(filepath, "r") as fh:
+            data = json.load(fh)
+
+        for name, count in data.get("blocks", {}).items():
+            self.visit(name, count)
+        for source, target, count in data.get("edges", []):
+            self.transition(source, target, count)
+
+    def read_design_encodings(self, filepath):
+        """
+        Return a list of (state name, encoding) tuples read from the
+        `localparam` state declarations of a generated verilog file.
+        """
+        pattern = re.compile(
+            r"localparam\s*(?:\[[^\]]*\])?\s*(STATE_\w+)\s*=\s*" +
+            r"(?:\d*'[dD])?(\d+)\s*;")
+        tr = []
+        with open(filepath, "r") as fh:
+            for line in fh:
+                match = pattern.search(line)
+                if(match != None):
+                    tr.append((match.group(1), int(match.group(2))))
+        return tr
+
+    def load_vcd(self, filepath, program, signal = "_current_state_",
+                 clock = "clk", reset = "aresetn", encodings = None):
+        """
+        Add the counts from the state register of a VCD file, sampled on
+        every rising clock edge while the active low reset is high. State
+        encodings are mapped back to blocks of the supplied program, which
+        must be built the same way as the simulated design, unless a list
+        of (state name, encoding) tuples for the design is given. The
+        file is streamed, so memory use does not grow with its length.
+        Returns the number of cycles read.
+        """
+        if(encodings == None):
+            encodings = program.synth_state_encodings()
+
+        blocks = dict((program.get_block_state_name(b), b.name)
+                      for b in program.blocks)
+        names  = {}
+        for state, encoding in encodings:
+            if(state in blocks):
+                names[encoding] = blocks[state]
+            else:
+                self.log.warning("%s: No block for state %s" %
+                    (filepath, state))
+
+        with UCVcdReader(filepath) as vcd:
+            state = vcd.find(signal)
+            if(state == None):
+                self.log.error("%s: No '%s' signal to profile" %
+                    (filepath, signal))
+                return 0
+
+            scope = ".".join(state.scope)
+            clk   = vcd.find(clock, scope) or vcd.find(clock)
+            rstn  = vcd.find(reset, scope) or vcd.find(reset)
+            if(clk == None):
+                self.log.error("%s: No '%s' signal to sample states with" %
+                    (filepath, clock))
+                return 0
+
+            cycles   = 0
+            previous = None
+            unknown  = set([])
+            for time, encoding in vcd.sample(state, clk, rstn):
+                name = names.get(encoding, None)
+                if(name == None):
+                    unknown.add(encoding)
+                    previous = None
+                    continue
+                self.visit(name)
+                if(previous != None):
+                    self.transition(previous, name)
+                previous = name
+                cycles  += 1
+
+        if(len(unknown) > 0):
+            self.log.warning("%s: Ignored %d unknown state encodings: %s" %
+                (filepath, len(unknown),
+                 ", ".join(str(e) for e in sorted(unknown))))
+
+        return cycles
+
+
+class UCProfileReport(object):
+    """
+    Attributes the cycles of a profile to the states and source lines of a
+    resolved program. Each source line is charged with every cycle spent in
+    the state which holds it, so lines which were coalesced into the same
+    state share its cycles, and the line totals can exceed the cycle count.
+    Cycles in states which are not part of the program are reported as
+    unattributed.
+    """
+
+    def __init__(self, profile, program):
+        """
+        Create a new report on a profile of the given program.
+        """
+        self.profile = profile
+        self.program = program
+
+    def fraction(self, count):
+        """
+        Return count as a fraction of all profiled cycles.
+        """
+        if(self.profile.cycles == 0):
+            return 0.0
+        return float(count) / self.profile.cycles
+
+    def block_rows(self):
+        """
+        Return a list of (block, cycles) tuples for every block in the
+        program, hottest first and then in program order.
+        """
+        rows = [(i, b, self.profile.block_count(b.name))
+                for i, b in enumerate(self.program.blocks)]
+        rows.sort(key = lambda r: (-r[2], r[0]))
+        return [(b, c) for i, b, c in rows]
+
+    def line_rows(self):
+        """
+        Return a list of (location, source text, cycles) tuples for every
+        source line of the program, hottest first and then in program
+        order.
+        """
+        rows = {}
+        for block in self.program.blocks:
+            count = self.profile.block_count(block.name)
+            for location, text in zip(block.src_lines, block.src_statements):
+                if(location == None):
+                    continue
+                row = rows.setdefault(location, [len(rows), text, 0])
+                row[2] += count
+        tr = sorted(rows.items(), key = lambda r: (-r[1][2], r[1][0]))
+        return [(location, text, count) for location, (i, text, count) in tr]
+
+    def unattributed(self):
+        """
+        Return the number of profiled cycles spent outside the program.
+        """
+        return self.profile.cycles - sum(c for b, c in self.block_rows())
+
+    def write(self, fh, top = None):
+        """
+        Write the state and source line histograms as text to an open
+        file, optionally only listing the top most expensive entries.
+        """
+        blocks = self.block_rows()[:top]
+        lines  = self.line_rows()[:top]
+
+        fh.write("Cycles: %d\n" % self.profile.cycles)
+        fh.write("Unattributed: %d\n\n" % self.unattributed())
+
+        fh.write("%10s %7s  %s\n" % ("cycles", "%", "state"))
+        for block, count in blocks:
+            fh.write("%10d %6.2f%%  %s\n" % (count, 100 * self.fraction(count),
+                self.program.get_block_state_name(block)))
+
+        fh.write("\n%10s %7s  %s\n" % ("cycles", "%", "line"))
+        for location, text, count in lines:
+            fh.write("%10d %6.2f%%  %s  %s\n" % (count,
+                100 * self.fraction(count), location, text))
+
+    def as_dict(self):
+        """
+        Return the report as a dict which can be serialised to JSON.
+        """
+        return {
+            "cycles"       : self.profile.cycles,
+            "unattributed" : self.unattributed(),
+            "states"       : [{
+                "block"    : block.name,
+                "state"    : self.program.get_block_state_name(block),
+                "encoding" : self.program.get_block_encoding(block),
+                "cycles"   : count,
+                "fraction" : self.fraction(count)
+            } for block, count in self.block_rows()],
+            "lines"        : [{
+                "location" : location,
+                "source"   : text,
+                "cycles"   : count,
+                "fraction" : self.fraction(count)
+            } for location, text, count in self.line_rows()]
+        }
+
+    def save(self, filepath):
+        """
+        Write the report to a file, as JSON if the path ends in `.json`
+        and as text otherwise.
+        """
+        with open(filepath, "w") as fh:
+            if(filepath.endswith(".json")):
+                json.dump(self.as_dict(), fh, indent=4)
+            else:
+                self.write(fh)
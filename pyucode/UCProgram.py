@@ -3,14 +3,17 @@
 Functions and classes for parsing and representing complete programs.
 """
 
-import re
 import os
 import sys
-import copy
+import enum
 import logging
 
 from .UCInstructions import UCInstructionCollection
 
+from .UCLexer import UCLexer
+
+from .UCFlowGraph import UCFlowGraph
+
 from .UCState import UCProgramVariable
 from .UCState import UCProgramVariableCollection
 from .UCState import UCVarStrings
@@ -24,18 +27,39 @@ from .UCState import UCTypeVarConst
 from .UCState import UCTypeVarComb 
 from .UCState import UCVarTypes    
 
-UCProgramFlowNone   = 0
-UCProgramFlowGoto   = 1
-UCProgramFlowIfEqz  = 2
-UCProgramFlowIfNez  = 3
+log = logging.getLogger(__name__)
+
+class UCProgramFlowType(enum.IntEnum):
+    """
+    The kinds of flow change which may end a block.
+    """
+    NONE  = 0
+    GOTO  = 1
+    IFEQZ = 2
+    IFNEZ = 3
+
+UCProgramFlowNone   = UCProgramFlowType.NONE
+UCProgramFlowGoto   = UCProgramFlowType.GOTO
+UCProgramFlowIfEqz  = UCProgramFlowType.IFEQZ
+UCProgramFlowIfNez  = UCProgramFlowType.IFNEZ
+
+# Ways of assigning values to the states of a program.
+UCStateEncodingBinary = "binary"
+UCStateEncodingOneHot = "onehot"
+UCStateEncodingGray   = "gray"
+UCStateEncodings      = [UCStateEncodingBinary,
+                         UCStateEncodingOneHot,
+                         UCStateEncodingGray]
 
 class UCProgramFlowChange(object):
 
+    __slots__ = ["src", "change_type", "target", "to_variable", "conditional",
+                 "variable"]
+
     def __init__(self, src):
         """
         Create a new program flow change object from source.
         """
-        self.log = logging.getLogger(__name__)
         self.src=src
         self.change_type    = UCProgramFlowNone
         self.target         = None
@@ -49,10 +73,10 @@ class UCProgramFlowChange(object):
         """
         Parse a program flow change from a source line.
         """
-        tokens = self.src.split(" ")
+        tokens = [sys.intern(t) for t in self.src.split(" ")]
         
         if(len(tokens) <= 1):
-            self.log.error("Control flow change without target")
+            log.error("Control flow change without target")
 
         if(tokens[0] == "goto"):
             self.change_type    = UCProgramFlowGoto
@@ -80,23 +104,51 @@ class UCProgramBlock(object):
 
     __count__ = 0
 
-    def __init__(self, name, statements, flow_change):
+    __slots__ = ["id", "name", "statements", "flow_change", "index",
+                 "resolved", "removable", "src_statements",
+                 "gets_dereferenced", "src_lines", "loop_bound",
+                 "source_name", "encoding", "rw_sets", "rw_masks"]
+
+    def __init__(self, name, statements, flow_change, src_lines = None):
         """
         Create a new program block with the supplied statments and control
-        flow change at the end.
+        flow change at the end. src_lines optionally gives the "file:line"
+        location of each statement.
         """
         self.id  = UCProgramBlock.__count__
         UCProgramBlock.__count__ = UCProgramBlock.__count__ + 1
-        self.log = logging.getLogger(__name__)
-        self.name           = name
+        self.name           = sys.intern(name)
         self.statements     = statements
         self.flow_change    = flow_change
         self.index          = None
         self.resolved       = False
         self.removable      = False
-        self.src_statements = copy.deepcopy(statements)
+        self.src_statements = list(statements)
         self.gets_dereferenced = False
 
+        # Source location of each statement, kept in step with
+        # src_statements as blocks are merged.
+        if(src_lines == None):
+            src_lines = [None] * len(statements)
+        self.src_lines      = list(src_lines)
+
+        # Most times this block may be entered each time the loop it heads
+        # is entered, from a `bound` annotation. None if not annotated.
+        self.loop_bound     = None
+
+        # Name of the block in the program source which this block was
+        # atomised from.
+        self.source_name    = self.name
+
+        # Value of the state register while this block executes, assigned
+        # once the program is optimised. Until then the id is used.
+        self.encoding       = None
+
+        # Cached read / write sets and bitmasks. Only invalidated when the
+        # block is merged with another.
+        self.rw_sets  = None
+        self.rw_masks = None
+
     def is_atomic(self):
         """
         Return True if there are zero or one statements in this program block,
@@ -117,20 +169,88 @@ class UCProgramBlock(object):
         assert (self.resolved) , \
             "Blocks must be resolved before read set is constructed."
 
+        if(self.rw_sets != None):
+            return self.rw_sets
+
         read_set    = set([])
         write_set   = set([])
 
         for statement in self.statements:
             
             rs, ws      = statement.read_write_sets()
-            read_set    = read_set.union(rs)
-            write_set   = write_set.union(ws)
+            read_set.update(rs)
+            write_set.update(ws)
         
         for fc in self.flow_change:
             if(fc.conditional):
                 read_set.add(fc.variable)
+            if(fc.to_variable):
+                read_set.add(fc.target)
+
+        self.rw_sets = (read_set, write_set)
+        return self.rw_sets
+
+
+    def read_write_masks(self):
+        """
+        Returns the variables read and written inside the block as a tuple
+        of integer bitmasks `(read mask, write mask)`. The result is cached
+        until the block is merged with another.
+        """
+        assert (self.resolved) , \
+            "Blocks must be resolved before read set is constructed."
+
+        if(self.rw_masks != None):
+            return self.rw_masks
+
+        read_mask   = 0
+        write_mask  = 0
+
+        for statement in self.statements:
+            rm, wm      = statement.read_write_masks()
+            read_mask  |= rm
+            write_mask |= wm
+
+        for fc in self.flow_change:
+            if(fc.conditional):
+                read_mask |= fc.variable.bit
+            if(fc.to_variable):
+                read_mask |= fc.target.bit
+
+        self.rw_masks = (read_mask, write_mask)
+        return self.rw_masks
+
+
+    def merged(self, child):
+        """
+        Append the statements of child onto the end of this block, and
+        update the cached read / write information to cover both blocks.
+        The caller is responsible for the flow changes, which should be
+        replaced by those of the child, whose conditional reads are already
+        part of its read mask.
+        """
+        masks = None
+        if(self.rw_masks != None and child.rw_masks != None):
+            masks = (self.rw_masks[0] | child.rw_masks[0],
+                     self.rw_masks[1] | child.rw_masks[1])
+
+        self.statements     += child.statements
+        self.src_statements += child.src_statements
+        self.src_lines      += child.src_lines
+
+        self.rw_sets  = None
+        self.rw_masks = masks
+        return self
+
 
-        return (read_set, write_set)
+    def invalidate_read_write_sets(self):
+        """
+        Discard the cached read / write sets and bitmasks. Must be called
+        whenever the statements or conditional flow changes of the block
+        are modified other than through merged().
+        """
+        self.rw_sets  = None
+        self.rw_masks = None
 
 
     def atomised(self):
@@ -145,7 +265,7 @@ class UCProgramBlock(object):
         tr = []
         namecounter = 0
         
-        for statement in self.statements:
+        for statement, src_line in zip(self.statements, self.src_lines):
             
             # Keep the same block name if this is the first statement,
             # otherwise number it accordingly.
@@ -165,11 +285,15 @@ class UCProgramBlock(object):
 
             newblock     = UCProgramBlock(newblock_name, 
                                           [statement],
-                                          newblock_flowchange)
+                                          newblock_flowchange,
+                                          [src_line])
+            newblock.source_name = self.source_name
+            if(statement is self.statements[0]):
+                newblock.loop_bound = self.loop_bound
             tr.append(newblock)
             namecounter += 1
 
-        self.log.info("Atomised block '%s' into %d sub-blocks" % 
+        log.info("Atomised block '%s' into %d sub-blocks" % 
             (self.name, len(tr)))
 
         return tr
@@ -196,12 +320,156 @@ class UCProgram(object):
         # List of parsed instruction files included in this program.
         self.instructions = UCInstructionCollection()
 
+        # Index of control flow edges between blocks. Only valid once the
+        # flow change targets have been resolved into blocks.
+        self.flow_graph = UCFlowGraph()
+
+        # How states are encoded, and the width of the state register.
+        self.state_encoding = UCStateEncodingBinary
+        self.state_width    = 12
+
+        # UCFunctionalUnits shared between states by operator sharing.
+        self.functional_units = []
+
+    def build_flow_graph(self):
+        """
+        Index the control flow edges between all blocks in the program.
+        Must be called once all flow change targets are resolved.
+        """
+        self.flow_graph.build(self.blocks)
+        return self.flow_graph
+
+    def remove_blocks(self, to_remove):
+        """
+        Remove the supplied collection of blocks from the program and its
+        flow graph.
+        """
+        to_remove   = set(to_remove)
+        self.blocks = [b for b in self.blocks if not b in to_remove]
+
+        for block in to_remove:
+            self.flow_graph.remove_block(block)
+            if(self.blocks_by_name.get(block.name) is block):
+                del self.blocks_by_name[block.name]
+
     def get_block_state_name(self,block):
         """
         Given a block, return its state name when being executed.
         """
         return "STATE_%s" % block.name.upper()
     
+    def get_block_encoding(self, block):
+        """
+        Given a block, return the value of the state register while it is
+        being executed.
+        """
+        if(block.encoding == None):
+            return block.id
+        return block.encoding
+
+    def state_order(self, profile = None):
+        """
+        Return the list of blocks in the order they are given codes, with
+        main first. With a profile, the hottest transitions are chained
+        together greedily, so that their states get adjacent codes.
+        """
+        main  = self.blocks_by_name.get("main", None)
+        order = [b for b in self.blocks if b is not main]
+        if(main != None):
+            order.insert(0, main)
+
+        if(profile == None):
+            return order
+
+        position = dict((b, i) for i, b in enumerate(order))
+        edges    = []
+        for block in order:
+            for target in self.flow_graph.successors(block):
+                count = profile.edge_count(block.name, target.name)
+                if(count > 0 and not target is block):
+                    edges.append((-count, position[block],
+                                  position[target], block, target))
+        edges.sort(key = lambda e: e[:3])
+
+        # Each block has at most one successor and one predecessor in a
+        # chain. head maps each block onto the first block of its chain.
+        after  = {}
+        before = {}
+        head   = dict((b, b) for b in order)
+        for count, i, j, block, target in edges:
+            if(block in after or target in before or target is main):
+                continue
+            if(head[block] is target):
+                continue
+            after[block]   = target
+            before[target] = block
+            first = head[block]
+            node  = target
+            while(node != None):
+                head[node] = first
+                node = after.get(node, None)
+
+        tr = []
+        for block in order:
+            if(block in before):
+                continue
+            node = block
+            while(node != None):
+                tr.append(node)
+                node = after.get(node, None)
+        return tr
+
+    def encode_states(self, encoding = UCStateEncodingBinary, profile = None):
+        """
+        Give every block a dense state encoding, and size the state register
+        to fit. Binary and Gray codes count up from main in program order.
+        Gray codes follow the hottest transitions of a profile if one is
+        given, so most state changes only flip one bit. One-hot codes give
+        every state its own bit.
+        """
+        assert encoding in UCStateEncodings, \
+            "Unknown state encoding '%s'" % encoding
+
+        order = self.state_order(profile if encoding ==
+                                 UCStateEncodingGray else None)
+        count = max(1, len(order))
+
+        for i, block in enumerate(order):
+            if(encoding == UCStateEncodingOneHot):
+                block.encoding = 1 << i
+            elif(encoding == UCStateEncodingGray):
+                block.encoding = i ^ (i >> 1)
+            else:
+                block.encoding = i
+
+        self.state_encoding = encoding
+        if(encoding == UCStateEncodingOneHot):
+            self.state_width = count
+        else:
+            self.state_width = max(1, (count - 1).bit_length())
+
+        self.log.info("Encoded %d states in %d bits as %s" %
+            (len(order), self.state_width, encoding))
+
+    def synth_state_case_select(self):
+        """
+        Return the expression which the state machine case statement
+        selects on.
+        """
+        if(self.state_encoding == UCStateEncodingOneHot):
+            return "1'b1"
+        return "_current_state_"
+
+    def synth_state_case_label(self, block):
+        """
+        Return the case statement label for a block. One-hot states only
+        test their own bit of the state register.
+        """
+        if(self.state_encoding == UCStateEncodingOneHot):
+            return "_current_state_[%d]" % \
+                (self.get_block_encoding(block).bit_length() - 1)
+        return self.get_block_state_name(block)
+
     def synth_block_statements(self,block, annotate=True):
         """
         Return a synthesised set of statements within the program block.
@@ -224,7 +492,8 @@ class UCProgram(object):
 
         for block in self.blocks:
 
-            tr.append((self.get_block_state_name(block), block.id))
+            tr.append((self.get_block_state_name(block),
+                       self.get_block_encoding(block)))
 
         return tr
 
@@ -400,33 +669,29 @@ class UCProgram(object):
 
     def parseSource(self, filepath):
         """
-        Parse a new source file into the program.
+        Parse a new source file into the program. The file is read one line
+        at a time.
         """
-        lines = []
-
-        with open(filepath,"r") as fh:
-            lines = fh.readlines()
-            lines = [l.strip(" \n") for l in lines]
-            lines = [l for l in lines if l != "" and not l.startswith("//")]
-            lines = [re.sub(" +"," ",l) for l in lines]
-    
         BLOCKS_PORTS= 1
         USING  = 2
         BLOCK  = 3
         ERROR  = 0
         
         pstate = USING
-        lno    = 0
 
         current_name        = None
         current_sub_block   = 1
         current_statements  = []
+        current_lines       = []
         current_flowchange  = []
+        current_bound       = None
                     
         def l_add_current_block(current_name, 
                                 current_sub_block,
                                 current_statements,
-                                current_flowchange):
+                                current_flowchange,
+                                current_lines,
+                                current_bound):
             # Add the "current" block
             if(current_name != None):
                 if(current_sub_block>1):
@@ -434,16 +699,19 @@ class UCProgram(object):
                                               current_sub_block)
                 toadd = UCProgramBlock(current_name,
                                        current_statements,
-                                       current_flowchange)
+                                       current_flowchange,
+                                       current_lines)
+                toadd.loop_bound = current_bound
                 self.log.info("Add block '%s'" % current_name)
                 self.addProgramBlock(toadd)
 
 
-        for line in lines:
-            lno += 1
-            if(line[0] == "#"):
+        for source_line in UCLexer(filepath):
+            tokens = source_line.words
+            if(tokens[0][0] == "#" or source_line.is_comment()):
                 continue
-            tokens = line.split(" ")
+            lno    = source_line.number
+            line   = source_line.text
                 
             if(pstate == USING):
                 
@@ -454,7 +722,8 @@ class UCProgram(object):
                     self.addProgramVariable(lno, tokens)
                     pstate = BLOCKS_PORTS
                 else:
-                    self.log.error("0")
+                    self.log.error("%s: Expected a 'using' statement or variable declaration: %s" %
+                        (source_line.location(), line))
                     pstate = ERROR
 
             elif(pstate == BLOCKS_PORTS):
@@ -463,6 +732,8 @@ class UCProgram(object):
                     # start parsing the new block.
                     current_name        = tokens[1]
                     current_statements  = []
+                    current_lines       = []
+                    current_bound       = None
                     current_sub_block   = 1
                     current_flowchange  = []
                     pstate = BLOCK 
@@ -472,7 +743,8 @@ class UCProgram(object):
                     self.addProgramVariable(lno, tokens)
 
                 else:
-                    self.log.error("1")
+                    self.log.error("%s: Expected a block or variable declaration: %s" %
+                        (source_line.location(), line))
                     pstate = ERROR
 
             elif(pstate == BLOCK):
@@ -487,25 +759,38 @@ class UCProgram(object):
                         l_add_current_block(current_name, 
                                             current_sub_block,
                                             current_statements,
-                                            current_flowchange)
+                                            current_flowchange,
+                                            current_lines,
+                                            current_bound)
                     # start parsing the new block.
                     current_name        = tokens[1]
                     current_statements  = []
+                    current_lines       = []
+                    current_bound       = None
                     current_sub_block   = 1
                     current_flowchange  = []
                     pstate = BLOCK 
 
                 elif(tokens[0] in ["goto", "ifeqz", "ifnez"]):
                     current_flowchange.append(UCProgramFlowChange(line))
+                elif(tokens[0] == "bound"):
+                    if(len(tokens) != 2 or not tokens[1].isdigit() or
+                       int(tokens[1]) < 1):
+                        self.log.error("%s: Loop bound should be a positive integer: %s" %
+                            (source_line.location(1 if len(tokens) > 1 else 0), line))
+                    else:
+                        current_bound = int(tokens[1])
                 elif(tokens[0] == "port"):
-                    self.log.error("Line %d: Cannot put port declarations inside blocks." % lno)
+                    self.log.error("%s: Cannot put port declarations inside blocks." %
+                        source_line.location())
                 elif(tokens[0] == "state"):
-                    self.log.error("Line %d: Cannot put state delcarations inside blocks." % lno)
+                    self.log.error("%s: Cannot put state delcarations inside blocks." %
+                        source_line.location())
                 else:
                     current_statements.append(line)
+                    current_lines.append("%s:%d" % (filepath, lno))
 
             else:
-                self.log.error("Parse error on line %d: %s" % (lno + 1, line))
                 break
 
         if(current_name != None and
@@ -514,7 +799,9 @@ class UCProgram(object):
             l_add_current_block(current_name, 
                                 current_sub_block,
                                 current_statements,
-                                current_flowchange)
+                                current_flowchange,
+                                current_lines,
+                                current_bound)
 
 
 if __name__ =="__main__":
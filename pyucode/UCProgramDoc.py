@@ -8,6 +8,7 @@ from jinja2 import Environment
 from jinja2 import FileSystemLoader
 
 from .UCResolver import UCResolver
+from .UCTiming   import UCTimingAnalysis
 
 class UCProgramDocgen(object):
     """
@@ -24,20 +25,76 @@ class UCProgramDocgen(object):
         
         self.prog = resolved_program
 
+    def flow_edges(self):
+        """
+        Return a list of (source block name, target name) tuples for every
+        flow change in the program. Jumps between blocks come from the
+        program flow graph, while jumps to variables target the variable
+        name.
+        """
+        graph = self.prog.program.flow_graph
+        tr    = []
+        for block in self.prog.program.blocks:
+            for flow_change in graph.edges_from(block):
+                tr.append((block.name, flow_change.target.name))
+            for flow_change in block.flow_change:
+                if(flow_change.to_variable):
+                    tr.append((block.name, flow_change.target.name))
+        return tr
 
-    def gen_flow_dot_graph(self, filepath):
+
+    def heat_colour(self, heat):
+        """
+        Return a graphviz colour for a heat between 0 and 1, which fades
+        from white through orange to red.
+        """
+        heat = min(max(heat, 0.0), 1.0)
+        return "#ff%02x%02x" % (int(255 - 205 * heat), int(255 * (1 - heat)))
+
+    def flow_heat(self, profile):
+        """
+        Return a tuple of (blocks, edges) giving the (cycles, colour) of
+        every block by name, and the number of times each flow edge was
+        taken. Colours are scaled against the hottest block.
+        """
+        program = self.prog.program
+        hottest = max([profile.block_count(b.name) for b in program.blocks]
+                      + [1])
+        blocks  = {}
+        for block in program.blocks:
+            count = profile.block_count(block.name)
+            blocks[block.name] = (count,
+                self.heat_colour(float(count) / hottest))
+
+        edges = {}
+        for edge in self.flow_edges():
+            edges[edge] = profile.edge_count(edge[0], edge[1])
+
+        return (blocks, edges)
+
+
+    def gen_flow_dot_graph(self, filepath, profile = None):
         """
         Creates a graphviz representation of the program flow which can
-        be fed into the `dot` program.
+        be fed into the `dot` program. If a UCProfile is given, blocks are
+        coloured by the cycles spent in them and edges are labelled with
+        the number of times they were taken.
         """
         
         env      = Environment(loader=FileSystemLoader("./templates/"))
         template = env.get_template("dot-graph.dot")
 
+        heat, edge_counts = (None, None)
+        if(profile != None):
+            heat, edge_counts = self.flow_heat(profile)
+
         with open(filepath,"w") as fh:
             fh.write(
                 template.render(
                     program   = self.prog.program,
+                    edges     = self.flow_edges(),
+                    heat      = heat,
+                    edge_counts = edge_counts
                 )
             )
 
@@ -53,6 +110,9 @@ class UCProgramDocgen(object):
             fh.write(
                 template.render(
                     program   = self.prog.program,
+                    graph     = self.prog.program.flow_graph,
+                    block_cost= self.prog.block_cost,
+                    timing    = UCTimingAnalysis(self.prog).report(),
                     pagetitle = "Program Documentation"
                 )
             )
@@ -6,6 +6,9 @@ proper objects.
 
 import sys
 import copy
+import heapq
+import collections
+import contextlib
 import logging
 
 from .UCState import UCProgramVariable
@@ -17,6 +20,30 @@ from .UCInstructions import UCInstructionCollection
 from .UCProgram import UCProgramFlowChange
 from .UCProgram import UCProgramBlock
 from .UCProgram import UCProgram
+from .UCProgram import UCStateEncodingBinary
+
+from .UCCost import UCCostModel
+from .UCCost import UCCostDefaults
+
+from .UCScheduler import UCListScheduler
+
+from .UCUnroller import UCLoopUnroller
+
+from .UCThreader import UCJumpThreader
+
+from .UCIfConverter import UCIfConverter
+
+from .UCMinimiser import UCStateMinimiser
+
+from .UCAllocator import UCRegisterAllocator
+
+from .UCBinder import UCOperatorBinder
+
+class UCResolverError(Exception):
+    """
+    Raised when a program resolves, but cannot be built into a working
+    design.
+    """
 
 class UCResolver(object):
     """
@@ -34,6 +61,57 @@ class UCResolver(object):
         self.instrs     = UCInstructionCollection()
         self.program    = UCProgram()
         self.enable_coalescing = False
+        self.enable_unreachable_removal = False
+        self.enable_scheduling = False
+        self.enable_threading  = False
+        self.enable_minimisation = False
+        self.enable_register_sharing = False
+
+        # Number of flip-flops saved by register sharing.
+        self.flops_saved = 0
+
+        # Compute operators whose cost class weighs at least share_min_cost
+        # and which are at least share_min_width bits wide with functional
+        # units shared between states.
+        self.enable_operator_sharing = False
+        self.share_min_cost  = UCCostDefaults["mul"]
+        self.share_min_width = 8
+
+        # Merge branch diamonds whose arms have at most this many
+        # statements each into one state of predicated statements.
+        self.enable_if_conversion      = False
+        self.max_predicated_statements = 2
+
+        # Number of copies of each inner loop to make, where 1 disables
+        # unrolling, and an optional limit on the number of states that
+        # unrolling may grow the program to.
+        self.unroll_factor = 1
+        self.max_states    = None
+
+        # How the states of the optimised program are encoded. One of the
+        # UCStateEncodings.
+        self.state_encoding = UCStateEncodingBinary
+
+        # Operator delay weights, and the largest critical path cost a
+        # block may reach through coalescing. None means no limit.
+        self.cost_model     = UCCostModel()
+        self.max_cycle_cost = None
+
+        # Optional UCProfile of block visit counts. Blocks which take at
+        # least hot_fraction of the profiled cycles are hot: they are
+        # coalesced first, and may absorb copies of small join blocks.
+        self.profile        = None
+        self.hot_fraction   = 0.01
+        self.max_duplicate_statements = 8
+        self.duplicated     = {}
+
+        # Optional UCStats which records each pass of resolve() as a phase.
+        self.stats          = None
+
+        # Maps each UCInstruction definition onto the program variables
+        # named by the identifiers of its statements which are not
+        # arguments.
+        self.resolved_vars  = {}
 
     def addVariables(self, variables):
         for v in variables.by_index:
@@ -110,10 +188,19 @@ class UCResolver(object):
                 or constant type. Is it properly defined?" % 
                     (argument.name, instr.name))
 
-        tr               = copy.deepcopy(instr)
-        tr.resolved_args = resolved_args
-        tr.resolved      = True
-        return tr
+        # Identifiers in the statements which are not arguments refer
+        # directly to program variables, the same ones for every use.
+        resolved_vars = self.resolved_vars.get(instr, None)
+        if(resolved_vars == None):
+            resolved_vars = {}
+            for name in instr.identifiers():
+                if(instr.get_argument(name) == None):
+                    var = self.getVariable(name)
+                    if(var != None):
+                        resolved_vars[name] = var
+            self.resolved_vars[instr] = resolved_vars
+
+        return instr.resolved_with(resolved_args, resolved_vars)
 
 
     def resolveInstructions(self):
@@ -185,28 +272,82 @@ class UCResolver(object):
 
             block.resolved = True
 
-    def check_reads_and_writes(self):
+        self.program.build_flow_graph()
+
+    def check_state_variables(self):
         """
-        Looks over the program blocks and notifies when we write to a
-        variable more than once in a single block.
-        TODO - implement this!
+        Report any variable which is jumped to, and so holds a state
+        encoding, but is narrower than the state register. Raises a
+        UCResolverError if there are any, since the design would jump to
+        the wrong state.
         """
+        checked = set([])
+        narrow  = []
         for block in self.program.blocks:
+            for fc in block.flow_change:
+                var = fc.target
+                if(not fc.to_variable or var in checked):
+                    continue
+                checked.add(var)
+                if(var.width < self.program.state_width):
+                    self.log.error("Variable '%s' is jumped to, but is %d bits wide and states need %d bits" %
+                        (var.name, var.width, self.program.state_width))
+                    narrow.append(var.name)
+        if(narrow):
+            raise UCResolverError("Jumped to variables %s are narrower than the %d bit %s state register" %
+                (", ".join(narrow), self.program.state_width,
+                 self.program.state_encoding))
+
+
+    def block_cost(self, block):
+        """
+        Return the estimated critical path cost of a single block, using
+        the resolver's cost model.
+        """
+        return self.cost_model.block_cost(block.statements, block.flow_change)
+
+    def max_block_cost(self):
+        """
+        Return the highest critical path cost of any block in the program.
+        """
+        return max([self.block_cost(b) for b in self.program.blocks] + [0])
 
-            reads, writes = block.read_write_sets()
+    def heat(self, block):
+        """
+        Return the number of profiled cycles spent in a block, or zero if
+        there is no profile.
+        """
+        if(self.profile == None):
+            return 0
+        return self.profile.block_count(block.name)
+
+    def is_hot(self, block):
+        """
+        Return true if the profile shows that a block is executed often
+        enough to be worth optimising at the expense of program size.
+        """
+        if(self.profile == None or self.profile.cycles == 0):
+            return False
+        heat = self.heat(block)
+        return heat > 0 and heat >= self.hot_fraction * self.profile.cycles
 
+    def reads_current_state(self, block):
+        """
+        Return true if any instruction in a block reads the state register,
+        whose value depends on which state the instruction is placed in.
+        """
+        for instr in block.statements:
+            if("_current_state_" in instr.resolved_args.values() or
+               "_current_state_" in instr.identifiers()):
+                return True
+        return False
 
     def incoming_blocks(self,block):
         """
         Given an instance of a block, return a list of blocks which might
         jump into it.
         """
-        tr = []
-        for b in self.program.blocks:
-            for flowchange in b.flow_change:
-                if flowchange.target== block:
-                    tr.append(b)
-        return tr
+        return self.program.flow_graph.predecessors(block)
 
     def outgoing_blocks (self,block):
         """
@@ -215,102 +356,262 @@ class UCResolver(object):
         """
         assert type(block) == UCProgramBlock, "Type should be UCProgramBlock\
  but instead is '%s'" % type(block)
-        tr = []
-        for flowchange in block.flow_change:
-            if(type(flowchange.target) == UCProgramBlock):
-                tr.append(flowchange.target)
-        return tr
+        return self.program.flow_graph.successors(block)
+
+    def reachable_blocks(self):
+        """
+        Return the set of blocks which can be reached from the main block.
+        Blocks which are de-referenced with `*block` are also roots, since
+        their state encoding can be loaded into a variable and jumped to.
+        Each block and flow graph edge is visited at most once.
+        """
+        graph = self.program.flow_graph
+        main  = self.program.getBlock("main")
+
+        roots = [b for b in self.program.blocks if b.gets_dereferenced]
+        if(main != None):
+            roots.insert(0, main)
+        else:
+            self.log.error("Program has no 'main' block")
+
+        reached = set(roots)
+        queue   = collections.deque(roots)
+
+        while(len(queue) > 0):
+            block = queue.popleft()
+            for target in graph.successors(block):
+                if(not target in reached):
+                    reached.add(target)
+                    queue.append(target)
+
+        return reached
 
     def remove_unreachable_blocks(self):
         """
-        Removes all unreachable blocks from the program
+        Removes all blocks which cannot be reached from the main block or
+        a de-referenced block. Returns a tuple of the number of states and
+        statements removed. Statements of blocks which were merged into
+        another block by coalescing are not counted, since they still
+        execute.
         """
-        newlist = []
+        reached  = self.reachable_blocks()
+        toremove = []
+        statements = 0
         for block in self.program.blocks:
             
-            inset   = self.incoming_blocks(block)
-            outset  = self.outgoing_blocks(block)
-
-            if(len(inset) + len(outset) == 0 or block.removable):
+            if(not block in reached):
                 self.log.info("Removing un-reachable block: '%s'" % block.name)
-            else:
-                newlist.append(block)
-        self.program.blocks = newlist
+                toremove.append(block)
+                if(not block.removable):
+                    statements += len(block.statements)
+
+        self.program.remove_blocks(toremove)
+
+        self.log.info(">> Removed %d un-reachable states with %d statements" %
+            (len(toremove), statements))
+
+        return (len(toremove), statements)
 
 
     def coalesce_blocks(self, parent, child):
         """
-        Merge two blocks together.
+        Merge two blocks together. Any other jumps into the child are
+        re-targeted to the parent, unless the child is de-referenced
+        elsewhere or has other predecessors, and so must be kept. In that
+        case the parent gets its own copies of the child's flow change
+        objects.
         """
 
         self.log.debug("O: Merging block %s into %s" % (child.name,parent.name))
 
-        parent.statements += child.statements
-        parent.flow_change = child.flow_change
-        parent.src_statements += child.src_statements
+        graph = self.program.flow_graph
+        keep  = child.gets_dereferenced or graph.in_degree(child) > 1
 
-        for block in self.program.blocks:
-            for fc in block.flow_change:
-                if(fc.target == child):
-                    fc.target = parent
+        parent.merged(child)
+
+        if(keep):
+            graph.set_flow_change(parent,
+                [copy.copy(fc) for fc in child.flow_change])
+        else:
+            flow_change = child.flow_change
+            graph.set_flow_change(child, [])
+            graph.set_flow_change(parent, flow_change)
+            graph.retarget_all(child, parent)
 
         return parent
 
 
+    def coalesce_candidate(self, parent):
+        """
+        Return the block which can be merged into the end of parent, or
+        None if there is no such block.
+        """
+        if(parent.name == "main"):
+            return None
+
+        # Only an unconditional jump to another block can be merged away.
+        if(len(parent.flow_change) != 1):
+            return None
+
+        flow_change = parent.flow_change[0]
+        if(flow_change.conditional or flow_change.to_variable):
+            return None
+
+        candidate = flow_change.target
+        if(candidate is parent or candidate.name == "main"):
+            return None
+
+        # If multiple things target this block, it can only be copied into
+        # the end of a hot parent.
+        if(self.program.flow_graph.in_degree(candidate) > 1 and
+           not self.duplicate_candidate(parent, candidate)):
+            return None
+
+        reads, writes = parent.read_write_masks()
+        crd  , cwr    = candidate.read_write_masks()
+
+        # Avoid read after write hazards.
+        if(crd & writes): return None
+        if(cwr & writes): return None
+
+        # Keep the critical path of the merged state within budget.
+        if(self.max_cycle_cost != None):
+            cost = self.cost_model.block_cost(
+                parent.statements + candidate.statements,
+                candidate.flow_change)
+            if(cost > self.max_cycle_cost): return None
+
+        return candidate
+
+
+    def duplicate_candidate(self, parent, candidate):
+        """
+        Return true if a copy of candidate, which has other predecessors,
+        should be merged into the end of parent. Each parent copies a given
+        block at most once, so chains of copies always end.
+        """
+        if(not self.is_hot(parent)):
+            return False
+        if(candidate in self.duplicated.get(parent, set([]))):
+            return False
+        if(len(candidate.statements) > self.max_duplicate_statements):
+            return False
+        return not self.reads_current_state(candidate)
+
+
     def coalesce_program(self):
         """
         Modifys the program by coalescing blocks which appear in sequence
         and which are orthogonal into a single block.
-        """
 
-        changes = 0
+        Blocks are visited in program order from a worklist. The program
+        flow graph, and each block's cached read and write masks, are kept
+        up to date as blocks merge, so nothing is re-scanned. A parent which
+        absorbs a removable child is re-visited straight away so that whole
+        chains collapse into it.
 
-        for i in range(0,len(self.program.blocks)):
-            block = self.program.blocks[i]
+        With a profile, the hottest blocks are visited first, so they get
+        the first claim on any cycle cost budget, and hot blocks may also
+        absorb copies of small blocks with several predecessors. Returns
+        the number of merges performed.
+        """
 
-            self.log.debug("C: %s" % block.name)
+        blocks   = self.program.blocks
+        graph    = self.program.flow_graph
+        heat     = [self.heat(b) for b in blocks]
+        saved    = 0
+        self.duplicated = {}
+
+        # Min-heap of (-heat, program index) still to be visited. Parents
+        # which absorb a kept child are only re-visited after the next
+        # removable merge, matching the original restarting behaviour.
+        worklist = [(-heat[i], i) for i in range(0, len(blocks))]
+        heapq.heapify(worklist)
+        queued   = set(range(0, len(blocks)))
+        deferred = []
+        changes  = 0
+
+        while(len(worklist) > 0):
+            h, i   = heapq.heappop(worklist)
+            queued.discard(i)
+            parent = blocks[i]
+
+            if(parent.removable):
+                continue
 
-            inset   = self.incoming_blocks(block)
-            outset  = self.outgoing_blocks(block)
+            self.log.debug("C: %s" % parent.name)
 
-            if(block.name == "main"):
-                continue
-            
-            if(len(inset) + len(outset) == 0):
-                block.removable = True and not candidate.gets_dereferenced
+            candidate = self.coalesce_candidate(parent)
+            if(candidate == None):
                 continue
-            
-            # Reads and writes for the parent block.
-            reads,writes = block.read_write_sets()
 
-            if(len(outset) == 1):
-                candidate = outset[0]
-                cin      = self.incoming_blocks(candidate)
-                cout     = self.outgoing_blocks(candidate)
+            copied = graph.in_degree(candidate) > 1
+            if(copied):
+                self.duplicated.setdefault(parent, set([])).add(candidate)
+                saved += heat[i]
+            else:
+                saved += self.heat(candidate)
+
+            self.coalesce_blocks(parent, candidate)
+            changes += 1
+
+            if(copied):
+                # The parent now ends with the copied flow changes, which
+                # may lead on to more blocks worth merging.
+                heapq.heappush(worklist, (-heat[i], i))
+                queued.add(i)
+            elif(candidate.gets_dereferenced):
+                deferred.append(i)
+            else:
+                candidate.removable = True
+                deferred.append(i)
+                for j in deferred:
+                    if(not j in queued):
+                        heapq.heappush(worklist, (-heat[j], j))
+                        queued.add(j)
+                deferred = []
+
+        if(self.profile != None):
+            self.log.info(">> Profile: %d merges save an estimated %d of %d cycles" %
+                (changes, saved, self.profile.cycles))
 
-                # Reads and writes for the candidate merge block
-                crd, cwr = candidate.read_write_sets()
+        return changes
 
-                # If multiple things target this block, we cannot merge it
-                # safely.
-                if(len(cin) > 1): continue
 
-                # Avoid read after write hazards.
-                if(not crd.isdisjoint(writes)): continue
-                if(not cwr.isdisjoint(writes)): continue
-                
-                self.program.blocks[i] = self.coalesce_blocks(block,candidate)
-                candidate.removable = True and not candidate.gets_dereferenced
-                if(candidate.removable):
-                    changes += 1
-                    break
+    def thread_program(self):
+        """
+        Re-target jumps through blocks which have no statements straight to
+        where they lead. Returns the number of blocks whose flow changes
+        were changed.
+        """
+        threader = UCJumpThreader(self)
+        changes  = threader.thread_program()
+        self.log.info(">> Threading changed the flow of %d states" % changes)
+        if(self.profile != None):
+            self.log.info(">> Profile: threading saves an estimated %d of %d cycles" %
+                (threader.saved, self.profile.cycles))
+        return changes
 
-        if(changes > 0):
-            self.remove_unreachable_blocks()
-            changes = self.coalesce_program()
 
-        return changes
+    def counters(self):
+        """
+        Return a dict of the sizes of the program, recorded before and
+        after each phase of resolve().
+        """
+        return {
+            "blocks"     : len(self.program.blocks),
+            "statements" : sum(len(b.statements) for b in self.program.blocks),
+            "variables"  : len(self.variables.by_index)
+        }
 
+    def phase(self, name):
+        """
+        Return a context manager which records the code run inside it as a
+        phase of the resolver's stats, if it has any.
+        """
+        if(self.stats == None):
+            return contextlib.nullcontext()
+        return self.stats.phase(name, self.counters)
 
     def resolve(self):
         """
@@ -326,10 +627,58 @@ class UCResolver(object):
         - Variable widths must be consistant.
         """
         
-        self.resolveInstructions()
-        self.check_reads_and_writes()
+        with self.phase("resolve instructions"):
+            self.resolveInstructions()
+        if(self.unroll_factor > 1):
+            with self.phase("unroll"):
+                unroller = UCLoopUnroller(self)
+                added    = unroller.unroll_program()
+            self.log.info(">> Unrolling added %d states" % added)
+        if(self.enable_scheduling):
+            with self.phase("schedule"):
+                scheduler = UCListScheduler(self)
+                removed   = scheduler.schedule_program()
+            self.log.info(">> Scheduling removed %d states" % removed)
         if(self.enable_coalescing):
             self.log.info(">> Pre-coalesce state count: %d" % len(self.program.blocks))
-            self.coalesce_program()
-            self.remove_unreachable_blocks()
+            with self.phase("coalesce"):
+                self.coalesce_program()
+        if(self.enable_if_conversion):
+            with self.phase("if-convert"):
+                converter = UCIfConverter(self)
+                converted = converter.convert_program()
+                self.log.info(">> If-conversion merged %d branches" % converted)
+                if(converted > 0 and self.enable_coalescing):
+                    self.coalesce_program()
+        if(self.enable_threading):
+            with self.phase("thread"):
+                self.thread_program()
+        if(self.enable_coalescing or self.enable_threading or
+           self.enable_minimisation or self.enable_unreachable_removal):
+            with self.phase("remove unreachable"):
+                self.remove_unreachable_blocks()
+        if(self.enable_minimisation):
+            with self.phase("minimise"):
+                minimiser = UCStateMinimiser(self)
+                removed   = minimiser.minimise_program()
+            self.log.info(">> Minimisation merged %d equivalent states" % removed)
+        if(self.enable_coalescing):
             self.log.info(">> Post-coalesce state count %d" % len(self.program.blocks))
+        if(self.enable_register_sharing):
+            with self.phase("share registers"):
+                allocator = UCRegisterAllocator(self)
+                self.flops_saved = allocator.allocate_program()
+            self.log.info(">> Register sharing saved %d flops in %d variables" %
+                (self.flops_saved, len(allocator.mapping)))
+
+        with self.phase("encode states"):
+            self.program.encode_states(self.state_encoding, self.profile)
+            self.check_state_variables()
+        if(self.enable_operator_sharing):
+            with self.phase("share operators"):
+                binder  = UCOperatorBinder(self)
+                removed = binder.bind_program()
+            self.log.info(">> Operator sharing replaced %d operators with %d shared units" %
+                (removed + len(binder.units), len(binder.units)))
+
+        self.log.info(">> Maximum cycle cost: %s" % self.max_block_cost())
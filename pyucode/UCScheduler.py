@@ -0,0 +1,240 @@
+
+"""
+Classes and functions for packing the instructions of a source block into
+as few states (clock cycles) as their dependencies allow.
+"""
+
+import logging
+
+class UCListScheduler(object):
+    """
+    A list scheduler which works on the chains of atomic blocks created by
+    UCProgramBlock.atomised. The instructions of each chain form a
+    dependency graph, using their resolved read / write masks:
+
+    - Read after write and write after write dependencies must be in a
+      strictly later cycle, since a state only sees the values registered
+      at the end of the previous one.
+    - Write after read dependencies may share a cycle, as may two
+      instructions which both use ports. Ports are never re-ordered, so
+      any handshake seen on them keeps its order.
+
+    Instructions are then assigned to cycles in order of their longest
+    path to the end of the block, subject to the resolver's cycle cost
+    budget. The flow changes of the chain stay in its final state.
+    """
+
+    def __init__(self, resolver):
+        """
+        Create a new scheduler for the program held by a resolver whose
+        instructions have already been resolved.
+        """
+        self.log      = logging.getLogger(__name__)
+        self.resolver = resolver
+        self.program  = resolver.program
+
+        self.port_mask = 0
+        for var in resolver.variables.getPorts():
+            self.port_mask |= var.bit
+
+    def chains(self):
+        """
+        Return a list of chains of blocks which came from the same source
+        block, and which are only ever entered at the start of the chain.
+        """
+        graph   = self.program.flow_graph
+        visited = set([])
+        tr      = []
+
+        for block in self.program.blocks:
+            if(block in visited):
+                continue
+
+            chain = [block]
+            visited.add(block)
+
+            while(True):
+                tail = chain[-1]
+                if(len(tail.flow_change) != 1):
+                    break
+                fc = tail.flow_change[0]
+                if(fc.conditional or not graph.is_edge(fc)):
+                    break
+                nxt = fc.target
+                if(nxt in visited or
+                   nxt.source_name != block.source_name or
+                   nxt.gets_dereferenced or
+                   graph.in_degree(nxt) != 1):
+                    break
+                chain.append(nxt)
+                visited.add(nxt)
+
+            tr.append(chain)
+
+        return tr
+
+    def dependencies(self, instrs, flow_change):
+        """
+        Build the dependency graph for a list of instructions in program
+        order. Returns a tuple of (strict, weak, flow) where strict[j] and
+        weak[j] list the instructions which j must come strictly after, or
+        not before. flow lists the instructions whose writes the flow
+        changes must see, so which must finish before the final cycle.
+        """
+        masks  = [i.read_write_masks() for i in instrs]
+        strict = [[] for i in instrs]
+        weak   = [[] for i in instrs]
+
+        for j in range(0, len(instrs)):
+            rj, wj = masks[j]
+            for i in range(0, j):
+                ri, wi = masks[i]
+                if((wi & rj) or (wi & wj)):
+                    strict[j].append(i)
+                elif((ri & wj) or
+                     ((ri | wi) & self.port_mask and
+                      (rj | wj) & self.port_mask)):
+                    weak[j].append(i)
+
+        # The conditions, and any variable jumped to, are evaluated
+        # alongside the last instruction, so they see the writes of every
+        # instruction before it.
+        cond_mask = 0
+        for fc in flow_change:
+            if(fc.conditional):
+                cond_mask |= fc.variable.bit
+            if(fc.to_variable):
+                cond_mask |= fc.target.bit
+
+        flow = [i for i in range(0, len(instrs) - 1) if masks[i][1] & cond_mask]
+
+        return (strict, weak, flow, cond_mask)
+
+    def heights(self, strict, weak):
+        """
+        Return the length of the longest path from each instruction to the
+        end of the dependency graph, counting strict edges only.
+        """
+        tr = [0] * len(strict)
+        for j in reversed(range(0, len(strict))):
+            for i in strict[j]:
+                tr[i] = max(tr[i], tr[j] + 1)
+            for i in weak[j]:
+                tr[i] = max(tr[i], tr[j])
+        return tr
+
+    def schedule(self, instrs, flow_change):
+        """
+        Assign each instruction in the list to a cycle. Returns a tuple of
+        the list of cycle numbers, one per instruction, and the number of
+        cycles needed including the one which evaluates the flow changes.
+        """
+        strict, weak, flow, cond_mask = self.dependencies(instrs, flow_change)
+        height = self.heights(strict, weak)
+        budget = self.resolver.max_cycle_cost
+        cost   = self.resolver.cost_model
+
+        cycle_of  = {}
+        remaining = list(range(0, len(instrs)))
+        c         = 0
+
+        while(len(remaining) > 0):
+            placed = []
+
+            while(True):
+                ready = [j for j in remaining
+                    if all(cycle_of.get(i, c) < c for i in strict[j]) and
+                       all(i in cycle_of for i in weak[j])]
+                ready.sort(key = lambda j: (-height[j], j))
+
+                chosen = None
+                for j in ready:
+                    if(budget != None and len(placed) > 0):
+                        trial = [instrs[k] for k in placed + [j]]
+                        if(cost.block_cost(trial, []) > budget):
+                            continue
+                    chosen = j
+                    break
+
+                if(chosen == None):
+                    break
+
+                cycle_of[chosen] = c
+                placed.append(chosen)
+                remaining.remove(chosen)
+
+            c += 1
+
+        tr   = [cycle_of[j] for j in range(0, len(instrs))]
+        last = max(tr)
+        if(any(tr[i] == last for i in flow)):
+            last += 1
+
+        # Any instruction which writes a condition variable after the
+        # others must still share the final state with the flow changes.
+        final = len(instrs) - 1
+        if(instrs[final].read_write_masks()[1] & cond_mask):
+            tr[final] = last
+
+        return (tr, last + 1)
+
+    def schedule_chain(self, chain):
+        """
+        Re-pack the instructions of a chain of blocks into as few of them
+        as possible. Returns the number of blocks removed. Chains which
+        read the state register are left alone, since moving an
+        instruction to another state changes the value it reads.
+        """
+        if(any(self.resolver.reads_current_state(b) for b in chain)):
+            return 0
+
+        instrs = []
+        srcs   = []
+        lines  = []
+        for block in chain:
+            instrs += block.statements
+            srcs   += block.src_statements
+            lines  += block.src_lines
+
+        if(len(instrs) <= 1 or len(srcs) != len(instrs)):
+            return 0
+
+        cycles, count = self.schedule(instrs, chain[-1].flow_change)
+
+        if(count >= len(chain)):
+            return 0
+
+        graph = self.program.flow_graph
+
+        for k in range(0, count):
+            block = chain[k]
+            block.statements     = [instrs[j] for j in range(0, len(instrs))
+                                    if cycles[j] == k]
+            block.src_statements = [srcs[j]   for j in range(0, len(srcs))
+                                    if cycles[j] == k]
+            block.src_lines      = [lines[j]  for j in range(0, len(lines))
+                                    if cycles[j] == k]
+            block.invalidate_read_write_sets()
+
+        flow_change = chain[-1].flow_change
+        graph.set_flow_change(chain[-1], [])
+        graph.set_flow_change(chain[count-1], flow_change)
+        chain[count-1].invalidate_read_write_sets()
+
+        self.program.remove_blocks(chain[count:])
+
+        self.log.info("Scheduled block '%s' into %d states rather than %d" %
+            (chain[0].source_name, count, len(chain)))
+
+        return len(chain) - count
+
+    def schedule_program(self):
+        """
+        Schedule every chain of atomic blocks in the program. Returns the
+        total number of states removed.
+        """
+        removed = 0
+        for chain in self.chains():
+            if(len(chain) > 1):
+                removed += self.schedule_chain(chain)
+        return removed
@@ -0,0 +1,653 @@
+
+"""
+Classes and functions for compiling a resolved program into specialised
+Python functions, so that it can be simulated much faster than by walking
+statement trees every cycle.
+"""
+
+import hashlib
+import logging
+
+from .UCInstructionStatement import UCExprConstant
+from .UCInstructionStatement import UCExprIdentifier
+from .UCInstructionStatement import UCExprSelect
+from .UCInstructionStatement import UCExprUnary
+from .UCInstructionStatement import UCExprBinary
+from .UCInstructionStatement import UCExprTernary
+from .UCInstructionStatement import UCExprParen
+from .UCInstructionStatement import UCExprConcat
+from .UCInstructionStatement import UCExprReplicate
+from .UCInstructionStatement import UCExprCall
+
+from .UCProgram   import UCProgramFlowIfEqz
+from .UCState     import UCProgramVariable
+from .UCSimulator import UCSimulator
+from .UCSimulator import UCSimCompareOps
+from .UCSimulator import UCSimLogicalOps
+from .UCSimulator import UCSimShiftOps
+from .UCSimulator import mask_of
+
+# Helper functions available to every compiled program.
+UCSimPrelude = '''
+def _sgn(x, w):
+    return x - (1 << w) if (x >> (w - 1)) & 1 else x
+
+def _asr(x, w, n):
+    return _sgn(x, w) >> n
+
+def _ext(x, ow, w):
+    if (x >> (ow - 1)) & 1:
+        x |= ((1 << w) - 1) & ~((1 << ow) - 1)
+    return x
+
+def _bit(x, i):
+    return (x >> i) & 1 if i >= 0 else 0
+
+def _put(x, y, hi, lo, tlo, tw):
+    if lo < tlo or hi >= tlo + tw or hi < lo:
+        return x
+    m = (1 << (hi - lo + 1)) - 1
+    s = lo - tlo
+    return (x & ~(m << s)) | ((y & m) << s)
+
+def _rep(x, w, n):
+    tr = 0
+    for i in range(n):
+        tr = (tr << w) | x
+    return tr
+
+def _parity(x):
+    return bin(x).count('1') & 1
+
+def _div(a, b, w, s, rem):
+    if b == 0:
+        return 0
+    if not s:
+        return a % b if rem else a // b
+    a, b = _sgn(a, w), _sgn(b, w)
+    q = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        q = -q
+    return ((a - q * b) if rem else q) & ((1 << w) - 1)
+'''
+
+# Compiled code objects, keyed by the hash of the program they simulate.
+_code_cache = {}
+
+
+class UCSimCompiler(object):
+    """
+    Generates the source of a Python module which simulates a program. Each
+    block becomes a function `s_<encoding>(v)`, where v is the dict of
+    current variable values. Every statement is turned into a python
+    expression, with variable widths folded into constant masks and any
+    sub-expression without variables folded into a literal. Next values
+    are kept in locals until the end of the function, which then writes
+    them back and returns the encoding of the next state. The module ends
+    with a `dispatch` table from state encodings to block functions, and a
+    `wires` function which updates the comb variables, or None.
+    """
+
+    def __init__(self, sim):
+        """
+        Create a compiler for the program held by a UCSimulator, sharing
+        its identifier bindings and sizing rules.
+        """
+        self.log       = logging.getLogger(__name__)
+        self.sim       = sim
+        self.evaluator = sim.evaluator
+        self.temps     = 0
+        self.prelude   = UCSimPrelude
+
+    def program_hash(self):
+        """
+        Return a digest of everything the generated code depends on: the
+        variable declarations, state encodings, synthesised statements and
+        flow changes of every block.
+        """
+        program = self.sim.program
+        h       = hashlib.sha1()
+
+        for v in self.sim.resolver.variables.by_index:
+            h.update(("%s %d %d %d %d %s\n" % (v.name, v.port_type, v.var_type,
+                v.hi, v.lo, v.comb_expr)).encode())
+
+        h.update(("main %d %d\n" % (self.sim.main_encoding,
+            self.sim.state_var.width)).encode())
+
+        for block in program.blocks:
+            h.update(("block %d\n" % program.get_block_encoding(block)).encode())
+            for line in program.synth_block_statements(block, annotate=False):
+                h.update(line.encode())
+            for line in program.synth_flowchanges(block):
+                h.update(line.encode())
+
+        return h.hexdigest()
+
+    def is_constant(self, node, names):
+        """
+        Returns True if an expression does not read any program variables,
+        apart from the current state which is known for each block.
+        """
+        for n in node.walk():
+            if(type(n) != UCExprIdentifier):
+                continue
+            target = self.evaluator.lookup(n.name, names)
+            if(target is self.sim.state_var or target == None):
+                continue
+            if(type(target) == UCProgramVariable):
+                return False
+            if(not self.is_constant(target, {})):
+                return False
+        return True
+
+    def read(self, var):
+        """
+        Return the python code which reads the current value of a variable.
+        """
+        return "v[%r]" % var.name
+
+    def flag(self, condition):
+        """
+        Return python code which turns a boolean condition into 1 or 0.
+        """
+        return "(1 if %s else 0)" % condition
+
+    def choose(self, condition, if_true, if_false):
+        """
+        Return python code which selects between two values depending on
+        whether condition is non-zero.
+        """
+        return "(%s if %s else %s)" % (if_true, condition, if_false)
+
+    def logical(self, a, op, b):
+        """
+        Return python code for a verilog `&&` or `||` of two values.
+        """
+        return self.flag("%s %s %s" % (a, "and" if op == "&&" else "or", b))
+
+    def width(self, node, names):
+        return self.evaluator.width(node, names, {})
+
+    def is_signed(self, node, names):
+        return self.evaluator.is_signed(node, names)
+
+    def expr_self(self, node, names, state):
+        """
+        Return python code for an expression at its self-determined width.
+        """
+        return self.expr(node, self.width(node, names),
+                         self.is_signed(node, names), names, state)
+
+    def expr(self, node, width, signed, names, state):
+        """
+        Return python code which evaluates an expression in a context of
+        the supplied width and signedness, mirroring
+        UCSimEvaluator.evaluate.
+        """
+        if(self.is_constant(node, names)):
+            return "%d" % self.evaluator.evaluate(node, width, signed, names,
+                {self.sim.state_var.name: state})
+
+        t = type(node)
+        m = "0x%x" % mask_of(width)
+
+        if(t == UCExprParen):
+            return self.expr(node.operand, width, signed, names, state)
+
+        elif(t == UCExprTernary):
+            return self.choose(
+                self.expr_self(node.condition, names, state),
+                self.expr(node.if_true, width, signed, names, state),
+                self.expr(node.if_false, width, signed, names, state))
+
+        elif(t == UCExprUnary and node.op in ("~", "-", "+")):
+            x = self.expr(node.operand, width, signed, names, state)
+            if(node.op == "~"):
+                return "(~%s & %s)" % (x, m)
+            elif(node.op == "-"):
+                return "(-%s & %s)" % (x, m)
+            return x
+
+        elif(t == UCExprBinary and node.op in UCSimShiftOps):
+            a = self.expr(node.lhs, width, signed, names, state)
+            n = self.expr_self(node.rhs, names, state)
+            if(node.op in ("<<", "<<<")):
+                return "((%s << %s) & %s)" % (a, n, m)
+            elif(node.op == ">>>" and signed):
+                return "(_asr(%s, %d, %s) & %s)" % (a, width, n, m)
+            return "(%s >> %s)" % (a, n)
+
+        elif(t == UCExprBinary and not (node.op in UCSimCompareOps or
+                                        node.op in UCSimLogicalOps)):
+            a  = self.expr(node.lhs, width, signed, names, state)
+            b  = self.expr(node.rhs, width, signed, names, state)
+            op = node.op
+            if(op in ("+", "-", "*")):
+                return "((%s %s %s) & %s)" % (a, op, b, m)
+            elif(op in ("&", "|", "^")):
+                return "(%s %s %s)" % (a, op, b)
+            elif(op == "~&"):
+                return "(~(%s & %s) & %s)" % (a, b, m)
+            elif(op == "~|"):
+                return "(~(%s | %s) & %s)" % (a, b, m)
+            elif(op in ("~^", "^~")):
+                return "(~(%s ^ %s) & %s)" % (a, b, m)
+            return "_div(%s, %s, %d, %s, %s)" % (a, b, width, signed, op == "%")
+
+        code, own_width = self.leaf(node, names, state)
+        if(signed and own_width < width):
+            return "_ext(%s, %d, %d)" % (code, own_width, width)
+        elif(own_width > width):
+            return "(%s & %s)" % (code, m)
+        return code
+
+    def leaf(self, node, names, state):
+        """
+        Return a tuple of (python code, width) for a node which is always
+        sized by itself, mirroring UCSimEvaluator.leaf.
+        """
+        t = type(node)
+
+        if(t == UCExprIdentifier):
+            target = self.evaluator.lookup(node.name, names)
+            if(type(target) == UCProgramVariable):
+                return (self.read(target), target.width)
+            return (self.expr_self(target, {}, state), self.width(target, {}))
+
+        elif(t == UCExprSelect):
+            target = self.evaluator.lookup(node.operand.name, names)
+            if(type(target) == UCProgramVariable):
+                full, lo = self.read(target), target.lo
+            else:
+                full, lo = self.expr_self(target, {}, state), 0
+
+            if(node.lo == None):
+                if(self.is_constant(node.hi, names)):
+                    hi = self.evaluator.index(node.hi, names, {})
+                    if(hi < lo):
+                        return ("0", 1)
+                    return ("((%s >> %d) & 1)" % (full, hi - lo), 1)
+                return ("_bit(%s, %s - %d)" % (full,
+                    self.expr_self(node.hi, names, state), lo), 1)
+
+            hi     = self.evaluator.index(node.hi, names, {})
+            bottom = self.evaluator.index(node.lo, names, {})
+            width  = hi - bottom + 1
+            return ("((%s >> %d) & 0x%x)" % (full, bottom - lo, mask_of(width)),
+                    width)
+
+        elif(t == UCExprConcat or t == UCExprReplicate):
+            code, width = None, 0
+            for part in node.parts:
+                w = self.width(part, names)
+                p = self.expr_self(part, names, state)
+                code   = p if code == None else "((%s << %d) | %s)" % (code, w, p)
+                width += w
+            if(t == UCExprReplicate):
+                count = self.evaluator.value(node.count, names, {})
+                code  = "_rep(%s, %d, %d)" % (code, width, count)
+                width = width * count
+            return (code, width)
+
+        elif(t == UCExprCall):
+            if(not node.function in ("$signed", "$unsigned")):
+                return ("0", 32)
+            arg = node.args[0]
+            return (self.expr_self(arg, names, state), self.width(arg, names))
+
+        elif(t == UCExprUnary):
+            w = self.width(node.operand, names)
+            x = self.expr_self(node.operand, names, state)
+            if(node.op == "!"):
+                return (self.flag("%s == 0" % x), 1)
+            elif(node.op == "&"):
+                return (self.flag("%s == 0x%x" % (x, mask_of(w))), 1)
+            elif(node.op == "~&"):
+                return (self.flag("%s != 0x%x" % (x, mask_of(w))), 1)
+            elif(node.op == "|"):
+                return (self.flag("%s != 0" % x), 1)
+            elif(node.op == "~|"):
+                return (self.flag("%s == 0" % x), 1)
+            elif(node.op == "^"):
+                return ("_parity(%s)" % x, 1)
+            return ("(_parity(%s) ^ 1)" % x, 1)
+
+        elif(t == UCExprBinary and node.op in UCSimLogicalOps):
+            a = self.expr_self(node.lhs, names, state)
+            b = self.expr_self(node.rhs, names, state)
+            return (self.logical(a, node.op, b), 1)
+
+        elif(t == UCExprBinary):
+            w = max(self.width(node.lhs, names), self.width(node.rhs, names))
+            s = (self.is_signed(node.lhs, names) and
+                 self.is_signed(node.rhs, names))
+            a = self.expr(node.lhs, w, s, names, state)
+            b = self.expr(node.rhs, w, s, names, state)
+            if(s):
+                a, b = "_sgn(%s, %d)" % (a, w), "_sgn(%s, %d)" % (b, w)
+            return (self.flag("%s %s %s" % (a, node.op, b)), 1)
+
+        return ("0", 32)
+
+    def assign(self, lhs, code, width, names, written, lines, state):
+        """
+        Append the lines which write code, a python expression of at most
+        width bits, into the next value locals of an lvalue. Select
+        indices which read variables are worked out when the code runs.
+        """
+        t = type(lhs)
+
+        if(t == UCExprConcat):
+            self.temps += 1
+            temp = "t%d" % self.temps
+            lines.append("%s = %s" % (temp, code))
+            used = 0
+            for part in reversed(lhs.parts):
+                w = self.width(part, names)
+                shifted = "(%s >> %d)" % (temp, used) if used else temp
+                self.assign(part, shifted, width - used, names, written, lines,
+                            state)
+                used += w
+            return
+
+        ident  = lhs if t == UCExprIdentifier else lhs.operand
+        target = self.evaluator.lookup(ident.name, names)
+        if(type(target) != UCProgramVariable or
+           not target in self.sim.registers):
+            self.log.error("Cannot assign to non-register variable '%s'" %
+                ident.name)
+            return
+
+        local = "n_%s" % target.name
+
+        if(t == UCExprIdentifier):
+            if(width > target.width):
+                code = "%s & 0x%x" % (code, mask_of(target.width))
+            lines.append("%s = %s" % (local, code))
+            written[target.name] = local
+            return
+
+        bounds = [lhs.hi] if lhs.lo == None else [lhs.hi, lhs.lo]
+        if(not all(self.is_constant(b, names) for b in bounds)):
+            hi = self.expr_self(lhs.hi, names, state)
+            lo = hi if lhs.lo == None else self.expr_self(lhs.lo, names, state)
+            if(not target.name in written):
+                lines.append("%s = %s" % (local, self.read(target)))
+                written[target.name] = local
+            lines.append("%s = _put(%s, %s, %s, %s, %d, %d)" % (local, local,
+                code, hi, lo, target.lo, target.width))
+            return
+
+        hi = self.evaluator.index(lhs.hi, names, {})
+        lo = hi if lhs.lo == None else self.evaluator.index(lhs.lo, names, {})
+        if(lo < target.lo or hi > target.hi):
+            return
+
+        if(not target.name in written):
+            lines.append("%s = %s" % (local, self.read(target)))
+            written[target.name] = local
+
+        shift = lo - target.lo
+        keep  = mask_of(target.width) & ~(mask_of(hi - lo + 1) << shift)
+        lines.append("%s = (%s & 0x%x) | ((%s & 0x%x) << %d)" % (local, local,
+            keep, code, mask_of(hi - lo + 1), shift))
+
+    def flow(self, block):
+        """
+        Return python code for the encoding of the state after a block.
+        """
+        state_mask = mask_of(self.sim.state_var.width)
+        code       = "%d" % self.sim.main_encoding
+
+        for fc in reversed(block.flow_change):
+            if(fc.to_variable):
+                target = "(%s & 0x%x)" % (self.read(fc.target), state_mask)
+            else:
+                target = "%d" % self.sim.program.get_block_encoding(fc.target)
+
+            if(not fc.conditional):
+                code = target
+            else:
+                cmp  = "==" if fc.change_type == UCProgramFlowIfEqz else "!="
+                code = self.choose("%s %s 0" % (self.read(fc.variable), cmp),
+                    target, code)
+
+        return code
+
+    def gen_body(self, block):
+        """
+        Return a tuple of (lines, written, next_state) for one block: the
+        lines which compute the next values into locals, a dict mapping
+        each variable name written onto its local, and the code for the
+        next state encoding.
+        """
+        lines    = []
+        written  = {}
+        encoding = self.sim.program.get_block_encoding(block)
+        for instr in block.statements:
+            names = self.sim.names[instr]
+            kept  = self.predicate(instr, written, lines)
+            for statement in instr.statements:
+                if(not statement.is_parsed()):
+                    continue
+                lhs, rhs = statement.lhs, statement.rhs
+                width = max(self.width(lhs, names), self.width(rhs, names))
+                code  = self.expr(rhs, width, self.is_signed(rhs, names),
+                                  names, encoding)
+                self.assign(lhs, code, width, names, written, lines,
+                            encoding)
+            for local, old, enable in kept:
+                lines.append("%s = %s" % (local,
+                    self.choose(enable, local, old)))
+
+        return (lines, written, self.flow(block))
+
+    def predicate(self, instr, written, lines):
+        """
+        Append the lines which evaluate the predicate of an instruction and
+        keep the next values it may write. Returns a list of (local, old,
+        enable) tuples: once the instruction has run, each local must be
+        set back to old unless enable is non-zero.
+        """
+        if(len(instr.predicate) == 0):
+            return []
+
+        enable = None
+        for var, nonzero in instr.predicate:
+            test = self.flag("%s %s 0" % (self.read(var),
+                                          "!=" if nonzero else "=="))
+            enable = test if enable == None else \
+                     self.logical(enable, "&&", test)
+
+        self.temps += 1
+        name = "p%d" % self.temps
+        lines.append("%s = %s" % (name, enable))
+
+        tr = []
+        for var in sorted(instr.read_write_sets()[1], key=lambda v: v.name):
+            if(not var in self.sim.registers):
+                continue
+            local = "n_%s" % var.name
+            if(not var.name in written):
+                lines.append("%s = %s" % (local, self.read(var)))
+                written[var.name] = local
+            self.temps += 1
+            old = "t%d" % self.temps
+            lines.append("%s = %s" % (old, local))
+            tr.append((local, old, name))
+        return tr
+
+    def gen_block(self, block):
+        """
+        Return the source lines of the function which simulates one block.
+        """
+        lines, written, next_state = self.gen_body(block)
+
+        if(len(written) > 0):
+            lines.append("nxt = %s" % next_state)
+            for name, local in written.items():
+                lines.append("v[%r] = %s" % (name, local))
+            next_state = "nxt"
+        lines.append("return %s" % next_state)
+
+        tr = ["", "def s_%d(v):" % self.sim.program.get_block_encoding(block),
+              "    # %s" % self.sim.program.get_block_state_name(block)]
+        tr += ["    " + l for l in lines]
+        return tr
+
+    def wire_lines(self):
+        """
+        Return the list of (variable, code) pairs for every comb variable
+        whose expression reads other variables.
+        """
+        tr = []
+        for v, expr in self.sim.wire_exprs:
+            if(expr != None and not self.is_constant(expr, {})):
+                tr.append((v, self.expr(expr, v.width, False, {}, 0)))
+        return tr
+
+    def gen_wires(self):
+        """
+        Return the source lines of the wires function, which re-computes
+        every comb variable whose expression reads other variables.
+        """
+        lines = ["v[%r] = %s" % (v.name, code) for v, code in self.wire_lines()]
+
+        if(len(lines) == 0):
+            return ["", "wires = None"]
+        return ["", "def wires(v):"] + ["    " + l for l in lines]
+
+    def gen_source(self):
+        """
+        Return the full source of the compiled program module.
+        """
+        tr = [self.prelude]
+        for block in self.sim.program.blocks:
+            tr += self.gen_block(block)
+        tr += self.gen_wires()
+        tr += ["", "dispatch = {"]
+        tr += ["    %d : s_%d," % (e, e) for e in
+               sorted(self.sim.blocks_by_encoding)]
+        tr += ["}", ""]
+        return "\n".join(tr)
+
+    def build(self):
+        """
+        Return the namespace dict of the compiled program, re-using the
+        code object of an identical program compiled earlier.
+        """
+        key  = "%s-%s" % (type(self).__name__, self.program_hash())
+        code = _code_cache.get(key, None)
+
+        if(code == None):
+            self.log.info("Compiling simulation model %s" % key)
+            code = compile(self.gen_source(), "<%s>" % key, "exec")
+            _code_cache[key] = code
+
+        namespace = {}
+        exec(code, namespace)
+        return namespace
+
+
+class UCCompiledSimulator(UCSimulator):
+    """
+    A UCSimulator which runs each state through a compiled python function
+    from UCSimCompiler rather than by walking statement trees. The
+    behaviour is identical, it is just many times faster.
+    """
+
+    def __init__(self, resolver):
+        """
+        Create and compile a new simulator for a resolved program.
+        """
+        self.wires_function = None
+        UCSimulator.__init__(self, resolver)
+
+        namespace           = UCSimCompiler(self).build()
+        self.wires_function = namespace["wires"]
+        self.dispatch       = namespace["dispatch"]
+
+    def reset(self):
+        """
+        Reset the simulation. Constant wires are only evaluated here, by
+        the interpreter.
+        """
+        UCSimulator.reset(self)
+        UCSimulator.update_wires(self)
+
+    def update_wires(self):
+        """
+        Re-evaluate the comb variables which depend on other variables.
+        """
+        if(self.wires_function != None):
+            self.wires_function(self.values)
+
+    def execute(self, block):
+        """
+        Run the compiled function for a block, returning the next state.
+        """
+        return self.dispatch[self.program.get_block_encoding(block)](
+            self.values)
+
+    def run(self, cycles, until = None):
+        """
+        Simulate up to the given number of cycles, as UCSimulator.run. The
+        loop only leaves the compiled state functions to call the stimulus
+        and stop condition, if they are set. Tracing and profiling use the
+        slower per-cycle steps of UCSimulator.
+        """
+        if(self.trace != None or self.profile != None):
+            return UCSimulator.run(self, cycles, until)
+
+        values     = self.values
+        lookup     = self.dispatch.get
+        wires      = self.wires_function
+        stimulus   = self.stimulus
+        set_inputs = self.set_inputs
+        masks      = self.input_masks
+        state      = self.state
+        state_name = self.state_var.name
+        main       = self.main_encoding
+        start      = self.cycle
+        cycle      = start
+        end        = start + cycles
+
+        # Decided once, rather than comparing against None every cycle.
+        has_stimulus = stimulus != None
+        has_wires    = wires != None
+        has_until    = until != None
+
+        # Invalid state encodings go back to main.
+        to_main = lambda v: main
+
+        while(cycle < end):
+            if(has_stimulus):
+                self.state = state
+                self.cycle = cycle
+                inputs     = stimulus(cycle, self)
+                if(inputs):
+                    # set_inputs, without a method call per cycle.
+                    for name, value in inputs.items():
+                        mask = masks.get(name, None)
+                        if(mask == None):
+                            set_inputs({name: value})
+                        else:
+                            values[name] = value & mask
+            if(has_wires):
+                wires(values)
+
+            state  = lookup(state, to_main)(values)
+            cycle += 1
+
+            if(has_until):
+                self.state = state
+                self.cycle = cycle
+                values[state_name] = state
+                if(until(self)):
+                    break
+
+        self.state  = state
+        self.cycle  = cycle
+        values[state_name] = state
+        return cycle - start
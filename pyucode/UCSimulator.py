@@ -0,0 +1,759 @@
+
+"""
+Classes and functions for simulating a resolved program cycle by cycle,
+without needing to render and run the verilog.
+"""
+
+import logging
+
+from .UCInstructionStatement import UCInstructionStatement
+from .UCInstructionStatement import UCExprConstant
+from .UCInstructionStatement import UCExprIdentifier
+from .UCInstructionStatement import UCExprSelect
+from .UCInstructionStatement import UCExprUnary
+from .UCInstructionStatement import UCExprBinary
+from .UCInstructionStatement import UCExprTernary
+from .UCInstructionStatement import UCExprParen
+from .UCInstructionStatement import UCExprConcat
+from .UCInstructionStatement import UCExprReplicate
+from .UCInstructionStatement import UCExprCall
+
+from .UCProgram import UCProgramFlowIfEqz
+from .UCProgram import UCProgramFlowIfNez
+from .UCState   import UCProgramVariable
+from .UCState   import UCTypePortNone
+from .UCState   import UCTypeVarComb
+
+# Operators whose result is one bit wide, and whose operands are sized
+# independently of the surrounding expression.
+UCSimCompareOps = set(["==", "!=", "<", "<=", ">", ">="])
+UCSimLogicalOps = set(["&&", "||"])
+UCSimShiftOps   = set(["<<", ">>", "<<<", ">>>"])
+UCSimReduceOps  = set(["&", "|", "^", "~&", "~|", "~^", "^~"])
+
+
+def mask_of(width):
+    """
+    Return an integer with the bottom width bits set.
+    """
+    return (1 << width) - 1
+
+
+def to_signed(value, width):
+    """
+    Interpret the bottom width bits of value as a two's complement number.
+    """
+    if(width > 0 and (value >> (width - 1)) & 1):
+        return value - (1 << width)
+    return value
+
+
+class UCSimEvaluator(object):
+    """
+    Evaluates statement expression trees with verilog sizing rules. Each
+    node has a self-determined width and signedness. Arithmetic and bitwise
+    operators are evaluated at the width of their context, so that
+    `n_a = b + c` keeps the carry if a is wider than b and c. Comparisons,
+    reductions, shift amounts, concatenation parts and function arguments
+    are sized on their own.
+
+    Identifiers are looked up first in the per-instruction names dict, and
+    then in the global names dict. Each entry is either a program variable,
+    whose value is read from the values dict, or an expression tree which
+    is evaluated in the global scope, such as a constant argument.
+    """
+
+    def __init__(self, global_names):
+        """
+        Create a new evaluator, where global_names maps identifiers which
+        are visible everywhere onto variables or expression trees.
+        """
+        self.log          = logging.getLogger(__name__)
+        self.global_names = global_names
+        self.warned       = set([])
+
+    def lookup(self, name, names):
+        """
+        Return the variable or expression tree an identifier refers to, or
+        None if it is unknown.
+        """
+        tr = names.get(name, None)
+        if(tr == None):
+            tr = self.global_names.get(name, None)
+        if(tr == None and not name in self.warned):
+            self.warned.add(name)
+            self.log.warning("Unknown identifier '%s' will read as zero" % name)
+        return tr
+
+    def index(self, node, names, values):
+        """
+        Return the integer value of a select index expression.
+        """
+        return self.value(node, names, values)
+
+    def width(self, node, names, values):
+        """
+        Return the self-determined width of an expression in bits.
+        """
+        t = type(node)
+
+        if(t == UCExprIdentifier):
+            target = self.lookup(node.name, names)
+            if(target == None):
+                return 32
+            if(type(target) == UCProgramVariable):
+                return target.width
+            return self.width(target, {}, values)
+
+        elif(t == UCExprConstant):
+            return node.value_and_width()[1]
+
+        elif(t == UCExprSelect):
+            if(node.lo == None):
+                return 1
+            hi = self.index(node.hi, names, values)
+            lo = self.index(node.lo, names, values)
+            return abs(hi - lo) + 1
+
+        elif(t == UCExprUnary):
+            if(node.op in UCSimReduceOps or node.op == "!"):
+                return 1
+            return self.width(node.operand, names, values)
+
+        elif(t == UCExprBinary):
+            if(node.op in UCSimCompareOps or node.op in UCSimLogicalOps):
+                return 1
+            if(node.op in UCSimShiftOps):
+                return self.width(node.lhs, names, values)
+            return max(self.width(node.lhs, names, values),
+                       self.width(node.rhs, names, values))
+
+        elif(t == UCExprTernary):
+            return max(self.width(node.if_true, names, values),
+                       self.width(node.if_false, names, values))
+
+        elif(t == UCExprParen):
+            return self.width(node.operand, names, values)
+
+        elif(t == UCExprConcat):
+            return sum(self.width(p, names, values) for p in node.parts)
+
+        elif(t == UCExprReplicate):
+            count = self.value(node.count, names, values)
+            return count * sum(self.width(p, names, values) for p in node.parts)
+
+        elif(t == UCExprCall):
+            if(len(node.args) > 0):
+                return self.width(node.args[0], names, values)
+            return 32
+
+        return 32
+
+    def is_signed(self, node, names):
+        """
+        Returns True if an expression is signed. Only unsized decimal
+        literals, literals with an `s` base and `$signed` are signed on
+        their own. Operators are signed only if all of their context
+        sized operands are.
+        """
+        t = type(node)
+
+        if(t == UCExprConstant):
+            return ((not "'" in node.text) or
+                    node.text.partition("'")[2][:1] in "sS")
+
+        elif(t == UCExprIdentifier):
+            target = self.lookup(node.name, names)
+            if(target == None or type(target) == UCProgramVariable):
+                return False
+            return self.is_signed(target, {})
+
+        elif(t == UCExprUnary):
+            if(node.op in UCSimReduceOps or node.op == "!"):
+                return False
+            return self.is_signed(node.operand, names)
+
+        elif(t == UCExprBinary):
+            if(node.op in UCSimCompareOps or node.op in UCSimLogicalOps):
+                return False
+            if(node.op in UCSimShiftOps):
+                return self.is_signed(node.lhs, names)
+            return (self.is_signed(node.lhs, names) and
+                    self.is_signed(node.rhs, names))
+
+        elif(t == UCExprTernary):
+            return (self.is_signed(node.if_true, names) and
+                    self.is_signed(node.if_false, names))
+
+        elif(t == UCExprParen):
+            return self.is_signed(node.operand, names)
+
+        elif(t == UCExprCall):
+            return node.function == "$signed"
+
+        return False
+
+    def value(self, node, names, values):
+        """
+        Return the value of an expression at its self-determined width.
+        """
+        return self.evaluate(node, self.width(node, names, values),
+                             self.is_signed(node, names), names, values)
+
+    def extend(self, value, own_width, width, signed):
+        """
+        Extend a value from its own width to the context width, copying
+        the sign bit if the context is signed.
+        """
+        if(signed and own_width < width and (value >> (own_width - 1)) & 1):
+            value |= mask_of(width) & ~mask_of(own_width)
+        return value & mask_of(width)
+
+    def leaf(self, node, names, values):
+        """
+        Return a tuple of (value, width) for a node which is always sized
+        by itself.
+        """
+        t = type(node)
+
+        if(t == UCExprConstant):
+            return node.value_and_width()
+
+        elif(t == UCExprIdentifier):
+            target = self.lookup(node.name, names)
+            if(target == None):
+                return (0, 32)
+            if(type(target) == UCProgramVariable):
+                return (values.get(target.name, 0), target.width)
+            return (self.value(target, {}, values),
+                    self.width(target, {}, values))
+
+        elif(t == UCExprSelect):
+            target = self.lookup(node.operand.name, names)
+            if(type(target) == UCProgramVariable):
+                full, lo = values.get(target.name, 0), target.lo
+            elif(target != None):
+                full, lo = self.value(target, {}, values), 0
+            else:
+                full, lo = 0, 0
+
+            hi = self.index(node.hi, names, values)
+            if(node.lo == None):
+                return ((full >> (hi - lo)) & 1 if hi >= lo else 0, 1)
+            bottom = self.index(node.lo, names, values)
+            width  = hi - bottom + 1
+            return ((full >> (bottom - lo)) & mask_of(width), width)
+
+        elif(t == UCExprConcat or t == UCExprReplicate):
+            tr, width = 0, 0
+            for part in node.parts:
+                w      = self.width(part, names, values)
+                tr     = (tr << w) | self.value(part, names, values)
+                width += w
+            if(t == UCExprReplicate):
+                count = self.value(node.count, names, values)
+                part  = tr
+                tr    = 0
+                for i in range(0, count):
+                    tr = (tr << width) | part
+                width *= count
+            return (tr, width)
+
+        elif(t == UCExprCall):
+            if(not node.function in ("$signed", "$unsigned")):
+                if(not node.function in self.warned):
+                    self.warned.add(node.function)
+                    self.log.warning("Cannot simulate '%s', it will return zero" %
+                        node.function)
+                return (0, 32)
+            arg = node.args[0]
+            return (self.value(arg, names, values),
+                    self.width(arg, names, values))
+
+        elif(t == UCExprUnary):
+            operand = node.operand
+            w       = self.width(operand, names, values)
+            v       = self.value(operand, names, values)
+            if(node.op == "!"):
+                return (int(v == 0), 1)
+            elif(node.op == "&"):
+                return (int(v == mask_of(w)), 1)
+            elif(node.op == "~&"):
+                return (int(v != mask_of(w)), 1)
+            elif(node.op == "|"):
+                return (int(v != 0), 1)
+            elif(node.op == "~|"):
+                return (int(v == 0), 1)
+            elif(node.op == "^"):
+                return (bin(v).count("1") & 1, 1)
+            else:
+                return ((bin(v).count("1") & 1) ^ 1, 1)
+
+        else:
+            # Comparisons and logical operators.
+            if(node.op in UCSimLogicalOps):
+                a = self.value(node.lhs, names, values) != 0
+                b = self.value(node.rhs, names, values) != 0
+                if(node.op == "&&"):
+                    return (int(a and b), 1)
+                return (int(a or b), 1)
+
+            w = max(self.width(node.lhs, names, values),
+                    self.width(node.rhs, names, values))
+            s = (self.is_signed(node.lhs, names) and
+                 self.is_signed(node.rhs, names))
+            a = self.evaluate(node.lhs, w, s, names, values)
+            b = self.evaluate(node.rhs, w, s, names, values)
+            if(s):
+                a, b = to_signed(a, w), to_signed(b, w)
+
+            op = node.op
+            if(op == "=="):
+                return (int(a == b), 1)
+            elif(op == "!="):
+                return (int(a != b), 1)
+            elif(op == "<"):
+                return (int(a < b), 1)
+            elif(op == "<="):
+                return (int(a <= b), 1)
+            elif(op == ">"):
+                return (int(a > b), 1)
+            return (int(a >= b), 1)
+
+    def evaluate(self, node, width, signed, names, values):
+        """
+        Evaluate an expression in a context of the supplied width and
+        signedness. Returns an unsigned integer of at most width bits.
+        """
+        t = type(node)
+        m = mask_of(width)
+
+        if(t == UCExprParen):
+            return self.evaluate(node.operand, width, signed, names, values)
+
+        elif(t == UCExprTernary):
+            if(self.value(node.condition, names, values) != 0):
+                return self.evaluate(node.if_true, width, signed, names, values)
+            return self.evaluate(node.if_false, width, signed, names, values)
+
+        elif(t == UCExprUnary and node.op in ("~", "-", "+")):
+            v = self.evaluate(node.operand, width, signed, names, values)
+            if(node.op == "~"):
+                return ~v & m
+            elif(node.op == "-"):
+                return -v & m
+            return v
+
+        elif(t == UCExprBinary and node.op in UCSimShiftOps):
+            a = self.evaluate(node.lhs, width, signed, names, values)
+            n = self.value(node.rhs, names, values)
+            if(node.op in ("<<", "<<<")):
+                return (a << n) & m
+            elif(node.op == ">>>" and signed):
+                return (to_signed(a, width) >> n) & m
+            return a >> n
+
+        elif(t == UCExprBinary and not (node.op in UCSimCompareOps or
+                                        node.op in UCSimLogicalOps)):
+            a  = self.evaluate(node.lhs, width, signed, names, values)
+            b  = self.evaluate(node.rhs, width, signed, names, values)
+            op = node.op
+            if(op == "+"):
+                return (a + b) & m
+            elif(op == "-"):
+                return (a - b) & m
+            elif(op == "*"):
+                return (a * b) & m
+            elif(op == "&"):
+                return a & b
+            elif(op == "|"):
+                return a | b
+            elif(op == "^"):
+                return a ^ b
+            elif(op == "~&"):
+                return ~(a & b) & m
+            elif(op == "~|"):
+                return ~(a | b) & m
+            elif(op in ("~^", "^~")):
+                return ~(a ^ b) & m
+            elif(b == 0):
+                # Division by zero gives x in verilog.
+                return 0
+            elif(signed):
+                sa, sb = to_signed(a, width), to_signed(b, width)
+                q      = abs(sa) // abs(sb)
+                if((sa < 0) != (sb < 0)):
+                    q = -q
+                if(op == "/"):
+                    return q & m
+                return (sa - q * sb) & m
+            elif(op == "/"):
+                return a // b
+            return a % b
+
+        value, own_width = self.leaf(node, names, values)
+        return self.extend(value, own_width, width, signed)
+
+    def assign(self, lhs, value, names, values, nxt):
+        """
+        Write value into the next value of the variables named by an
+        lvalue tree. Returns the number of bits consumed from the bottom
+        of value.
+        """
+        t = type(lhs)
+
+        if(t == UCExprConcat):
+            used = 0
+            for part in reversed(lhs.parts):
+                used += self.assign(part, value >> used, names, values, nxt)
+            return used
+
+        ident  = lhs if t == UCExprIdentifier else lhs.operand
+        target = self.lookup(ident.name, names)
+        if(type(target) != UCProgramVariable):
+            return self.width(lhs, names, values)
+
+        if(not target.name in nxt):
+            if(not target.name in self.warned):
+                self.warned.add(target.name)
+                self.log.error("Cannot assign to non-register variable '%s'" %
+                    target.name)
+            return self.width(lhs, names, values)
+
+        if(t == UCExprIdentifier):
+            nxt[target.name] = value & mask_of(target.width)
+            return target.width
+
+        hi = self.index(lhs.hi, names, values)
+        lo = hi if lhs.lo == None else self.index(lhs.lo, names, values)
+        w  = hi - lo + 1
+        if(lo < target.lo or hi > target.hi):
+            return w
+
+        shift = lo - target.lo
+        field = mask_of(w) << shift
+        nxt[target.name] = ((nxt[target.name] & ~field) |
+                            ((value & mask_of(w)) << shift))
+        return w
+
+    def execute(self, statement, names, values, nxt):
+        """
+        Execute a single parsed UCInstructionStatement, reading the current
+        values and writing the next ones.
+        """
+        if(not statement.is_parsed()):
+            return
+        width = max(self.width(statement.lhs, names, values),
+                    self.width(statement.rhs, names, values))
+        value = self.evaluate(statement.rhs, width,
+                              self.is_signed(statement.rhs, names),
+                              names, values)
+        self.assign(statement.lhs, value, names, values, nxt)
+
+
+class UCSimStimulus(object):
+    """
+    Drives the input ports of a simulation from a text file. Each line
+    gives a cycle number followed by the ports which change on that cycle.
+    Ports keep their value until they are changed again. Values may be
+    decimal or verilog style literals, and `#` starts a comment:
+
+    ```
+    0   valid=0 n=8'd10
+    4   valid=1         # Start the computation.
+    ```
+    """
+
+    def __init__(self, filepath = None):
+        """
+        Create a new stimulus, loading it from a file if given.
+        """
+        self.log     = logging.getLogger(__name__)
+        self.changes = {}
+        if(filepath != None):
+            self.load(filepath)
+
+    def add(self, cycle, name, value):
+        """
+        Set an input port to a value from the given cycle onwards.
+        """
+        self.changes.setdefault(cycle, {})[name] = value
+
+    def load(self, filepath):
+        """
+        Parse a stimulus file.
+        """
+        with open(filepath, "r") as fh:
+            for lno, line in enumerate(fh, 1):
+                tokens = line.partition("#")[0].split()
+                if(len(tokens) == 0):
+                    continue
+                try:
+                    cycle = int(tokens[0])
+                    for token in tokens[1:]:
+                        name, _, text = token.partition("=")
+                        value = UCExprConstant(text).value_and_width()[0]
+                        self.add(cycle, name, value)
+                except (ValueError, KeyError, IndexError):
+                    self.log.error("%s:%d: Bad stimulus line '%s'" %
+                        (filepath, lno, line.strip()))
+
+    def __call__(self, cycle, sim):
+        """
+        Return the dict of input port values which change on this cycle.
+        """
+        return self.changes.get(cycle, None)
+
+
+class UCSimulator(object):
+    """
+    A cycle accurate model of the state machine which ucore-template.v
+    renders for a resolved program.
+
+    Each cycle, every register variable and output port starts with its
+    next (`n_*`) value equal to its current value. The statements of the
+    current state then run in order, reading current values and writing
+    next values, and the flow changes of the state choose the next state.
+    At the clock edge every next value becomes current. Registers reset
+    to zero and the state machine resets into main.
+
+    Input ports are driven by a stimulus, which is any callable taking
+    `(cycle, simulator)` and returning a dict of port name to value, or
+    None if nothing changes. If a trace file is given, each cycle writes
+    one line with the cycle number, the current state, and the values of
+    any output ports which changed. If a UCProfile is given, each cycle
+    records a visit to the current block and the transition it takes.
+    """
+
+    def __init__(self, resolver):
+        """
+        Create a new simulator for the program held by a resolver which
+        has already been resolved.
+        """
+        self.log      = logging.getLogger(__name__)
+        self.resolver = resolver
+        self.program  = resolver.program
+        variables     = resolver.variables
+
+        self.registers = [v for v in variables.by_index
+                          if v.isRegVar() or v.isOutPort()]
+        self.inputs    = [v for v in variables.by_index if v.isInPort()]
+        self.input_masks = dict((v.name, mask_of(v.width)) for v in self.inputs)
+        self.outputs   = [v for v in variables.by_index if v.isOutPort()]
+        self.wires     = [v for v in variables.by_index
+                          if v.isConstVar() or
+                             (v.isCombVar() and not v.isPort())]
+
+        # The state register of the template can be read by instructions,
+        # for example to save a return state.
+        self.state_var = UCProgramVariable("_current_state_", UCTypePortNone,
+            UCTypeVarComb, self.program.state_width - 1, 0)
+
+        # Identifiers which every statement can see: program variables, the
+        # state register and the localparam state encodings.
+        global_names = {self.state_var.name: self.state_var}
+        for v in variables.by_index:
+            global_names[v.name] = v
+        for name, encoding in self.program.synth_state_encodings():
+            global_names[name] = UCExprConstant("%d'd%d" %
+                (self.state_var.width, encoding))
+
+        self.evaluator = UCSimEvaluator(global_names)
+
+        # Constants and comb variables use the same expression as their
+        # continuous assignment in the template.
+        self.wire_exprs = []
+        for v in self.wires:
+            statement = UCInstructionStatement("%s = %s" % (v.name, v.comb_expr))
+            self.wire_exprs.append((v, statement.rhs))
+
+        self.main          = self.program.blocks_by_name["main"]
+        self.main_encoding = self.program.get_block_encoding(self.main)
+        self.blocks_by_encoding = dict((self.program.get_block_encoding(b), b)
+                                       for b in self.program.blocks)
+        self.names         = {}
+        for block in self.program.blocks:
+            for instr in block.statements:
+                self.names[instr] = self.bind(instr)
+
+        self.stimulus = None
+        self.trace    = None
+        self.profile  = None
+        self.reset()
+
+    def bind(self, instr):
+        """
+        Return the dict mapping each identifier used by a resolved
+        instruction onto the variable or constant expression it stands for.
+        """
+        tr = {}
+        for name in instr.identifiers():
+            argument = instr.get_argument(name)
+            if(argument != None and argument.constant):
+                text = str(instr.resolved_args.get(name, "0"))
+                if(text.startswith('"') and text.endswith('"')):
+                    # Verilog string literals pack 8 bits per character.
+                    chars = text[1:-1].encode("ascii")
+                    text  = "%d'h%x" % (8 * max(1, len(chars)),
+                                        int.from_bytes(chars, "big"))
+                tr[name] = UCInstructionStatement("_ = %s" % text).rhs
+            else:
+                var = instr.get_variable(name)
+                if(var != None):
+                    tr[name] = var
+        return tr
+
+    def reset(self):
+        """
+        Reset every variable to zero and the state machine into main.
+        """
+        self.values = {}
+        for v in self.resolver.variables.by_index:
+            self.values[v.name] = 0
+        self.state       = self.main_encoding
+        self.values[self.state_var.name] = self.state
+        self.cycle       = 0
+        self.last_traced = None
+        self.update_wires()
+
+    def update_wires(self):
+        """
+        Re-evaluate the constant and comb variables from current values.
+        """
+        for v, expr in self.wire_exprs:
+            if(expr != None):
+                self.values[v.name] = self.evaluator.evaluate(
+                    expr, v.width, False, {}, self.values)
+
+    def set_inputs(self, inputs):
+        """
+        Drive input ports from a dict of port name to value.
+        """
+        for name, value in inputs.items():
+            mask = self.input_masks.get(name, None)
+            if(mask == None):
+                self.log.error("Cannot drive '%s', it is not an input port" %
+                    name)
+                continue
+            self.values[name] = value & mask
+
+    def current_block(self):
+        """
+        Return the block for the current state, or None if the current
+        state does not encode a block.
+        """
+        return self.blocks_by_encoding.get(self.state, None)
+
+    def state_name(self):
+        """
+        Return the localparam name of the current state.
+        """
+        block = self.current_block()
+        if(block == None):
+            return str(self.state)
+        return self.program.get_block_state_name(block)
+
+    def next_state(self, block):
+        """
+        Evaluate the flow changes at the end of a block, returning the
+        encoding of the next state.
+        """
+        for fc in block.flow_change:
+            if(fc.conditional):
+                value = self.values.get(fc.variable.name, 0)
+                if(fc.change_type == UCProgramFlowIfEqz and value != 0):
+                    continue
+                if(fc.change_type == UCProgramFlowIfNez and value == 0):
+                    continue
+            if(fc.to_variable):
+                return self.values.get(fc.target.name, 0)
+            return self.program.get_block_encoding(fc.target)
+        return self.main_encoding
+
+    def write_trace(self):
+        """
+        Write one line of the output trace for the current cycle.
+        """
+        outputs = [(v.name, self.values[v.name]) for v in self.outputs]
+        if(self.last_traced != None):
+            changed = [o for o, p in zip(outputs, self.last_traced) if o != p]
+        else:
+            changed = outputs
+        self.last_traced = outputs
+
+        self.trace.write("%d %s %s\n" % (self.cycle, self.state_name(),
+            " ".join("%s=%d" % o for o in changed)))
+
+    def enabled(self, instr):
+        """
+        Return true if the predicate of an instruction holds for the
+        current values.
+        """
+        for var, nonzero in instr.predicate:
+            if((self.values.get(var.name, 0) != 0) != nonzero):
+                return False
+        return True
+
+    def execute(self, block):
+        """
+        Run the statements and flow changes of a block against the current
+        values, then register the next values. Returns the encoding of the
+        next state.
+        """
+        nxt = {}
+        for v in self.registers:
+            nxt[v.name] = self.values[v.name]
+
+        for instr in block.statements:
+            if(not self.enabled(instr)):
+                continue
+            names = self.names[instr]
+            for statement in instr.statements:
+                self.evaluator.execute(statement, names, self.values, nxt)
+        state = self.next_state(block)
+
+        self.values.update(nxt)
+        return state
+
+    def step(self):
+        """
+        Simulate one clock cycle. Returns the block which was executed, or
+        None if the current state was not a valid encoding.
+        """
+        if(self.stimulus != None):
+            inputs = self.stimulus(self.cycle, self)
+            if(inputs):
+                self.set_inputs(inputs)
+        self.update_wires()
+
+        block = self.current_block()
+        if(self.trace != None):
+            self.write_trace()
+
+        state = self.main_encoding
+        if(block != None):
+            state = self.execute(block)
+
+        self.state  = state & mask_of(self.state_var.width)
+        self.values[self.state_var.name] = self.state
+        self.cycle += 1
+
+        if(self.profile != None and block != None):
+            self.profile.visit(block.name)
+            target = self.current_block()
+            if(target != None):
+                self.profile.transition(block.name, target.name)
+
+        return block
+
+    def run(self, cycles, until = None):
+        """
+        Simulate up to the given number of cycles. If until is given, it is
+        called with the simulator after each cycle and stops the simulation
+        early by returning True. Returns the number of cycles simulated.
+        """
+        for i in range(0, cycles):
+            self.step()
+            if(until != None and until(self)):
+                return i + 1
+        return cycles
@@ -4,13 +4,25 @@ Contains classes and functions for loading and representing program state
 variables
 """
 
+import sys
+import enum
 import logging
 
 import yaml
 
-UCTypePortIn    = 0xA0
-UCTypePortOut   = 0xA1
-UCTypePortNone  = 0xA2 
+log = logging.getLogger(__name__)
+
+class UCPortType(enum.IntEnum):
+    """
+    Whether a variable is an input port, an output port or neither.
+    """
+    IN   = 0xA0
+    OUT  = 0xA1
+    NONE = 0xA2
+
+UCTypePortIn    = UCPortType.IN
+UCTypePortOut   = UCPortType.OUT
+UCTypePortNone  = UCPortType.NONE
 UCPortTypes     = [UCTypePortIn, UCTypePortOut, UCTypePortNone]
 
 UCPortStrings    = {
@@ -18,9 +30,17 @@ UCPortStrings    = {
     "output"  : UCTypePortOut
 }
 
-UCTypeVarReg    = 0xB0
-UCTypeVarConst  = 0xB1
-UCTypeVarComb   = 0xB2
+class UCVarType(enum.IntEnum):
+    """
+    Whether a variable is a register, a constant or a combinatorial value.
+    """
+    REG   = 0xB0
+    CONST = 0xB1
+    COMB  = 0xB2
+
+UCTypeVarReg    = UCVarType.REG
+UCTypeVarConst  = UCVarType.CONST
+UCTypeVarComb   = UCVarType.COMB
 UCVarTypes      = [UCTypeVarReg, UCTypeVarConst, UCTypeVarComb]
 
 UCVarStrings    = {
@@ -34,6 +54,10 @@ class UCProgramVariable(object):
     Represents a single program variable within a program.
     """
 
+    __slots__ = ["port_type", "var_type", "name", "width", "lo", "hi",
+                 "description", "comb_expr", "const_expr", "id", "bit",
+                 "shares"]
+
     def __init__(self, name, 
                        port_type,
                        var_type,
@@ -50,19 +74,29 @@ class UCProgramVariable(object):
         assert bits_hi >= bits_lo, "A port width must be greater than or equal to 1"
         assert port_type in UCPortTypes, "Invalid port type"
         assert var_type  in UCVarTypes, "Invalid var type"
-        self.log = logging.getLogger(__name__)
 
-        self.port_type  = port_type
-        self.var_type   = var_type
-        self.name       = name
+        self.port_type  = UCPortType(port_type)
+        self.var_type   = UCVarType(var_type)
+        self.name       = sys.intern(name)
         self.width      = 1 + bits_hi - bits_lo
         self.lo         = bits_lo
         self.hi         = bits_hi
         self.description= description.rstrip("\n")
         self.comb_expr  = "0"
+        self.const_expr = ""
+
+        # Dense index and matching bitmask, assigned when the variable is
+        # added to a UCProgramVariableCollection. Used to represent sets of
+        # variables as integers.
+        self.id         = None
+        self.bit        = 0
+
+        # The variable whose register this one is stored in, when register
+        # sharing has found that they are never live at the same time.
+        self.shares     = None
 
         if(self.isRegVar() and self.isInPort()):
-            self.log.error("Input port '%s' cannot be of variable type 'reg'" %
+            log.error("Input port '%s' cannot be of variable type 'reg'" %
                 self.name)
 
     def __len__(self):
@@ -118,7 +152,7 @@ class UCProgramVariableCollection (object):
         """
         Create a new empty collection of ports.
         """
-        self.log = logging.getLogger(__name__)
+        self.log = log
 
         self.by_index = []
         self.by_name  = {}
@@ -132,6 +166,18 @@ class UCProgramVariableCollection (object):
         else:
             return None
     
+    def getVariablesInMask(self, mask):
+        """
+        Return the list of variables whose bits are set in the supplied
+        integer bitmask, in order of their ids.
+        """
+        tr = []
+        while(mask):
+            low   = mask & -mask
+            tr.append(self.by_index[low.bit_length() - 1])
+            mask ^= low
+        return tr
+
     def getPortNames(self):
         """
         Return a list of all variable names which are ports
@@ -154,6 +200,8 @@ class UCProgramVariableCollection (object):
         assert type(variable) is UCProgramVariable, "variable should be of type UCProgramVariable"
 
         if not variable.name in self.by_name:
+            variable.id  = len(self.by_index)
+            variable.bit = 1 << variable.id
             self.by_name[variable.name] = variable
             self.by_index.append(variable)
         else:
@@ -0,0 +1,229 @@
+
+"""
+Classes and functions for recording how long each phase of a compile
+takes, how much memory it uses, and how it changes the program.
+"""
+
+import sys
+import json
+import time
+import cProfile
+import logging
+import tracemalloc
+import contextlib
+
+class UCPhase(object):
+    """
+    The measurements of a single phase of a compile.
+    """
+
+    def __init__(self, name, depth):
+        """
+        Create a new, empty record of a phase nested depth phases deep.
+        """
+        self.name     = name
+        self.depth    = depth
+        self.wall     = 0.0
+        self.cpu      = 0.0
+
+        # Wall time spent in phases nested inside this one.
+        self.children = 0.0
+
+        # Peak traced memory in bytes, or None if memory is not traced.
+        self.peak     = None
+
+        # Maps counter names onto (before, after) tuples.
+        self.counters = {}
+
+        # Profile of the time spent in this phase but not in any phase
+        # nested inside it, if profiling.
+        self.profile  = None
+
+    def own_wall(self):
+        """
+        Return the wall time spent in this phase but not in any phase
+        nested inside it.
+        """
+        return self.wall - self.children
+
+    def as_dict(self):
+        """
+        Return the phase as a dict which can be serialised to JSON.
+        """
+        return {
+            "name"     : self.name,
+            "depth"    : self.depth,
+            "wall"     : self.wall,
+            "own_wall" : self.own_wall(),
+            "cpu"      : self.cpu,
+            "peak"     : self.peak,
+            "counters" : dict((k, {"before": b, "after": a})
+                              for k, (b, a) in self.counters.items())
+        }
+
+
+class UCStats(object):
+    """
+    Records the wall time, CPU time and peak traced memory of each phase
+    of a compile, along with counters such as the number of blocks before
+    and after it. Phases may be nested, in which case the time and memory
+    of the inner phases also count towards the outer ones.
+
+    Memory is traced with tracemalloc, which slows everything else down,
+    so it is only done if asked for. With profiling enabled, each phase
+    gets its own cProfile profile of the time it spends outside of its
+    nested phases, and the profile of the phase which took longest can be
+    written out for `pstats` or `snakeviz`.
+    """
+
+    def __init__(self, memory = False, profiling = False):
+        """
+        Create a new, empty set of statistics.
+        """
+        self.log       = logging.getLogger(__name__)
+        self.memory    = memory
+        self.profiling = profiling
+        self.phases    = []
+        self.stack     = []
+
+        if(self.memory and not tracemalloc.is_tracing()):
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name, counters = None):
+        """
+        Return a context manager which measures the code run inside it as
+        a phase with the given name. counters is an optional function
+        returning a dict of counter values, which is called before and
+        after the phase.
+        """
+        parent = self.stack[-1] if len(self.stack) > 0 else None
+        record = UCPhase(name, len(self.stack))
+        self.phases.append(record)
+        self.stack.append(record)
+
+        before = counters() if counters != None else {}
+
+        if(self.memory):
+            if(parent != None):
+                parent.peak = max(parent.peak or 0,
+                                  tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        if(self.profiling):
+            if(parent != None):
+                parent.profile.disable()
+            record.profile = cProfile.Profile()
+            record.profile.enable()
+
+        wall = time.perf_counter()
+        cpu  = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - wall
+            record.cpu  = time.process_time() - cpu
+
+            if(self.profiling):
+                record.profile.disable()
+                if(parent != None):
+                    parent.profile.enable()
+
+            if(self.memory):
+                record.peak = max(record.peak or 0,
+                                  tracemalloc.get_traced_memory()[1])
+                if(parent != None):
+                    parent.peak = max(parent.peak or 0, record.peak)
+
+            after = counters() if counters != None else {}
+            for key in after:
+                record.counters[key] = (before.get(key, None), after[key])
+
+            if(parent != None):
+                parent.children += record.wall
+            self.stack.pop()
+
+    def hottest(self):
+        """
+        Return the phase which spent the most wall time outside of its
+        nested phases, or None if there are no phases.
+        """
+        if(len(self.phases) == 0):
+            return None
+        return max(self.phases, key = lambda p: p.own_wall())
+
+    def total_wall(self):
+        """
+        Return the wall time of every outermost phase added together.
+        """
+        return sum(p.wall for p in self.phases if p.depth == 0)
+
+    def write(self, fh):
+        """
+        Write the phases as a table of text to an open file.
+        """
+        fh.write("%-28s %9s %9s %9s %9s  %s\n" % ("phase", "wall(s)",
+            "own(s)", "cpu(s)", "peak(MB)", "counters"))
+
+        for p in self.phases:
+            peak     = "-" if p.peak == None else "%.2f" % (p.peak / 1e6)
+            counters = ", ".join(
+                "%s %s" % (k, a) if b == None or b == a else
+                "%s %s->%s" % (k, b, a)
+                for k, (b, a) in sorted(p.counters.items()))
+            fh.write("%-28s %9.3f %9.3f %9.3f %9s  %s\n" % (
+                "  " * p.depth + p.name, p.wall, p.own_wall(), p.cpu, peak,
+                counters))
+
+        fh.write("%-28s %9.3f\n" % ("total", self.total_wall()))
+
+        hottest = self.hottest()
+        if(hottest != None):
+            fh.write("hottest: %s\n" % hottest.name)
+
+    def as_dict(self):
+        """
+        Return the statistics as a dict which can be serialised to JSON.
+        """
+        hottest = self.hottest()
+        return {
+            "total_wall" : self.total_wall(),
+            "hottest"    : hottest.name if hottest != None else None,
+            "phases"     : [p.as_dict() for p in self.phases]
+        }
+
+    def save_text(self, filepath):
+        """
+        Write the phases as a table of text to a file, or to stdout if
+        the path is `-`.
+        """
+        if(filepath == "-"):
+            self.write(sys.stdout)
+            return
+        with open(filepath, "w") as fh:
+            self.write(fh)
+
+    def save_json(self, filepath):
+        """
+        Write the statistics to a JSON file.
+        """
+        with open(filepath, "w") as fh:
+            json.dump(self.as_dict(), fh, indent=4)
+
+    def save_profile(self, filepath, name = None):
+        """
+        Write the cProfile profile of the named phase, or of the hottest
+        phase if no name is given, to a file which can be loaded with
+        `pstats`. Returns the phase, or None if there is no such profile.
+        """
+        if(name == None):
+            phase = self.hottest()
+        else:
+            phase = ([p for p in self.phases if p.name == name] or [None])[0]
+
+        if(phase == None or phase.profile == None):
+            self.log.error("No profile of phase '%s' to write" % name)
+            return None
+
+        phase.profile.dump_stats(filepath)
+        return phase
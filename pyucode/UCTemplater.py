@@ -38,6 +38,7 @@ class UCTemplater(object):
                     variables = self.prog.variables,
                     instrs    = self.prog.instrs,
                     program   = self.prog.program,
+                    flops_saved = self.prog.flops_saved,
                     debug_states = self.debug_states
                 )
             )
@@ -0,0 +1,256 @@
+
+"""
+Classes and functions for removing the states of a resolved program which
+do nothing but jump somewhere else.
+"""
+
+import copy
+import logging
+
+from .UCProgram import UCProgramFlowChange
+from .UCProgram import UCProgramFlowGoto
+from .UCProgram import UCProgramFlowIfEqz
+from .UCProgram import UCProgramFlowIfNez
+
+class UCJumpThreader(object):
+    """
+    Threads jumps through forwarding blocks, which have no statements, so
+    that their predecessors go straight to where they would have ended up.
+    Each hop removed saves a cycle every time the jump is taken.
+
+    - Any jump to a block which only has an unconditional flow change is
+      re-targeted to the end of the chain of such blocks.
+    - The unconditional flow change at the end of a block may be replaced
+      with all of the flow changes of a forwarding block it jumps to.
+      This moves the conditions one cycle earlier, so it is only done if
+      the block does not write anything they read, and they read no input
+      ports or comb variables, whose values may change in the meantime.
+    - Flow changes which can never be taken, or which go to the same place
+      as the unconditional flow change after them, are removed.
+
+    Forwarding blocks which nothing jumps to any more are left for the
+    resolver's unreachable block removal. The main block is never threaded
+    through, since it is where the program restarts.
+    """
+
+    def __init__(self, resolver):
+        """
+        Create a new jump threader for the program held by a resolver whose
+        instructions have already been resolved.
+        """
+        self.log      = logging.getLogger(__name__)
+        self.resolver = resolver
+        self.program  = resolver.program
+
+        # Maps each block onto the set of forwarding blocks whose flow
+        # changes it has absorbed, so that loops of them always end.
+        self.hoisted  = {}
+
+        # Profiled number of jumps which no longer pass through a
+        # forwarding block.
+        self.saved    = 0
+
+    def is_forwarding(self, block):
+        """
+        Return true if a block does nothing but change the flow of control.
+        """
+        return (len(block.statements) == 0 and
+                len(block.flow_change) > 0 and
+                block.name != "main")
+
+    def is_goto(self, block):
+        """
+        Return true if a block is forwarding and always jumps to the same
+        place.
+        """
+        return (self.is_forwarding(block) and
+                not block.flow_change[0].conditional)
+
+    def can_hoist(self, parent, block):
+        """
+        Return true if the flow changes of block may be evaluated at the end
+        of parent instead, one cycle earlier.
+        """
+        if(block is parent or block in self.hoisted.get(parent, set([]))):
+            return False
+
+        writes = parent.read_write_masks()[1]
+
+        for fc in block.flow_change:
+            reads = []
+            if(fc.conditional):
+                reads.append(fc.variable)
+            if(fc.to_variable):
+                reads.append(fc.target)
+            for var in reads:
+                if(var.isInPort() or var.isCombVar() or var.bit & writes):
+                    return False
+
+        if(self.resolver.max_cycle_cost != None):
+            flow_change = [f for f in parent.flow_change
+                           if f.conditional] + block.flow_change
+            cost = self.resolver.cost_model.block_cost(parent.statements,
+                                                       flow_change)
+            if(cost > self.resolver.max_cycle_cost):
+                return False
+
+        return True
+
+    def retargeted(self, flow_change, target):
+        """
+        Return a copy of a flow change which jumps to target instead, where
+        target is the flow change at the end of a forwarding block.
+        """
+        tr = copy.copy(flow_change)
+        tr.target      = target.target
+        tr.to_variable = target.to_variable
+        tr.src         = self.describe(tr)
+        return tr
+
+    def describe(self, flow_change):
+        """
+        Return the source text of a flow change.
+        """
+        target = flow_change.target.name
+        if(flow_change.change_type == UCProgramFlowIfEqz):
+            return "ifeqz %s %s" % (flow_change.variable.name, target)
+        elif(flow_change.change_type == UCProgramFlowIfNez):
+            return "ifnez %s %s" % (flow_change.variable.name, target)
+        return "goto %s" % target
+
+    def goto_target(self, parent, block):
+        """
+        Follow a chain of forwarding blocks with unconditional flow changes
+        from block. Returns the flow change at the end of the last one
+        which parent may use, or None if block is not such a block.
+        """
+        tr   = None
+        seen = set([parent])
+
+        while(self.is_goto(block) and not block in seen):
+            fc = block.flow_change[0]
+            if(fc.to_variable and not self.can_hoist(parent, block)):
+                break
+            seen.add(block)
+            tr = fc
+            if(fc.to_variable):
+                break
+            block = fc.target
+
+        return tr
+
+    def threaded(self, block):
+        """
+        Return the new list of flow changes for the end of block, or None
+        if nothing changes.
+        """
+        graph   = self.program.flow_graph
+        tr      = []
+        changed = False
+
+        for fc in block.flow_change:
+
+            target = fc.target
+            if(graph.is_edge(fc) and self.is_forwarding(target)):
+
+                end = self.goto_target(block, target)
+
+                if(end != None and (end.to_variable or
+                                    not end.target is target)):
+                    self.count(block, target)
+                    fc      = self.retargeted(fc, end)
+                    changed = True
+
+                elif(not fc.conditional and self.can_hoist(block, target)):
+                    self.count(block, target)
+                    self.hoisted.setdefault(block, set([])).add(target)
+                    tr     += [copy.copy(f) for f in target.flow_change]
+                    changed = True
+                    break
+
+            tr.append(fc)
+            if(not fc.conditional):
+                break
+
+        simplified = self.simplified(tr)
+        if(changed or simplified != block.flow_change):
+            return simplified
+        return None
+
+    def count(self, block, target):
+        """
+        Record that jumps from block no longer pass through target.
+        """
+        profile = self.resolver.profile
+        if(profile != None):
+            self.saved += profile.edge_count(block.name, target.name)
+
+    def same_target(self, a, b):
+        """
+        Return true if two flow changes always jump to the same place.
+        """
+        return a.target is b.target and a.to_variable == b.to_variable
+
+    def simplified(self, flow_change):
+        """
+        Return a list of flow changes which behaves the same as the one
+        supplied, without any flow changes which can never be taken, or
+        which go to the same place as the unconditional one after them.
+        """
+        tr   = []
+        seen = {}
+
+        for fc in flow_change:
+            if(fc.conditional):
+                # A test whose opposite has already failed always passes.
+                opposite = {UCProgramFlowIfEqz : UCProgramFlowIfNez,
+                            UCProgramFlowIfNez : UCProgramFlowIfEqz
+                           }[fc.change_type]
+                if(seen.get(fc.variable) == opposite):
+                    goto = UCProgramFlowChange(None)
+                    goto.change_type = UCProgramFlowGoto
+                    goto.target      = fc.target
+                    goto.to_variable = fc.to_variable
+                    goto.src         = self.describe(goto)
+                    fc = goto
+                elif(fc.variable in seen):
+                    # The same test has already failed.
+                    continue
+                else:
+                    seen[fc.variable] = fc.change_type
+
+            tr.append(fc)
+            if(not fc.conditional):
+                while(len(tr) > 1 and self.same_target(tr[-2], fc)):
+                    del tr[-2]
+                break
+
+        return tr
+
+    def thread_program(self):
+        """
+        Thread jumps through every forwarding block in the program, until
+        there are none left to thread. Returns the number of blocks whose
+        flow changes were changed.
+        """
+        graph    = self.program.flow_graph
+        worklist = list(reversed(self.program.blocks))
+        changes  = 0
+
+        while(len(worklist) > 0):
+            block       = worklist.pop()
+            flow_change = self.threaded(block)
+            if(flow_change == None):
+                continue
+
+            self.log.debug("T: %s -> %s" % (block.name,
+                ", ".join(self.describe(fc) for fc in flow_change)))
+
+            graph.set_flow_change(block, flow_change)
+            block.invalidate_read_write_sets()
+            changes += 1
+
+            # The new targets may be forwarding blocks too.
+            worklist.append(block)
+
+        return changes
@@ -0,0 +1,464 @@
+
+"""
+Classes and functions for statically bounding the number of cycles a
+resolved program takes to move between its states.
+"""
+
+import json
+import logging
+
+# Cycle count of a path which can go round a loop with no known bound.
+UNBOUNDED = float("inf")
+
+class UCTimingAnalysis(object):
+    """
+    Works out cycle counts over the flow graph of a resolved program, where
+    every state takes exactly one cycle. Times are measured from entering
+    one block to next entering another, so a path never passes through its
+    target block part way along.
+
+    Minimum times are shortest paths. Maximum times are longest paths, and
+    are unbounded if they can go round a loop which has no bound. A loop
+    bound is given by writing `bound N` in the block which heads the loop,
+    meaning that the block is entered at most N times each time the loop is
+    entered. Data dependent loops, like waiting for an input, have no bound.
+
+    Jumps to a variable are assumed to be able to reach any block which is
+    de-referenced, or which saves `_current_state_`. Blocks whose flow
+    changes are all conditional may also fall through to main.
+    """
+
+    def __init__(self, resolver):
+        """
+        Create a new analysis of the program held by a resolver which has
+        already been resolved.
+        """
+        self.log      = logging.getLogger(__name__)
+        self.resolver = resolver
+        self.program  = resolver.program
+        self.blocks   = list(self.program.blocks)
+        self.order    = dict((b, i) for i, b in enumerate(self.blocks))
+        self.main     = self.program.getBlock("main")
+
+        self.bounds = dict((b, b.loop_bound) for b in self.blocks
+                           if b.loop_bound != None)
+
+        graph   = self.program.flow_graph
+        returns = [b for b in self.blocks
+                   if b.gets_dereferenced or resolver.reads_current_state(b)]
+
+        self.succs = {}
+        self.preds = dict((b, []) for b in self.blocks)
+        for block in self.blocks:
+            targets = list(graph.successors(block))
+            if(any(fc.to_variable for fc in block.flow_change)):
+                targets += returns
+            if(self.main != None and (len(block.flow_change) == 0 or
+                                      block.flow_change[-1].conditional)):
+                targets.append(self.main)
+            targets = list(dict.fromkeys(t for t in targets if t in self.order))
+            self.succs[block] = targets
+            for target in targets:
+                self.preds[target].append(block)
+
+    def set_bound(self, name, bound):
+        """
+        Bound the number of times the named block may be entered each time
+        the loop it heads is entered, as if annotated with `bound`.
+        """
+        block = self.program.getBlock(name)
+        if(block == None):
+            self.log.error("Cannot bound unknown block '%s'" % name)
+        else:
+            self.bounds[block] = bound
+
+    def named_blocks(self):
+        """
+        Return the blocks which start a named block of the program source,
+        in program order.
+        """
+        return [b for b in self.blocks if b.name == b.source_name]
+
+    def reachable(self, nodes, source, stop):
+        """
+        Return the set of blocks in nodes which can be reached from source
+        without leaving nodes, or going through a block in stop.
+        """
+        reached = set([])
+        queue   = [source]
+        while(len(queue) > 0):
+            block = queue.pop()
+            if(block in stop and block is not source):
+                continue
+            for target in self.succs[block]:
+                if(target in nodes and not target in reached):
+                    reached.add(target)
+                    queue.append(target)
+        if(source in nodes):
+            reached.add(source)
+        return reached
+
+    def components(self, nodes, stop):
+        """
+        Return the strongly connected components of the graph formed by
+        nodes, where blocks in stop have no outgoing edges. Components are
+        returned in topological order, each as a list in program order.
+        """
+        index   = {}
+        low     = {}
+        stack   = []
+        onstack = set([])
+        tr      = []
+
+        for root in sorted(nodes, key = self.order.get):
+            if(root in index):
+                continue
+            work = [(root, 0)]
+            while(len(work) > 0):
+                block, i = work.pop()
+                if(i == 0):
+                    index[block] = low[block] = len(index)
+                    stack.append(block)
+                    onstack.add(block)
+                targets = [] if block in stop else \
+                          [t for t in self.succs[block] if t in nodes]
+                if(i < len(targets)):
+                    work.append((block, i + 1))
+                    target = targets[i]
+                    if(not target in index):
+                        work.append((target, 0))
+                    elif(target in onstack):
+                        low[block] = min(low[block], index[target])
+                    continue
+                for target in targets:
+                    if(target in onstack):
+                        low[block] = min(low[block], low[target])
+                if(low[block] == index[block]):
+                    component = []
+                    while(True):
+                        member = stack.pop()
+                        onstack.discard(member)
+                        component.append(member)
+                        if(member is block):
+                            break
+                    tr.append(sorted(component, key = self.order.get))
+
+        tr.reverse()
+        return tr
+
+    def is_cyclic(self, component, stop = set([])):
+        """
+        Return true if a strongly connected component contains a loop.
+        """
+        block = component[0]
+        return len(component) > 1 or \
+               (not block in stop and block in self.succs[block])
+
+    def header(self, component, entries, bounded):
+        """
+        Choose the block which heads the loop formed by a component, from
+        the blocks it is entered through. An entry with a bound is
+        preferred. If bounded is true, None is returned if no entry has a
+        bound.
+        """
+        for block in entries:
+            if(block in self.bounds):
+                return block
+        if(bounded):
+            return None
+        return entries[0] if len(entries) > 0 else component[0]
+
+    def round_trip(self, target, dist, members):
+        """
+        Return the most cycles needed to enter target, given the longest
+        distances to the blocks in members which can jump to it.
+        """
+        tr = None
+        for block in self.preds[target]:
+            if(block in members and block in dist):
+                tr = max(tr, dist[block] + 1) if tr != None else dist[block] + 1
+        return tr
+
+    def longest(self, nodes, source, stop = set([])):
+        """
+        Return a dict mapping each block reached from source through nodes
+        onto the most cycles from entering source to first entering it.
+        Source itself maps to zero, and is only part of the graph if it is
+        one of nodes. Blocks in stop are never left.
+        """
+        reach = self.reachable(nodes, source, stop)
+        dist  = {source : 0}
+
+        if(not source in reach):
+            for target in self.succs[source]:
+                if(target in reach):
+                    dist[target] = 1
+
+        for component in self.components(reach, stop):
+            if(self.is_cyclic(component, stop)):
+                self.through_loop(component, dist, stop)
+            for block in component:
+                if(block in stop or not block in dist):
+                    continue
+                for target in self.succs[block]:
+                    if(target in reach and not target in component):
+                        dist[target] = max(dist.get(target, 0), dist[block] + 1)
+
+        return dist
+
+    def through_loop(self, component, dist, stop):
+        """
+        Update dist with the longest distances to every block of a cyclic
+        component, from the entry distances already in dist. The loop is
+        broken at a bounded header, and the rest of the component is
+        analysed on its own, so nested loops need their own bounds.
+        """
+        entries = [b for b in component if b in dist]
+        start   = dict((b, dist[b]) for b in entries)
+        header  = self.header(component, entries, True)
+        if(header == None):
+            for block in component:
+                dist[block] = UNBOUNDED
+            return
+
+        rest   = set(component)
+        rest.discard(header)
+        bound  = max(1, self.bounds[header])
+        inner  = self.longest(rest, header, stop)
+        trip   = self.round_trip(header, inner, rest | set([header]))
+        loops  = (bound - 1) * trip if bound > 1 else 0
+
+        for entry in entries:
+            if(entry is header):
+                direct, to_header = (inner, 0)
+            else:
+                direct    = self.longest(rest, entry, stop)
+                to_header = self.round_trip(header, direct, rest)
+
+            for block in component:
+                best = direct.get(block, None) if block is not header else None
+                if(to_header != None):
+                    via = to_header + loops + inner.get(block, 0) \
+                          if block is header or block in inner else None
+                    if(via != None):
+                        best = max(best, via) if best != None else via
+                if(best != None):
+                    dist[block] = max(dist.get(block, 0), start[entry] + best)
+
+    def shortest(self, source, stop = set([]), nodes = None):
+        """
+        Return a dict mapping each block reached from source onto the
+        fewest cycles from entering source to first entering it. Blocks in
+        stop are never left, and only blocks in nodes are entered if it is
+        given.
+        """
+        dist  = {source : 0}
+        queue = [source]
+        for block in queue:
+            if(block in stop and block is not source):
+                continue
+            for target in self.succs[block]:
+                if(not target in dist and (nodes == None or target in nodes)):
+                    dist[target] = dist[block] + 1
+                    queue.append(target)
+        return dist
+
+    def min_cycles(self, source, target, nodes = None):
+        """
+        Return the fewest cycles from entering source to next entering
+        target, or None if target cannot be reached. Only blocks in nodes
+        are entered if it is given.
+        """
+        if(source is target):
+            dist  = self.shortest(source, set([]), nodes)
+            trips = [dist[b] + 1 for b in self.preds[target] if b in dist]
+            return min(trips) if len(trips) > 0 else None
+        return self.shortest(source, set([target]), nodes).get(target, None)
+
+    def max_cycles(self, source, target):
+        """
+        Return the most cycles from entering source to next entering
+        target, UNBOUNDED if there is a loop with no bound in the way, or
+        None if target cannot be reached.
+        """
+        nodes = set(self.blocks)
+        if(source is target):
+            nodes.discard(source)
+            dist = self.longest(nodes, source, set([]))
+            return self.round_trip(target, dist, self.order)
+        return self.longest(nodes, source, set([target])).get(target, None)
+
+    def loops(self, nodes = None):
+        """
+        Return a list of dicts describing each loop of the program, with
+        loops inside other loops following them. Each loop is found as a
+        strongly connected component and broken at its header, with the
+        rest searched for inner loops.
+        """
+        if(nodes == None):
+            nodes = set(self.blocks)
+        tr = []
+        for component in self.components(nodes, set([])):
+            if(not self.is_cyclic(component)):
+                continue
+            entries = [b for b in component
+                       if b is self.main or
+                          any(not p in component for p in self.preds[b])]
+            header  = self.header(component, entries, False)
+            rest    = set(component)
+            rest.discard(header)
+
+            length_min = self.min_cycles(header, header, set(component))
+            length_max = self.round_trip(header,
+                self.longest(rest, header, set([])), set(component))
+
+            bound = self.bounds.get(header, None)
+            tr.append({
+                "header" : header.name,
+                "blocks" : [b.name for b in component],
+                "bound"  : bound,
+                "min"    : length_min,
+                "max"    : length_max,
+                "worst"  : length_max * bound if bound != None else UNBOUNDED
+            })
+            tr += self.loops(rest)
+        return tr
+
+    def regions(self):
+        """
+        Return a list of dicts describing each acyclic region of the
+        program: a connected set of blocks which are not part of any loop.
+        Jumping back to main ends a region rather than forming a loop,
+        since programs usually return to main between transactions. Each
+        region gives the blocks which enter and leave it, and the most
+        cycles from entering it to leaving it.
+        """
+        main   = self.main
+        nodes  = set(self.blocks)
+        nodes.discard(main)
+        looped = set([])
+        for component in self.components(nodes, set([])):
+            if(self.is_cyclic(component)):
+                looped.update(component)
+        if(main != None and main in self.succs[main]):
+            looped.add(main)
+
+        acyclic = [b for b in self.blocks if not b in looped]
+        regions = []
+        seen    = set([])
+        for block in acyclic:
+            if(block in seen):
+                continue
+            region = set([block])
+            queue  = [block]
+            for member in queue:
+                others = [t for t in self.succs[member] if t is not main]
+                if(member is not main):
+                    others += self.preds[member]
+                for other in others:
+                    if(not other in looped and not other in region):
+                        region.add(other)
+                        queue.append(other)
+            seen.update(region)
+            regions.append(sorted(region, key = self.order.get))
+
+        tr = []
+        for region in regions:
+            members = set(region)
+            entries = [b for b in region if b is main or
+                       len(self.preds[b]) == 0 or
+                       any(not p in members for p in self.preds[b])]
+            exits   = [b for b in region if len(self.succs[b]) == 0 or
+                       any(t is main or not t in members
+                           for t in self.succs[b])]
+            members.discard(main)
+            latency = 0
+            for entry in entries:
+                dist = self.longest(members, entry)
+                for block in exits:
+                    if(block in dist):
+                        latency = max(latency, dist[block] + 1)
+            tr.append({
+                "blocks"  : [b.name for b in region],
+                "entries" : [b.name for b in entries],
+                "exits"   : [b.name for b in exits],
+                "latency" : latency
+            })
+        return tr
+
+    def paths(self):
+        """
+        Return a list of dicts giving the fewest and most cycles from
+        entering each named block to next entering each other named block
+        it can reach.
+        """
+        tr = []
+        for source in self.named_blocks():
+            for target in self.named_blocks():
+                fewest = self.min_cycles(source, target)
+                if(fewest == None):
+                    continue
+                tr.append({
+                    "from" : source.name,
+                    "to"   : target.name,
+                    "min"  : fewest,
+                    "max"  : self.max_cycles(source, target)
+                })
+        return tr
+
+    def report(self):
+        """
+        Return the full analysis as a dict which can be serialised to
+        JSON. Unbounded cycle counts are given as None.
+        """
+        def finite(entries):
+            for entry in entries:
+                for key, value in entry.items():
+                    if(value == UNBOUNDED):
+                        entry[key] = None
+            return entries
+
+        return {
+            "loops"   : finite(self.loops()),
+            "regions" : finite(self.regions()),
+            "paths"   : finite(self.paths())
+        }
+
+    def save(self, filepath):
+        """
+        Write the analysis to a JSON file.
+        """
+        with open(filepath, "w") as fh:
+            json.dump(self.report(), fh, indent=4)
+
+    def compare(self, baseline):
+        """
+        Compare the analysis against a dict loaded from a JSON file written
+        by save. Returns a list of messages describing every loop, region
+        or path which can now take more cycles than it used to.
+        """
+        current = self.report()
+        tr      = []
+
+        def worse(new, old):
+            if(old == None):
+                return False
+            return new == None or new > old
+
+        keys = [("loops",   lambda e: e["header"],          ["min", "max", "worst"]),
+                ("regions", lambda e: tuple(e["entries"]),  ["latency"]),
+                ("paths",   lambda e: (e["from"], e["to"]), ["min", "max"])]
+
+        for section, key, fields in keys:
+            old = dict((key(e), e) for e in baseline.get(section, []))
+            for entry in current[section]:
+                before = old.get(key(entry), None)
+                if(before == None):
+                    continue
+                for field in fields:
+                    if(worse(entry[field], before.get(field, None))):
+                        tr.append("%s %s: %s went from %s to %s" % (section,
+                            key(entry), field, before[field],
+                            "unbounded" if entry[field] == None
+                            else entry[field]))
+        return tr
@@ -0,0 +1,168 @@
+
+"""
+Classes and functions for unrolling the loops of a resolved program, so
+that later passes can pack more than one iteration into each state.
+"""
+
+import copy
+import logging
+
+from .UCProgram import UCProgramBlock
+
+class UCLoopUnroller(object):
+    """
+    Unrolls the innermost natural loops of the program flow graph. A loop
+    unrolled by a factor of N is followed by N-1 copies of its blocks. The
+    back edges of each copy jump to the header of the next copy, and those
+    of the last copy jump back to the original header. Exits from every
+    copy go to the same place as before, so the program behaves exactly as
+    it did, whatever the trip count of the loop.
+
+    On its own this only adds states. The gain comes from coalescing and
+    scheduling afterwards: the header of each copy has a single
+    predecessor, so the end of one iteration can often be merged with the
+    start of the next.
+
+    Loops which contain main, or which have no statements, are left alone,
+    as are loops whose header is not hot when the resolver has a profile.
+    A loop with a `bound` is never unrolled more times than its bound. If
+    the resolver has a state budget, the hottest loops are unrolled first
+    and the factor is cut down to stay within it.
+    """
+
+    def __init__(self, resolver):
+        """
+        Create a new unroller for the program held by a resolver whose
+        instructions have already been resolved.
+        """
+        self.log      = logging.getLogger(__name__)
+        self.resolver = resolver
+        self.program  = resolver.program
+
+    def loops(self):
+        """
+        Return the list of (header, body) tuples of the innermost natural
+        loops which may be unrolled, hottest first and then in program
+        order.
+        """
+        main  = self.program.getBlock("main")
+        if(main == None):
+            return []
+
+        found   = self.program.flow_graph.natural_loops(main)
+        headers = set(h for h, body in found)
+        tr      = []
+
+        for header, body in found:
+            if(main in body):
+                continue
+            if(any(b in headers for b in body if b is not header)):
+                continue
+            if(sum(len(b.statements) for b in body) == 0):
+                continue
+            if(self.resolver.profile != None and
+               not self.resolver.is_hot(header)):
+                continue
+            tr.append((header, body))
+
+        order = dict((b, i) for i, b in enumerate(self.program.blocks))
+        tr.sort(key = lambda l: (-self.resolver.heat(l[0]), order[l[0]]))
+        return tr
+
+    def unique_name(self, name):
+        """
+        Return name, with a numeric suffix added if a block already has it.
+        """
+        tr = name
+        i  = 1
+        while(tr in self.program.blocks_by_name):
+            tr = "%s_%d" % (name, i)
+            i += 1
+        return tr
+
+    def copy_block(self, block, iteration):
+        """
+        Return a new block with the same statements as block, which is not
+        yet part of the program and has no flow changes.
+        """
+        name = self.unique_name("%s_unroll%d" % (block.name, iteration))
+        tr   = UCProgramBlock(name, [], [])
+        tr.statements     = list(block.statements)
+        tr.src_statements = list(block.src_statements)
+        tr.src_lines      = list(block.src_lines)
+        tr.source_name    = block.source_name
+        tr.resolved       = True
+        return tr
+
+    def factor(self, header, body):
+        """
+        Return how many times to unroll a loop, taking its bound and the
+        state budget into account.
+        """
+        tr = self.resolver.unroll_factor
+        if(header.loop_bound != None):
+            tr = min(tr, header.loop_bound)
+
+        budget = self.resolver.max_states
+        if(budget != None):
+            spare = budget - len(self.program.blocks)
+            tr    = min(tr, 1 + spare // len(body))
+
+        return tr
+
+    def unroll(self, header, body, factor):
+        """
+        Unroll a single loop by the given factor. Returns the number of
+        states added.
+        """
+        graph  = self.program.flow_graph
+        blocks = sorted(body, key = self.program.blocks.index)
+
+        # copies[i] maps each block of the loop onto its i'th copy, where
+        # the original blocks are copy zero.
+        copies = [dict((b, b) for b in blocks)]
+        for i in range(1, factor):
+            copies.append(dict((b, self.copy_block(b, i)) for b in blocks))
+
+        # Every copy is added to the program before any flow changes are
+        # set, so that edges between the copies are indexed.
+        for i in range(1, factor):
+            for block in blocks:
+                self.program.addProgramBlock(copies[i][block])
+                graph.add_block(copies[i][block])
+
+        original = dict((b, list(b.flow_change)) for b in blocks)
+
+        for i in range(0, factor):
+            following = copies[(i + 1) % factor]
+            for block in blocks:
+                flow_change = []
+                for fc in original[block]:
+                    fc = copy.copy(fc)
+                    if(fc.to_variable):
+                        pass
+                    elif(fc.target is header):
+                        fc.target = following[header]
+                    elif(fc.target in body):
+                        fc.target = copies[i][fc.target]
+                    flow_change.append(fc)
+                graph.set_flow_change(copies[i][block], flow_change)
+
+        self.log.info("Unrolled loop '%s' of %d states %d times" %
+            (header.name, len(blocks), factor))
+
+        return (factor - 1) * len(blocks)
+
+    def unroll_program(self):
+        """
+        Unroll every suitable loop in the program. Returns the number of
+        states added.
+        """
+        added = 0
+        for header, body in self.loops():
+            factor = self.factor(header, body)
+            if(factor < 2):
+                self.log.info("Not unrolling loop '%s'" % header.name)
+                continue
+            added += self.unroll(header, body, factor)
+        return added
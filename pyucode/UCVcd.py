@@ -0,0 +1,233 @@
+
+"""
+Classes and functions for streaming value changes out of VCD waveform
+files, such as the work/waves.vcd dumped by the example testbenches.
+"""
+
+import logging
+import itertools
+import collections
+
+class UCVcdSignal(object):
+    """
+    A single variable declared in the header of a VCD file.
+    """
+
+    def __init__(self, code, name, width, scope):
+        self.code  = code
+        self.name  = name
+        self.width = width
+        self.scope = scope
+
+    def path(self):
+        """
+        Return the full dotted hierarchical name of the signal.
+        """
+        return ".".join(self.scope + [self.name])
+
+
+class UCVcdReader(object):
+    """
+    Reads a VCD file one token at a time, so that files of any size can be
+    processed in constant memory. The header is parsed when the reader is
+    opened. The value changes of a chosen set of signals are then streamed
+    out of the rest of the file by `changes`.
+    """
+
+    def __init__(self, filepath):
+        """
+        Open a VCD file and parse its header.
+        """
+        self.log       = logging.getLogger(__name__)
+        self.filepath  = filepath
+        self.signals   = []
+        self.by_code   = {}
+        self.timescale = ""
+        self.fh        = open(filepath, "r")
+        self.pending   = collections.deque()
+        self.stream    = self.tokens()
+        self.read_header()
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def tokens(self):
+        """
+        Yield every whitespace separated token in the file. Tokens of the
+        current line which have not been yielded yet are kept in pending.
+        """
+        pending = self.pending
+        while(True):
+            while(len(pending) > 0):
+                yield pending.popleft()
+            line = self.fh.readline()
+            if(line == ""):
+                return
+            pending.extend(line.split())
+
+    def read_until_end(self):
+        """
+        Return the list of tokens up to the next `$end`.
+        """
+        tr = []
+        for token in self.stream:
+            if(token == "$end"):
+                break
+            tr.append(token)
+        return tr
+
+    def read_header(self):
+        """
+        Parse the declarations at the start of the file, up to and
+        including `$enddefinitions`.
+        """
+        scope = []
+        for token in self.stream:
+            if(token == "$scope"):
+                body = self.read_until_end()
+                scope.append(body[-1] if len(body) > 0 else "")
+            elif(token == "$upscope"):
+                self.read_until_end()
+                scope.pop()
+            elif(token == "$var"):
+                body = self.read_until_end()
+                if(len(body) < 4):
+                    self.log.error("%s: Bad $var declaration: %s" %
+                        (self.filepath, " ".join(body)))
+                    continue
+                signal = UCVcdSignal(body[2], body[3], int(body[1]),
+                                     list(scope))
+                self.signals.append(signal)
+                self.by_code.setdefault(signal.code, []).append(signal)
+            elif(token == "$timescale"):
+                self.timescale = " ".join(self.read_until_end())
+            elif(token == "$enddefinitions"):
+                self.read_until_end()
+                return
+            elif(token.startswith("$")):
+                self.read_until_end()
+
+    def find(self, name, scope = None):
+        """
+        Return the first signal with the supplied name, optionally only
+        looking in the scope with the given dotted path. Returns None if
+        there is no such signal.
+        """
+        for signal in self.signals:
+            if(signal.name != name):
+                continue
+            if(scope == None or ".".join(signal.scope) == scope):
+                return signal
+        return None
+
+    def changes(self, codes):
+        """
+        Yield a tuple of (time, code, value) for every change to a signal
+        whose identifier code is in codes. Values are integers, or None if
+        any bit is x or z. Every change at one time is yielded before any
+        change at a later time. `$dumpvars` and similar blocks are treated
+        as ordinary value changes.
+
+        Lines holding a single change or timestamp, which is almost all of
+        them, are handled without going through the token stream.
+        """
+        codes    = set(codes)
+        time     = 0
+        stream   = self.stream
+        pending  = self.pending
+
+        # Changes on the same line as $enddefinitions.
+        lines    = itertools.chain([""], self.fh)
+
+        for line in lines:
+            c    = line[:1]
+            rest = line[1:].rstrip()
+            if(c == "#" and rest.isdigit()):
+                time = int(rest)
+                continue
+            elif(c != "" and c in "01xXzZ" and not " " in rest):
+                if(rest in codes):
+                    yield (time, rest, int(c) if c in "01" else None)
+                continue
+            elif(c != "" and c in "bB" and rest.count(" ") == 1):
+                digits, code = rest.split(" ")
+                if(code in codes):
+                    try:
+                        yield (time, code, int(digits, 2))
+                    except ValueError:
+                        yield (time, code, None)
+                continue
+
+            pending.extend(line.split())
+
+            while(len(pending) > 0):
+                token = next(stream)
+                c     = token[0]
+
+                if(c == "#"):
+                    time = int(token[1:])
+
+                elif(token == "$comment"):
+                    self.read_until_end()
+
+                elif(c in "01xXzZ"):
+                    code = token[1:]
+                    if(code in codes):
+                        yield (time, code, int(c) if c in "01" else None)
+
+                elif(c in "bBrR"):
+                    code = next(stream, None)
+                    if(code in codes):
+                        digits = token[1:]
+                        if(c in "rR"):
+                            yield (time, code, int(float(digits)))
+                        else:
+                            try:
+                                yield (time, code, int(digits, 2))
+                            except ValueError:
+                                yield (time, code, None)
+
+    def sample(self, signal, clock, reset = None):
+        """
+        Yield a tuple of (time, value) for each rising edge of clock,
+        where value is what signal held just before the edge. This is the
+        value a register driven by the signal captures. If an active low
+        reset signal is given, edges while it is low are skipped, as are
+        edges where the signal is x or z.
+        """
+        codes = [signal.code, clock.code]
+        if(reset != None):
+            codes.append(reset.code)
+
+        current   = None
+        value     = None
+        resetn    = None
+        in_reset  = None
+        clk       = None
+        time_seen = None
+
+        for time, code, new in self.changes(codes):
+
+            # Values seen at an earlier time are the ones which are stable
+            # when the clock rises at this time.
+            if(time != time_seen):
+                current   = value
+                in_reset  = resetn
+                time_seen = time
+
+            if(code == signal.code):
+                value = new
+            if(reset != None and code == reset.code):
+                resetn = new
+
+            if(code == clock.code):
+                if(new == 1 and clk == 0 and current != None and
+                   (reset == None or in_reset == 1)):
+                    yield (time, current)
+                clk = new
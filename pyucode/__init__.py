@@ -6,17 +6,59 @@ Top level package for the ucode compiler and generator.
 from .UCState import UCProgramVariable
 from .UCState import UCProgramVariableCollection
 
+from .UCLexer import UCSourceLine
+from .UCLexer import UCLexer
+
 from .UCInstructionStatement import UCInstructionStatement
 
 from .UCInstructions import UCInstructionArgument
 from .UCInstructions import UCInstruction
+from .UCInstructions import UCResolvedInstruction
 from .UCInstructions import UCInstructionCollection
 
 from .UCProgram import UCProgramFlowChange
 from .UCProgram import UCProgramBlock
 from .UCProgram import UCProgram
+from .UCProgram import UCStateEncodings
+
+from .UCFlowGraph import UCFlowGraph
+
+from .UCCost import UCCostModel
+
+from .UCScheduler import UCListScheduler
+
+from .UCUnroller import UCLoopUnroller
+
+from .UCThreader import UCJumpThreader
+
+from .UCIfConverter import UCIfConverter
+
+from .UCMinimiser import UCStateMinimiser
+
+from .UCAllocator import UCRegisterAllocator
+
+from .UCBinder import UCFunctionalUnit
+from .UCBinder import UCOperatorBinder
+
+from .UCVcd import UCVcdSignal
+from .UCVcd import UCVcdReader
+
+from .UCProfile import UCProfile
+from .UCProfile import UCProfileReport
+
+from .UCStats import UCPhase
+from .UCStats import UCStats
 
 from .UCResolver import UCResolver
+from .UCResolver import UCResolverError
+
+from .UCTiming import UCTimingAnalysis
+
+from .UCSimulator import UCSimulator
+from .UCSimulator import UCSimStimulus
+from .UCSimCompiler import UCSimCompiler
+from .UCSimCompiler import UCCompiledSimulator
+from .UCBatchSimulator import UCBatchSimulator
 
 from .UCTemplater import UCTemplater
 
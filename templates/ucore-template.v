@@ -27,12 +27,17 @@ input   wire aresetn
 // --------------------------------------------------------------
 // Program State Variables
 //
+{%- if flops_saved %}
+// Register sharing saved {{flops_saved}} flops.
+{%- endif %}
 
 {% for variable_name in variables.by_name | sort %}
     {%-  set variable = variables.by_name[variable_name] %} 
 
 // {{variable.description}}
-{%  if variable.isRegVar() or variable.isOutPort() %}
+{%  if variable.shares %}
+// Stored in the register of {{variable.shares.name}}.
+    {%- elif variable.isRegVar() or variable.isOutPort() %}
 
 {%-  if not variable.isOutPort() -%}
 reg  [{{variable.hi}}:{{variable.lo}}]   {{variable.name}};
@@ -59,20 +64,31 @@ assign {{variable.name}} = {{variable.comb_expr}}; // Not implemented yet.
 
 {% endfor %}
 
+{% if program.functional_units -%}
+// --------------------------------------------------------------
+// Shared functional units
+//
+{% for unit in program.functional_units %}
+// {{unit.op}} shared by {{unit.states | join(", ")}}.
+reg  [{{unit.width - 1}}:0] {{unit.lhs}};
+reg  [{{unit.rhs_width - 1}}:0] {{unit.rhs}};
+wire [{{unit.width - 1}}:0] {{unit.result}} = {{unit.lhs}} {{unit.op}} {{unit.rhs}};
+{% endfor %}
+{% endif -%}
 // --------------------------------------------------------------
 // Current and next state registers
 //
 
 //
-// State encodings.
+// State encodings ({{program.state_encoding}}).
 {%- for statename in program.synth_state_encodings() %}
-localparam {{statename[0]}} = {{statename[1]}};
+localparam [{{program.state_width - 1}}:0] {{statename[0]}} = {{program.state_width}}'d{{statename[1]}};
 {%- endfor %}
 
 //
 // Current and next state.
-reg [11:0] _current_state_;
-reg [11:0] _next_state_;
+reg [{{program.state_width - 1}}:0] _current_state_;
+reg [{{program.state_width - 1}}:0] _next_state_;
 
 
 //
@@ -98,21 +114,26 @@ always @(*) begin : _select_next_state_
 
 {% for variable_name in variables.by_name | sort %}
     {%-  set variable = variables.by_name[variable_name] -%} 
-    {%-  if variable.isRegVar() or variable.isOutPort() -%}
+    {%-  if (variable.isRegVar() or variable.isOutPort()) and not variable.shares -%}
     n_{{variable.name}} = {{variable.name}};
     {% endif %}
 {% endfor %}
     
+{%- for unit in program.functional_units %}
+    {{unit.lhs}} = {{unit.width}}'d0;
+    {{unit.rhs}} = {{unit.rhs_width}}'d0;
+{%- endfor %}
+    
     _next_state_ = {{program.get_block_state_name(program.blocks_by_name["main"])}};
 
-    case (_current_state_)
+    case ({{program.synth_state_case_select()}})
 
 {%- for block in program.blocks %}
 
         // 
         //  Block: {{block.name}}
         //
-        {{program.get_block_state_name(block)}} : begin
+        {{program.synth_state_case_label(block)}} : begin
             
             // Executed statements
             {%- for statement in program.synth_block_statements(block) %}
@@ -0,0 +1,213 @@
+"""
+Helpers shared by the tests: loading and resolving programs, driving
+simulators with repeatable random stimulus, and checking that an option of
+the resolver keeps the behaviour of a program.
+
+Options which keep every state a single cycle are compared with the
+program without them cycle by cycle. Options which change how many cycles
+the program takes are compared on the sequence of distinct values each
+output port goes through from fixed inputs.
+"""
+
+import os
+import random
+
+import pyucode as ucode
+
+# Directory of the repository the tests live in.
+ROOT     = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Names of the example programs under examples/.
+EXAMPLES = ["axi", "call", "count", "dma", "fibonacci", "memctrl", "riscv"]
+
+
+# Optimisations which change the program, for the simulators to agree on.
+ALL_PASSES = {
+    "enable_coalescing"       : True,
+    "enable_scheduling"       : True,
+    "unroll_factor"           : 2,
+    "enable_threading"        : True,
+    "enable_if_conversion"    : True,
+    "enable_minimisation"     : True,
+    "enable_register_sharing" : True,
+}
+
+
+def example_path(name):
+    """
+    Return the path of the program file of an example.
+    """
+    return os.path.join(ROOT, "examples", name, "%s-program.txt" % name)
+
+
+def program_path(name):
+    """
+    Return the path of a program file under tests/programs.
+    """
+    return os.path.join(ROOT, "tests", "programs", name)
+
+
+# Every program the tests run: the examples, then those under tests/programs.
+PROGRAMS = [example_path(e) for e in EXAMPLES] + [
+    program_path("select-program.txt"),
+    program_path("ifconvert-program.txt"),
+    program_path("share-program.txt"),
+    program_path("return-program.txt"),
+]
+
+
+def program_id(path):
+    """
+    Return the short name of a program for naming parameterised tests.
+    """
+    return os.path.basename(path).replace("-program.txt", "")
+
+
+def load(path, **options):
+    """
+    Parse and resolve the program at path, and return the resolver. Any
+    keyword arguments are set as attributes of the resolver first, so
+    `enable_coalescing = True` turns coalescing on.
+    """
+    program = ucode.UCProgram()
+    program.parseSource(path)
+
+    resolver = ucode.UCResolver()
+    resolver.addVariables(program.variables)
+    resolver.addInstructions(program.instructions)
+    resolver.addProgram(program)
+    for name, value in options.items():
+        setattr(resolver, name, value)
+    resolver.resolve()
+    return resolver
+
+
+def random_inputs(sim, rng):
+    """
+    Return a dict of a random value for every input port of a simulator.
+    """
+    return dict((v.name, rng.getrandbits(v.width)) for v in sim.inputs)
+
+
+def random_stimulus(seed, every = 3):
+    """
+    Return a stimulus callback which drives random values onto every input
+    port once every few cycles.
+    """
+    rng = random.Random(seed)
+    def stimulus(cycle, sim):
+        if(cycle % every == 0):
+            return random_inputs(sim, rng)
+        return None
+    return stimulus
+
+
+def run_together(a, b, cycles):
+    """
+    Step two scalar simulators of the same program side by side. Returns
+    None if they agree on the state and every variable after each cycle,
+    or a message describing the first cycle they differ on.
+    """
+    for cycle in range(0, cycles):
+        a.step()
+        b.step()
+        if(a.state != b.state or a.values != b.values):
+            diff = dict((n, (a.values[n], b.values.get(n, None)))
+                        for n in a.values if a.values[n] != b.values.get(n))
+            return "cycle %d: states %s/%s, values %s" % (cycle, a.state,
+                b.state, diff)
+    return None
+
+
+# Resolver options each pass is checked on top of.
+BASES = [
+    {},
+    {"enable_coalescing": True},
+    {"enable_coalescing": True, "enable_scheduling": True},
+]
+
+
+def outputs(sim):
+    """
+    Return a tuple of the output port values of a simulator.
+    """
+    return tuple(sim.values[v.name] for v in sim.outputs)
+
+
+def cycle_trace(resolver, seed, blocks, cycles = 1500, every = 7):
+    """
+    Return a list of the output port values after every cycle, with random
+    inputs changing every few cycles. If blocks is True, the name of the
+    current block is recorded along with them.
+    """
+    sim = ucode.UCCompiledSimulator(resolver)
+    rng = random.Random(seed)
+    tr  = []
+    for cycle in range(0, cycles):
+        if(cycle % every == 0):
+            sim.set_inputs(random_inputs(sim, rng))
+        sim.step()
+        block = sim.current_block() if blocks else None
+        tr.append((outputs(sim), block.name if block != None else None))
+    return tr
+
+
+def output_sequences(resolver, inputs, cycles = 3000):
+    """
+    Return a dict mapping each output port onto the list of distinct
+    values it goes through in the given number of cycles, with the inputs
+    of the program held at fixed values. Ports are followed on their own,
+    since a pass may move writes to different ports into the same cycle.
+    """
+    sim = ucode.UCCompiledSimulator(resolver)
+    sim.set_inputs(inputs)
+    tr  = dict((v.name, [sim.values[v.name]]) for v in sim.outputs)
+    for cycle in range(0, cycles):
+        sim.step()
+        for name, seen in tr.items():
+            if(seen[-1] != sim.values[name]):
+                seen.append(sim.values[name])
+    return tr
+
+
+def fixed_inputs(resolver, seed):
+    """
+    Return a dict of random values for the input ports of a program.
+    """
+    rng    = random.Random(seed)
+    inputs = random_inputs(ucode.UCSimulator(resolver), rng)
+    if("n" in inputs):
+        # Keep fibonacci's loop short enough to finish.
+        inputs["n"] = 20 + seed
+    return inputs
+
+
+def check_same_cycles(path, base, option, blocks = False):
+    """
+    Fail if enabling the options in option on top of base changes the
+    outputs in any cycle, or with blocks, the name of the block run.
+    """
+    before = load(path, **base)
+    after  = load(path, **dict(base, **option))
+    for seed in range(0, 2):
+        assert cycle_trace(before, seed, blocks) == \
+               cycle_trace(after, seed, blocks)
+
+
+def check_same_outputs(path, base, option):
+    """
+    Fail if enabling the options in option on top of base changes the
+    sequence of distinct values any output port goes through. These passes
+    only ever take cycles away, so the optimised program must get at least
+    as far as the original, whose last value may have been cut off part
+    way through and is not compared.
+    """
+    before = load(path, **base)
+    after  = load(path, **dict(base, **option))
+    for seed in range(0, 3):
+        inputs = fixed_inputs(before, seed)
+        a = output_sequences(before, inputs)
+        b = output_sequences(after, inputs)
+        for name in a:
+            common = len(a[name]) - 1
+            assert a[name][:common] == b[name][:common], name
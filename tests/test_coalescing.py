@@ -0,0 +1,33 @@
+"""
+Checks that coalescing blocks into states keeps the behaviour of a program.
+"""
+
+import pytest
+
+from tests.common import PROGRAMS, program_id, example_path, load
+from tests.common import check_same_outputs
+
+
+@pytest.mark.parametrize("path", PROGRAMS, ids = program_id)
+def test_coalescing(path):
+    check_same_outputs(path, {}, {"enable_coalescing": True})
+
+
+@pytest.mark.parametrize("path", PROGRAMS, ids = program_id)
+def test_coalescing_after_unreachable_removal(path):
+    check_same_outputs(path, {"enable_unreachable_removal": True},
+                       {"enable_coalescing": True})
+
+
+@pytest.mark.parametrize("budget", [2, 6])
+@pytest.mark.parametrize("path", PROGRAMS, ids = program_id)
+def test_cost_bounded_coalescing(path, budget):
+    check_same_outputs(path, {}, {"enable_coalescing": True,
+                                  "max_cycle_cost": budget})
+
+
+def test_cost_bound_limits_merging():
+    path      = example_path("axi")
+    unbounded = load(path, enable_coalescing = True)
+    bounded   = load(path, enable_coalescing = True, max_cycle_cost = 2)
+    assert len(bounded.program.blocks) > len(unbounded.program.blocks)
@@ -0,0 +1,21 @@
+"""
+Checks that if-conversion keeps the behaviour of a program.
+"""
+
+import pytest
+
+from tests.common import PROGRAMS, BASES, program_path, program_id, load
+from tests.common import check_same_outputs
+
+
+@pytest.mark.parametrize("base", BASES[1:])
+@pytest.mark.parametrize("path", PROGRAMS, ids = program_id)
+def test_if_conversion(path, base):
+    check_same_outputs(path, base, {"enable_if_conversion": True})
+
+
+def test_if_conversion_merges_diamond():
+    path   = program_path("ifconvert-program.txt")
+    before = load(path, enable_coalescing = True)
+    after  = load(path, enable_coalescing = True, enable_if_conversion = True)
+    assert len(after.program.blocks) < len(before.program.blocks)
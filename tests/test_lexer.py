@@ -0,0 +1,28 @@
+"""
+Checks the line lexer shared by the program and instruction parsers.
+"""
+
+import pyucode as ucode
+
+
+def test_lines_words_and_locations(tmp_path):
+    path = tmp_path / "program.txt"
+    path.write_text("\n  reg  a [7:0]\n\n// A comment\nblock\tmain\n")
+
+    lines = list(ucode.UCLexer(str(path)))
+    assert [l.number for l in lines] == [2, 4, 5]
+    assert lines[0].words == ["reg", "a", "[7:0]"]
+    assert lines[0].text == "reg a [7:0]"
+    assert lines[0].columns == [3, 8, 10]
+    assert lines[0].location(2) == "%s:2:10" % path
+    assert lines[1].is_comment()
+    assert lines[2].words == ["block\tmain"]
+
+
+def test_parse_error_location(tmp_path, caplog):
+    path = tmp_path / "program.txt"
+    path.write_text("reg a [7:0]\n\nblock main\n    bound x\n")
+
+    ucode.UCProgram().parseSource(str(path))
+    assert "%s:4:11: Loop bound should be a positive integer" % path in \
+        caplog.text
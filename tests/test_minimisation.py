@@ -0,0 +1,40 @@
+"""
+Checks that state minimisation keeps the behaviour of a program.
+"""
+
+import pytest
+
+from tests.common import PROGRAMS, BASES, program_id, program_path, load
+from tests.common import check_same_cycles
+
+
+@pytest.mark.parametrize("base", BASES)
+@pytest.mark.parametrize("path", PROGRAMS, ids = program_id)
+def test_minimisation(path, base):
+    check_same_cycles(path, base, {"enable_minimisation": True})
+
+
+def test_minimisation_splits_long_chains(tmp_path):
+    # Chains a and b are the same and merge. Chain c only differs from them
+    # in its last state, which splits it from the others one state at a
+    # time, working back to the first.
+    lines = ['using instructions "%s"' % program_path("return-instrs.txt"),
+             "output reg where [7:0]",
+             "reg x [1:0]",
+             "reg y [7:0]",
+             "block main", "inc x 1", "ifeqz x a0", "goto b0"]
+    for chain, where, after in [("a", 1, "c0"), ("b", 1, "c0"),
+                                ("c", 2, "main")]:
+        for i in range(6):
+            lines += ["block %s%d" % (chain, i), "inc y 1"]
+            lines += ["goto %s%d" % (chain, i + 1)] if i < 5 else \
+                     ["set where %d" % where, "goto %s" % after]
+    path = tmp_path / "chains-program.txt"
+    path.write_text("\n".join(lines) + "\n")
+
+    before   = load(str(path))
+    resolver = load(str(path), enable_minimisation = True)
+    names    = [b.name for b in resolver.program.blocks]
+    assert names == [b.name for b in before.program.blocks
+                     if not b.name.startswith("b")]
+    check_same_cycles(str(path), {}, {"enable_minimisation": True})
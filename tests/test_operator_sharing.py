@@ -0,0 +1,106 @@
+"""
+Checks that statements which read shared operators compute the same
+values as the statements they came from.
+"""
+
+import copy
+import random
+
+import pytest
+
+import pyucode as ucode
+
+from pyucode.UCState import UCProgramVariable, UCTypePortNone, UCTypeVarReg
+from pyucode.UCInstructionStatement import UCExprIdentifier, UCExprBinary
+
+from tests.common import program_path, load
+
+
+def unit_variables(bindings):
+    """
+    Return a dict of program variables standing for the operand and result
+    registers of every functional unit in a statement's bindings.
+    """
+    tr = {}
+    for node, unit in bindings:
+        for name, width in ((unit.lhs, unit.width), (unit.rhs, unit.rhs_width),
+                            (unit.result, unit.width)):
+            tr[name] = UCProgramVariable(name, UCTypePortNone, UCTypeVarReg,
+                                         width - 1, 0)
+    return tr
+
+
+def execute_shared(evaluator, statement, bindings, names, values, nxt):
+    """
+    Execute a statement whose bound operators read the results of shared
+    functional units, working out the operands and results of the units
+    from the current values first.
+    """
+    replace = dict((node, UCExprIdentifier(unit.result))
+                   for node, unit in bindings)
+    values  = dict(values)
+
+    # Units may read the results of other units, so go round once for each.
+    for i in range(0, len(bindings)):
+        for node, unit in bindings:
+            for side, name, width in ((node.lhs, unit.lhs, unit.width),
+                                      (node.rhs, unit.rhs, unit.rhs_width)):
+                expr  = side.replaced(replace)
+                width = max(width, evaluator.width(expr, names, values))
+                values[name] = evaluator.evaluate(expr, width,
+                    evaluator.is_signed(expr, names), names, values) & \
+                    ((1 << width) - 1)
+            y = UCExprBinary(unit.op, UCExprIdentifier(unit.lhs),
+                             UCExprIdentifier(unit.rhs))
+            values[unit.result] = evaluator.evaluate(y, unit.width, False,
+                                                     names, values)
+
+    shared     = copy.copy(statement)
+    shared.rhs = statement.rhs.replaced(replace)
+    evaluator.execute(shared, names, values, nxt)
+
+
+@pytest.mark.parametrize("base", [
+    {},
+    {"enable_coalescing": True},
+    {"enable_coalescing": True, "enable_if_conversion": True,
+     "max_predicated_statements": 4, "enable_scheduling": True},
+])
+def test_operator_sharing(base):
+    # Every statement which reads a shared unit must compute the same next
+    # values as the statement it came from, for random current values.
+    resolver  = load(program_path("operators-program.txt"),
+                     enable_operator_sharing = True, share_min_cost = 3,
+                     **base)
+    sim       = ucode.UCSimulator(resolver)
+    evaluator = sim.evaluator
+    variables = resolver.variables.by_index
+    rng       = random.Random(1)
+    checked   = 0
+
+    for block in resolver.program.blocks:
+        for instr in block.statements:
+            if(len(instr.bindings) == 0):
+                continue
+            names = dict(sim.bind(instr))
+            for bindings in instr.bindings.values():
+                names.update(unit_variables(bindings))
+
+            for trial in range(0, 100):
+                values = dict((v.name, rng.getrandbits(v.width))
+                              for v in variables)
+                values[sim.state_var.name] = 0
+                for i, statement in enumerate(instr.statements):
+                    bindings = instr.bindings.get(i, [])
+                    if(len(bindings) == 0):
+                        continue
+                    plain  = dict((v.name, values[v.name]) for v in variables)
+                    shared = dict(plain)
+                    evaluator.execute(statement, names, values, plain)
+                    execute_shared(evaluator, statement, bindings, names,
+                                   values, shared)
+                    assert plain == shared, "%s in %s" % (statement.src,
+                                                          block.name)
+                    checked += 1
+
+    assert checked > 0
@@ -0,0 +1,14 @@
+"""
+Checks that register sharing keeps the behaviour of a program.
+"""
+
+import pytest
+
+from tests.common import PROGRAMS, BASES, program_id
+from tests.common import check_same_cycles
+
+
+@pytest.mark.parametrize("base", BASES)
+@pytest.mark.parametrize("path", PROGRAMS, ids = program_id)
+def test_register_sharing(path, base):
+    check_same_cycles(path, base, {"enable_register_sharing": True}, True)
@@ -0,0 +1,33 @@
+"""
+Checks that list scheduling keeps the behaviour of a program.
+"""
+
+import pytest
+
+import pyucode as ucode
+
+from tests.common import PROGRAMS, program_path, program_id, load
+from tests.common import check_same_outputs
+
+
+@pytest.mark.parametrize("base", [{}, {"enable_coalescing": True}])
+@pytest.mark.parametrize("path", PROGRAMS, ids = program_id)
+def test_scheduling(path, base):
+    check_same_outputs(path, base, {"enable_scheduling": True})
+
+
+@pytest.mark.parametrize("options", [
+    {"enable_scheduling": True},
+    {"enable_scheduling": True, "enable_coalescing": True},
+])
+def test_jump_sees_return_address(options):
+    # A block which sets a return address and then jumps to it must not
+    # have the write packed into the state which evaluates the jump.
+    resolver = load(program_path("return-program.txt"), **options)
+    sim      = ucode.UCCompiledSimulator(resolver)
+    seen     = []
+    for cycle in range(0, 40):
+        sim.step()
+        if(len(seen) == 0 or seen[-1] != sim.values["where"]):
+            seen.append(sim.values["where"])
+    assert seen[:6] == [1, 2, 3, 1, 2, 3]
@@ -0,0 +1,74 @@
+"""
+Checks the compiled simulator against the interpreter it mirrors, cycle by
+cycle, on the examples and on programs which exercise corner cases.
+"""
+
+import pytest
+
+import pyucode as ucode
+
+from tests.common import EXAMPLES, PROGRAMS, ALL_PASSES, example_path
+from tests.common import program_path, program_id, load
+from tests.common import random_stimulus, run_together
+
+# Resolver options each program is checked with.
+OPTIONS = [
+    {},
+    {"enable_coalescing": True, "enable_scheduling": True},
+    ALL_PASSES,
+]
+
+
+def check_compiled(path, options, cycles = 3000, seed = 7):
+    """
+    Run the interpreter and the compiled simulator of a program together
+    with the same random inputs, and fail on the first difference.
+    """
+    resolver = load(path, **options)
+    a = ucode.UCSimulator(resolver)
+    b = ucode.UCCompiledSimulator(resolver)
+    a.stimulus = random_stimulus(seed)
+    b.stimulus = random_stimulus(seed)
+    message = run_together(a, b, cycles)
+    assert message == None, message
+
+
+@pytest.mark.parametrize("options", OPTIONS)
+@pytest.mark.parametrize("path", PROGRAMS, ids = program_id)
+def test_compiled_matches_interpreter(path, options):
+    check_compiled(path, options)
+
+
+def test_variable_select_assign_values():
+    # Uncoalesced, each pass round main and pair takes four cycles, so
+    # every bit of r is set once within 32 cycles.
+    resolver = load(program_path("select-program.txt"))
+    for sim in (ucode.UCSimulator(resolver),
+                ucode.UCCompiledSimulator(resolver)):
+        sim.stimulus = lambda c, s: {"inp": (c // 4) % 8, "sel": 15}
+        sim.run(40)
+        assert sim.values["r"] == 0xff
+
+
+@pytest.mark.parametrize("example", EXAMPLES)
+def test_compiled_run_matches_interpreter(example):
+    # UCCompiledSimulator.run has its own loop, rather than calling step.
+    resolver = load(example_path(example), enable_coalescing = True)
+    sims     = [ucode.UCSimulator(resolver),
+                ucode.UCCompiledSimulator(resolver)]
+    for sim in sims:
+        sim.stimulus = random_stimulus(3)
+        assert sim.run(2000) == 2000
+    assert sims[0].cycle == sims[1].cycle
+    assert sims[0].state == sims[1].state
+    assert sims[0].values == sims[1].values
+
+
+def test_compiled_run_until():
+    resolver = load(example_path("fibonacci"), enable_coalescing = True)
+    for sim in (ucode.UCSimulator(resolver),
+                ucode.UCCompiledSimulator(resolver)):
+        sim.stimulus = lambda c, s: {"n": 20, "valid": 1} if c == 0 else None
+        cycles = sim.run(10000, until = lambda s: s.values["done"] == 1)
+        assert cycles == 64
+        assert sim.values["result"] == 6765
@@ -0,0 +1,44 @@
+"""
+Checks that the state encodings keep the behaviour of a program.
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+import pyucode as ucode
+
+from tests.common import PROGRAMS, BASES, ROOT, program_id, load
+from tests.common import example_path, check_same_cycles
+
+
+@pytest.mark.parametrize("encoding", ["onehot", "gray"])
+@pytest.mark.parametrize("base", BASES[:2])
+@pytest.mark.parametrize("path", PROGRAMS, ids = program_id)
+def test_state_encoding(path, base, encoding):
+    try:
+        load(path, **dict(base, state_encoding = encoding))
+    except ucode.UCResolverError as e:
+        # A return address narrower than the state register, see
+        # test_narrow_state_variable_fails.
+        pytest.skip(str(e))
+    check_same_cycles(path, base, {"state_encoding": encoding}, True)
+
+
+def test_narrow_state_variable_fails(tmp_path):
+    # axi keeps return addresses in variables which fit a binary state
+    # number, but not one bit per state.
+    load(example_path("axi"))
+    with pytest.raises(ucode.UCResolverError):
+        load(example_path("axi"), state_encoding = "onehot")
+
+    def compile(encoding):
+        return subprocess.run([sys.executable, "compile.py",
+            "--state-encoding", encoding,
+            "--output", str(tmp_path / ("%s.v" % encoding)),
+            example_path("axi")], cwd = ROOT,
+            stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+    assert compile("binary").returncode == 0
+    assert compile("onehot").returncode != 0
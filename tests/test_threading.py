@@ -0,0 +1,14 @@
+"""
+Checks that jump threading keeps the behaviour of a program.
+"""
+
+import pytest
+
+from tests.common import PROGRAMS, BASES, program_id
+from tests.common import check_same_outputs
+
+
+@pytest.mark.parametrize("base", BASES)
+@pytest.mark.parametrize("path", PROGRAMS, ids = program_id)
+def test_threading(path, base):
+    check_same_outputs(path, base, {"enable_threading": True})